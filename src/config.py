@@ -25,6 +25,10 @@ class ConfigManager:
                     "enabled": False,
                     "port": 9999,
                     "host": "0.0.0.0",
+                    "backup_keep": 5,
+                    "backup_keep_daily": 7,
+                    "engine": "pooled",
+                    "allow_upload": False,
                 }
                 }
         self.config = self.load_config()
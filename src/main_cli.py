@@ -342,6 +342,13 @@ class SillyTavernCliLauncher:
         try:
             # Import sync_server module
             from sync_server import SyncServer
+            from sync_daemon import daemon_pid
+
+            # The daemon shares the index and ZIP cache, never run both
+            pid = daemon_pid(os.getcwd())
+            if pid is not None:
+                print(f"同步守护进程已在运行 (PID {pid})，请先停止后再启动")
+                return False
 
             # Get SillyTavern data path
             data_path = os.path.join(os.getcwd(), "SillyTavern", "data", "default-user")
@@ -357,7 +364,9 @@ class SillyTavernCliLauncher:
             self.sync_server = SyncServer(
                 data_path=data_path,
                 port=port,
-                host=host
+                host=host,
+                engine=self.config_manager.get("sync.engine", "pooled"),
+                allow_upload=self.config_manager.get("sync.allow_upload", False)
             )
 
             # Start server in background
@@ -392,16 +401,24 @@ class SillyTavernCliLauncher:
             return False
 
     def get_sync_server_status(self):
-        """获取同步服务器的真实状态"""
-        is_running = self.sync_server is not None and self.sync_server.running
+        """获取同步服务器的真实状态 (包括后台守护进程)"""
+        from sync_daemon import daemon_pid, send_command
+
+        daemon = send_command(os.getcwd(), 'status', timeout=2)
+        if daemon is not None and not daemon.get('success'):
+            daemon = None
+        # A busy daemon may not answer in time, the pidfile still shows it
+        daemon_running = daemon is not None or daemon_pid(os.getcwd()) is not None
+        is_running = daemon_running or (self.sync_server is not None and self.sync_server.running)
         config_enabled = self.config_manager.get("sync.enabled", False)
 
         return {
             "running": is_running,
+            "daemon": daemon_running,
             "config_enabled": config_enabled,
             "consistent": is_running == config_enabled,
-            "port": self.config_manager.get("sync.port", 9999),
-            "host": self.config_manager.get("sync.host", "0.0.0.0")
+            "port": daemon['port'] if daemon else self.config_manager.get("sync.port", 9999),
+            "host": daemon['host'] if daemon else self.config_manager.get("sync.host", "0.0.0.0")
         }
 
     def sync_config_with_actual_state(self):
@@ -424,7 +441,100 @@ class SillyTavernCliLauncher:
         else:
             print("数据同步服务未运行")
 
-    def sync_from_server(self, server_url, method='auto', backup=True):
+    def start_sync_daemon(self, port=None, host='0.0.0.0'):
+        """在后台守护进程中启动数据同步服务器 (关闭启动器后继续运行)"""
+        from sync_daemon import start_daemon
+
+        if self.sync_server is not None and self.sync_server.running:
+            print("同步服务器已在启动器内运行，请先停止后再启动守护进程")
+            return False
+
+        data_path = os.path.join(os.getcwd(), "SillyTavern", "data", "default-user")
+        if not os.path.exists(data_path):
+            print(f"错误: SillyTavern 数据目录不存在: {data_path}")
+            return False
+
+        if port is None:
+            port = self.config_manager.get("sync.port", 9999)
+
+        status = start_daemon(
+            data_path, port, host,
+            engine=self.config_manager.get("sync.engine", "pooled"),
+            run_dir=os.getcwd()
+        )
+        if status is None:
+            print("启动同步守护进程失败")
+            return False
+
+        local_ip = self._get_local_ip()
+        print(f"数据同步守护进程已启动 (PID {status['pid']})")
+        print(f"服务器地址: http://{local_ip}:{status['port']}")
+        print(f"本地地址: http://localhost:{status['port']}")
+        print(f"数据路径: {status['data_path']}")
+        if status.get('indexing'):
+            print("正在建立文件索引，完成后开始提供服务")
+        print("使用 'st sync status' 查看状态, 'st sync stop' 停止服务")
+
+        self.config_manager.set("sync.enabled", True)
+        self.config_manager.set("sync.port", status['port'])
+        self.config_manager.set("sync.host", status['host'])
+        self.config_manager.save_config()
+        return True
+
+    def stop_sync_daemon(self):
+        """停止后台同步守护进程"""
+        from sync_daemon import stop_daemon
+
+        if stop_daemon(os.getcwd()):
+            print("数据同步守护进程已停止")
+        else:
+            print("数据同步守护进程未运行")
+        self.config_manager.set("sync.enabled", False)
+        self.config_manager.save_config()
+
+    def show_sync_daemon_status(self, command='status'):
+        """显示同步守护进程状态 (command='reload' 时先重新加载配置并重新扫描)"""
+        from sync_daemon import send_command
+
+        status = send_command(os.getcwd(), command, timeout=120)
+        if status is None:
+            print("数据同步守护进程未运行")
+            return False
+        if not status.get('success'):
+            print(f"操作失败: {status.get('error')}")
+            return False
+
+        if command == 'reload':
+            print("已重新加载同步守护进程配置")
+        print(f"  进程 PID: {status['pid']}")
+        print(f"  监听地址: {status['host']}:{status['port']} (引擎: {status['engine']})")
+        print(f"  数据路径: {status['data_path']}")
+        print(f"  运行时间: {status['uptime']} 秒")
+        if status.get('indexing'):
+            print("  文件索引: 正在建立，完成后开始提供服务")
+            return True
+        print(f"  文件数量: {status['file_count']}")
+        print(f"  数据大小: {status['total_size'] / 1024 / 1024:.1f}MB")
+        print(f"  文件监控: {'inotify' if status['watching'] else '按需扫描'}")
+        return True
+
+    def watch_server(self, server_url, jobs=4):
+        """持续监听服务器变更，并实时应用到本地数据"""
+        try:
+            from sync_client import SyncClient
+
+            data_path = os.path.join(os.getcwd(), "SillyTavern", "data", "default-user")
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            client = SyncClient(server_url, data_path, jobs=jobs)
+            return client.watch()
+        except KeyboardInterrupt:
+            print("\n已停止监听服务器变更")
+            return True
+        except Exception as e:
+            print(f"监听服务器变更失败: {e}")
+            return False
+
+    def sync_from_server(self, server_url, method='auto', backup=True, jobs=4, dry_run=False):
         """从远程服务器同步数据"""
         try:
             # Import sync_client module
@@ -435,7 +545,9 @@ class SillyTavernCliLauncher:
             os.makedirs(os.path.dirname(data_path), exist_ok=True)
 
             # Initialize sync client
-            client = SyncClient(server_url, data_path)
+            client = SyncClient(server_url, data_path, jobs=jobs)
+            client.backup_keep_last = self.config_manager.get("sync.backup_keep", 5)
+            client.backup_keep_daily = self.config_manager.get("sync.backup_keep_daily", 7)
 
             # Check server health first
             if not client.check_server_health():
@@ -452,8 +564,10 @@ class SillyTavernCliLauncher:
 
             # Perform sync
             print(f"开始从服务器同步: {server_url}")
-            success = client.sync(prefer_zip=(method == 'auto' or method == 'zip'), backup=backup)
+            success = client.sync(method=method, backup=backup, dry_run=dry_run)
 
+            if dry_run:
+                return success
             if success:
                 print("数据同步完成!")
                 return True
@@ -478,7 +592,65 @@ class SillyTavernCliLauncher:
             # Fallback to common local IPs
             return "127.0.0.1"
 
-    
+    def _check_sync_server(self, server_url):
+        """测试同步服务器是否可用，并显示延迟"""
+        from sync_discovery import probe_server
+
+        result = probe_server(server_url, timeout=3)
+        if result is None:
+            return False
+        print(f"  延迟: {result['latency'] * 1000:.0f} ms")
+        return True
+
+    def scan_sync_servers(self, port=None):
+        """扫描局域网中的同步服务器，并可选择保存到服务器列表"""
+        from sync_discovery import discover
+
+        if port is None:
+            port = self.config_manager.get("sync.port", 9999)
+        print(f"正在扫描局域网同步服务器 (端口 {port})...")
+        started = time.monotonic()
+        servers = discover(port=port)
+        print(f"扫描完成，用时 {time.monotonic() - started:.1f} 秒")
+
+        if not servers:
+            print("未发现同步服务器")
+            return []
+
+        saved_servers = self.config_manager.get("sync.saved_servers", [])
+        print(f"发现 {len(servers)} 个同步服务器 (按延迟排序):")
+        for i, server in enumerate(servers, 1):
+            name = f" [{server['name']}]" if server.get('name') else ""
+            saved = " (已保存)" if server['url'] in saved_servers else ""
+            print(f"{i}. {server['url']}{name} - {server['latency'] * 1000:.0f} ms{saved}")
+            if server.get('data_path'):
+                print(f"   数据路径: {server['data_path']}")
+
+        choice = input("输入要保存的服务器编号 (多个用逗号分隔，a=全部，回车跳过): ").strip().lower()
+        if not choice:
+            return servers
+        if choice == 'a':
+            selected = servers
+        else:
+            selected = []
+            for part in choice.split(','):
+                part = part.strip()
+                if part.isdigit() and 1 <= int(part) <= len(servers):
+                    selected.append(servers[int(part) - 1])
+                elif part:
+                    print(f"忽略无效编号: {part}")
+
+        added = [server['url'] for server in selected if server['url'] not in saved_servers]
+        if added:
+            saved_servers.extend(added)
+            self.config_manager.set("sync.saved_servers", saved_servers)
+            self.config_manager.save_config()
+            for url in added:
+                print(f"已保存: {url}")
+        else:
+            print("没有新的服务器需要保存")
+        return servers
+
     def _connect_and_sync(self, server_url):
         """连接到服务器并执行同步"""
         try:
@@ -499,22 +671,24 @@ class SillyTavernCliLauncher:
             sync_choice = input("是否从此服务器同步数据？(Y/n): ").strip()
             if sync_choice.lower() != 'n':
                 print("请选择同步方法:")
-                print("1. 自动 (优先ZIP，失败后增量)")
+                print("1. 自动 (根据变更量选择更快的方式)")
                 print("2. ZIP全量同步")
                 print("3. 增量同步")
-                method_choice = input("请选择 [1-3]: ").strip()
+                print("4. 双向同步 (同时上传本地修改，冲突时保留副本)")
+                method_choice = input("请选择 [1-4]: ").strip()
 
                 method_map = {
                     "1": "auto",
                     "2": "zip",
-                    "3": "incremental"
+                    "3": "incremental",
+                    "4": "twoway"
                 }
                 method = method_map.get(method_choice, "auto")
 
                 backup_choice = input("是否备份现有数据？(Y/n): ").strip()
                 backup = backup_choice.lower() != 'n'
 
-                success = client.sync(prefer_zip=(method == 'auto' or method == 'zip'), backup=backup)
+                success = client.sync(method=method, backup=backup)
                 if success:
                     print("同步完成!")
                 else:
@@ -524,8 +698,12 @@ class SillyTavernCliLauncher:
             print(f"连接或同步失败: {e}")
 
     def _manage_saved_servers(self):
-        """管理已保存的服务器列表"""
+        """管理已保存的服务器列表 (打开时并发检测所有服务器)"""
+        from sync_discovery import probe_servers
+
         saved_servers = self.config_manager.get("sync.saved_servers", [])
+        probes = []
+        probed_for = None
 
         while True:
             print("\n" + "="*40)
@@ -535,22 +713,44 @@ class SillyTavernCliLauncher:
             if not saved_servers:
                 print("暂无已保存的服务器")
                 print("可以通过扫描服务器并选择保存来添加")
-                input("按Enter返回...")
-                return
-
-            for i, server_url in enumerate(saved_servers, 1):
-                print(f"{i}. {server_url}")
+                if input("是否现在扫描局域网？(Y/n): ").strip().lower() == 'n':
+                    return
+                self.scan_sync_servers()
+                saved_servers = self.config_manager.get("sync.saved_servers", [])
+                if not saved_servers:
+                    return
+                continue
+
+            if probed_for != saved_servers:
+                print(f"正在检测 {len(saved_servers)} 个服务器...")
+                probes = probe_servers(saved_servers)
+                probed_for = list(saved_servers)
+
+            # Numbered by reachability and latency
+            ordered = [probe['url'] for probe in probes]
+            fastest = probes[0]['url'] if probes and probes[0]['reachable'] else None
+            for i, probe in enumerate(probes, 1):
+                if not probe['reachable']:
+                    print(f"{i}. {probe['url']} - ✗ 无法连接")
+                    continue
+                details = f"延迟 {probe['latency'] * 1000:.0f} ms"
+                if probe['file_count'] is not None:
+                    details += (f", {probe['file_count']} 个文件"
+                                f", {probe['total_size'] / 1024 / 1024:.1f}MB")
+                print(f"{i}. {probe['url']} - ✓ {details}")
 
             print("\n选项:")
             print("1. 连接并同步")
             print("2. 测试连接")
             print("3. 删除服务器")
             print("4. 清空列表")
+            print("5. 扫描局域网并添加")
+            print("6. 重新检测")
             print("0. 返回")
             print("="*40)
 
             try:
-                choice = input("请选择操作 [0-4]: ").strip()
+                choice = input("请选择操作 [0-6]: ").strip()
 
                 if choice == "0":
                     break
@@ -559,11 +759,19 @@ class SillyTavernCliLauncher:
                     continue
 
                 if choice == "1":
-                    # 连接并同步
+                    # 连接并同步，直接回车使用延迟最低的可用服务器
                     try:
-                        server_choice = input(f"请选择服务器编号 [1-{len(saved_servers)}]: ").strip()
-                        if server_choice.isdigit() and 1 <= int(server_choice) <= len(saved_servers):
-                            selected_server = saved_servers[int(server_choice) - 1]
+                        if fastest:
+                            prompt = f"请选择服务器编号 [1-{len(ordered)}] (回车使用最快的 {fastest}): "
+                        else:
+                            prompt = f"请选择服务器编号 [1-{len(ordered)}]: "
+                        server_choice = input(prompt).strip()
+                        if not server_choice and fastest:
+                            self._connect_and_sync(fastest)
+                        elif not server_choice:
+                            print("没有可连接的服务器")
+                        elif server_choice.isdigit() and 1 <= int(server_choice) <= len(ordered):
+                            selected_server = ordered[int(server_choice) - 1]
                             self._connect_and_sync(selected_server)
                         else:
                             print("无效的服务器编号")
@@ -573,9 +781,9 @@ class SillyTavernCliLauncher:
                 elif choice == "2":
                     # 测试连接
                     try:
-                        server_choice = input(f"请选择服务器编号 [1-{len(saved_servers)}]: ").strip()
-                        if server_choice.isdigit() and 1 <= int(server_choice) <= len(saved_servers):
-                            selected_server = saved_servers[int(server_choice) - 1]
+                        server_choice = input(f"请选择服务器编号 [1-{len(ordered)}]: ").strip()
+                        if server_choice.isdigit() and 1 <= int(server_choice) <= len(ordered):
+                            selected_server = ordered[int(server_choice) - 1]
                             print(f"正在测试连接: {selected_server}")
                             if self._check_sync_server(selected_server):
                                 print("✓ 连接成功!")
@@ -589,9 +797,9 @@ class SillyTavernCliLauncher:
                 elif choice == "3":
                     # 删除服务器
                     try:
-                        server_choice = input(f"请选择要删除的服务器编号 [1-{len(saved_servers)}]: ").strip()
-                        if server_choice.isdigit() and 1 <= int(server_choice) <= len(saved_servers):
-                            selected_server = saved_servers[int(server_choice) - 1]
+                        server_choice = input(f"请选择要删除的服务器编号 [1-{len(ordered)}]: ").strip()
+                        if server_choice.isdigit() and 1 <= int(server_choice) <= len(ordered):
+                            selected_server = ordered[int(server_choice) - 1]
                             confirm = input(f"确认删除 '{selected_server}'? (y/N): ").strip()
                             if confirm.lower() == 'y':
                                 saved_servers.remove(selected_server)
@@ -616,8 +824,15 @@ class SillyTavernCliLauncher:
                     else:
                         print("取消清空")
 
+                elif choice == "5":
+                    self.scan_sync_servers()
+                    saved_servers = self.config_manager.get("sync.saved_servers", [])
+
+                elif choice == "6":
+                    probed_for = None
+
                 else:
-                    print("无效选择，请输入 0-4 之间的数字")
+                    print("无效选择，请输入 0-6 之间的数字")
 
             except (ValueError, KeyboardInterrupt):
                 print("\n操作取消")
@@ -669,16 +884,17 @@ class SillyTavernCliLauncher:
                 if status["consistent"]:
                     option_num = 7
                 print(f"{option_num}. 已保存的服务器列表")
+            print("9. 扫描局域网同步服务器")
             print("0. 返回主菜单")
             print("="*50)
 
             try:
-                choice = input("请选择操作 [0-8]: ").strip()
+                choice = input("请选择操作 [0-9]: ").strip()
 
                 if choice == "1":
                     if not status["running"]:
                         print("正在启动同步服务器...")
-                        success = self.start_sync_server()
+                        success = self.start_sync_daemon()
                         if not success:
                             print("启动失败，请检查配置和网络设置")
                     else:
@@ -686,7 +902,10 @@ class SillyTavernCliLauncher:
                 elif choice == "2":
                     if status["running"]:
                         print("正在停止同步服务器...")
-                        self.stop_sync_server()
+                        if status["daemon"]:
+                            self.stop_sync_daemon()
+                        else:
+                            self.stop_sync_server()
                     else:
                         print("同步服务器未运行")
                 elif choice == "3":
@@ -704,15 +923,17 @@ class SillyTavernCliLauncher:
                             continue
 
                         print("请选择同步方法:")
-                        print("1. 自动 (优先ZIP，失败后增量)")
+                        print("1. 自动 (根据变更量选择更快的方式)")
                         print("2. ZIP全量同步")
                         print("3. 增量同步")
-                        method_choice = input("请选择 [1-3]: ").strip()
+                        print("4. 双向同步 (同时上传本地修改，冲突时保留副本)")
+                        method_choice = input("请选择 [1-4]: ").strip()
 
                         method_map = {
                             "1": "auto",
                             "2": "zip",
-                            "3": "incremental"
+                            "3": "incremental",
+                            "4": "twoway"
                         }
                         method = method_map.get(method_choice, "auto")
 
@@ -758,22 +979,24 @@ class SillyTavernCliLauncher:
                 elif choice == "6":
                     # 设置同步服务器端口
                     try:
-                        new_port = input(f"请输入新的端口号 (当前: {sync_port}): ").strip()
+                        new_port = input(f"请输入新的端口号 (当前: {status['port']}): ").strip()
                         if new_port:
                             port_num = int(new_port)
                             if 1 <= port_num <= 65535:
                                 self.config_manager.set("sync.port", port_num)
                                 self.config_manager.save_config()
-                                sync_port = port_num
                                 print(f"同步服务器端口已设置为: {port_num}")
 
                                 # 如果服务器正在运行，询问是否重启
-                                if status["running"] and self.sync_server:
+                                if status["running"]:
                                     restart = input("同步服务器正在运行，是否重启以应用新端口？(Y/n): ").strip()
                                     if restart.lower() != 'n':
                                         print("正在重启同步服务器...")
-                                        self.stop_sync_server()
-                                        self.start_sync_server(port_num, status['host'])
+                                        if status["daemon"]:
+                                            self.stop_sync_daemon()
+                                        else:
+                                            self.stop_sync_server()
+                                        self.start_sync_daemon(port_num, status['host'])
                             else:
                                 print("错误: 端口号必须在 1-65535 范围内")
                         else:
@@ -787,13 +1010,15 @@ class SillyTavernCliLauncher:
                         print("状态已修复，配置已同步到实际运行状态")
                     else:
                         print("状态已经一致，无需修复")
-                elif choice == "8":
+                elif saved_servers and choice == ("7" if status["consistent"] else "8"):
                     # 处理已保存的服务器列表
                     self._manage_saved_servers()
+                elif choice == "9":
+                    self.scan_sync_servers()
                 elif choice == "0":
                     break
                 else:
-                    print("无效选择，请输入 0-8 之间的数字")
+                    print("无效选择，请输入 0-9 之间的数字")
 
             except KeyboardInterrupt:
                 print("\n收到退出信号，返回主菜单...")
@@ -999,9 +1224,11 @@ def main():
     parser.add_argument("--port", type=int, default=9999, help="同步服务器端口")
     parser.add_argument("--host", default='0.0.0.0', help="同步服务器主机地址")
     parser.add_argument("--server-url", help="同步源服务器地址")
-    parser.add_argument("--method", choices=['auto', 'zip', 'incremental'],
+    parser.add_argument("--method", choices=['auto', 'zip', 'incremental', 'twoway'],
                        default='auto', help="同步方法")
     parser.add_argument("--no-backup", action='store_true', help="同步时不备份现有数据")
+    parser.add_argument("--jobs", type=int, default=4, help="增量同步并发下载数")
+    parser.add_argument("--dry-run", action='store_true', help="只显示同步计划，不修改文件")
     
     args = parser.parse_args()
     
@@ -1068,9 +1295,11 @@ def main():
             print("请提供镜像源参数，例如: st set-mirror --mirror gh-proxy.org")
     elif args.command == "sync":
         if args.subcommand == "start":
-            launcher.start_sync_server(args.port, args.host)
+            launcher.start_sync_daemon(args.port, args.host)
         elif args.subcommand == "stop":
-            launcher.stop_sync_server()
+            launcher.stop_sync_daemon()
+        elif args.subcommand in ("status", "reload"):
+            launcher.show_sync_daemon_status(args.subcommand)
         elif args.subcommand == "from":
             if not args.server_url:
                 print("请提供服务器地址，例如: st sync from --server-url http://192.168.1.100:5000")
@@ -1078,27 +1307,43 @@ def main():
                 launcher.sync_from_server(
                     args.server_url,
                     args.method,
-                    not args.no_backup
+                    not args.no_backup,
+                    args.jobs,
+                    args.dry_run
                 )
+        elif args.subcommand == "watch":
+            if not args.server_url:
+                print("请提供服务器地址，例如: st sync watch --server-url http://192.168.1.100:9999")
+            else:
+                launcher.watch_server(args.server_url, args.jobs)
+        elif args.subcommand == "scan":
+            launcher.scan_sync_servers(args.port)
         elif args.subcommand == "menu":
             launcher.show_sync_menu()
         else:
             print("可用的同步子命令:")
-            print("  st sync start           - 启动同步服务器")
-            print("  st sync stop            - 停止同步服务器")
+            print("  st sync start           - 在后台启动同步服务器")
+            print("  st sync stop            - 停止后台同步服务器")
+            print("  st sync status          - 查看后台同步服务器状态")
+            print("  st sync reload          - 重新加载配置并重新扫描数据目录")
             print("  st sync from --server-url <URL>  - 从服务器同步数据")
+            print("  st sync watch --server-url <URL> - 持续跟随服务器变更 (几秒内同步)")
+            print("  st sync scan            - 扫描局域网同步服务器 (按 --port 端口)")
             print("  st sync menu            - 进入同步菜单")
             print("")
             print("可选参数:")
             print("  --port <port>           - 服务器端口 (默认: 5000)")
             print("  --host <host>           - 服务器主机地址 (默认: 0.0.0.0)")
-            print("  --method <method>       - 同步方法: auto, zip, incremental (默认: auto)")
+            print("  --method <method>       - 同步方法: auto, zip, incremental, twoway (双向) (默认: auto)")
             print("  --no-backup             - 同步时不备份现有数据")
+            print("  --jobs <n>              - 增量同步并发下载数 (默认: 4)")
+            print("  --dry-run               - 只显示同步计划和预计传输量，不修改文件")
             print("")
             print("示例:")
             print("  st sync start --port 8080")
             print("  st sync from --server-url http://192.168.1.100:5000")
             print("  st sync from --server-url http://192.168.1.100:5000 --method zip")
+            print("  st sync from --server-url http://192.168.1.100:5000 --method twoway")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
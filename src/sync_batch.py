@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Batch Container
+Length-prefixed framing used by POST /files to send many small files in a
+single response
+"""
+
+import json
+import os
+import struct
+
+
+MAGIC = b'STB1'
+FRAME_HEADER = struct.Struct('>I')
+
+# Upper bound on paths per request, keeps a single response bounded
+MAX_BATCH_PATHS = 5000
+
+
+class BatchFormatError(Exception):
+    """The batch stream is truncated or malformed"""
+
+
+def _frame(header):
+    """Encode a frame header (JSON object prefixed with its length)"""
+    data = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    return FRAME_HEADER.pack(len(data)) + data
+
+
+def iter_batch(entries, chunk_size=64 * 1024):
+    """
+    Stream files as a batch container
+
+    Layout: MAGIC, then per file a frame header {'path', 'size'} followed by
+    exactly size bytes of content, or {'path', 'error'} without content.
+    A zero-length frame header ends the stream.
+
+    Args:
+        entries (iterable): (rel_path, full_path or None) pairs; None marks
+            a path that can't be served
+        chunk_size (int): Read size
+
+    Yields:
+        bytes: Container data
+    """
+    yield MAGIC
+    for rel_path, full_path in entries:
+        if full_path is None:
+            yield _frame({'path': rel_path, 'error': 'not found'})
+            continue
+
+        try:
+            f = open(full_path, 'rb')
+        except OSError as e:
+            yield _frame({'path': rel_path, 'error': str(e)})
+            continue
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            yield _frame({'path': rel_path, 'size': size})
+            remaining = size
+            while remaining:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    # File shrank while sending - pad so framing stays intact;
+                    # the client's hash check rejects the content
+                    data = b'\0' * min(chunk_size, remaining)
+                remaining -= len(data)
+                yield data
+
+    yield FRAME_HEADER.pack(0)
+
+
+class BatchReader:
+    def __init__(self, stream):
+        """
+        Initialize batch reader
+
+        Args:
+            stream: File-like object with read(n), e.g. requests' response.raw
+        """
+        self.stream = stream
+        magic = self._read_exact(len(MAGIC))
+        if magic != MAGIC:
+            raise BatchFormatError("invalid batch header")
+
+    def _read_exact(self, n):
+        """Read exactly n bytes"""
+        parts = []
+        while n:
+            data = self.stream.read(n)
+            if not data:
+                raise BatchFormatError("unexpected end of batch stream")
+            parts.append(data)
+            n -= len(data)
+        return b''.join(parts)
+
+    def next_entry(self):
+        """
+        Read the next frame header
+
+        Returns:
+            dict: Frame header, or None at the end of the stream
+        """
+        length, = FRAME_HEADER.unpack(self._read_exact(FRAME_HEADER.size))
+        if length == 0:
+            return None
+        return json.loads(self._read_exact(length).decode('utf-8'))
+
+    def iter_content(self, size, chunk_size=64 * 1024):
+        """Yield the size content bytes of the current entry"""
+        while size:
+            data = self._read_exact(min(chunk_size, size))
+            size -= len(data)
+            yield data
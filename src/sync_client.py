@@ -2,23 +2,35 @@
 """
 SillyTavern Data Sync Client
 Python client for synchronizing SillyTavern user data from remote server
+(or in both directions, see SyncClient.sync_bidirectional)
 """
 
 import os
 import json
 import requests
-import zipfile
-import io
 import shutil
 import time
-from datetime import datetime, timedelta
-from pathlib import Path
-import tempfile
+from datetime import datetime
 import argparse
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+from sync_batch import BatchFormatError, BatchReader
+from sync_hash import HASH_ALGO, HashCache, build_digest_tree, hash_file, stat_key
+from sync_index import join_rel
+from sync_plan import SyncPlan, conflict_path, diff_manifests, diff_three_way
+from sync_snapshot import SnapshotStore
+from sync_zipextract import ZipStreamError, extract_stream
 
 
 class SyncClient:
-    def __init__(self, server_url, data_path=None, timeout=30):
+    def __init__(self, server_url, data_path=None, timeout=30, state_path=None,
+                 max_retries=5, retry_backoff=1.0, jobs=4):
         """
         Initialize sync client
 
@@ -26,13 +38,72 @@ class SyncClient:
             server_url (str): Base URL of sync server (e.g., http://192.168.1.100:5000)
             data_path (str): Local SillyTavern data directory
             timeout (int): Request timeout in seconds
+            state_path (str): Client state database (default: ./sync_client.db)
+            max_retries (int): Resume attempts after an interrupted transfer
+            retry_backoff (float): Initial retry delay in seconds, doubled each attempt
+            jobs (int): Concurrent downloads during incremental sync
         """
         self.server_url = server_url.rstrip('/')
         self.data_path = data_path or self._find_data_path()
         self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.jobs = max(1, int(jobs))
+        # Files up to batch_file_limit bytes are fetched in POST /files batches
+        self.batch_file_limit = 256 * 1024
+        self.batch_max_files = 1000
+        self._batch_supported = True
+        # Link estimates, updated by check_server_health / measure_link
+        self.link_latency = None
+        self.link_throughput = None
+        # Fallbacks for the cost model when the server can't be probed
+        self.default_throughput = 2 * 1024 * 1024
+        self.local_copy_throughput = 50 * 1024 * 1024
+        # Snapshot backups before ZIP sync and their retention
+        self.backup_dir = "./backup"
+        self.backup_keep_last = 5
+        self.backup_keep_daily = 7
+        # /zip compression level (None = server default, 0 = store only,
+        # useful when the link is faster than the server's CPU)
+        self.zip_level = None
+        # Names conflict copies of this side's versions in bidirectional sync
+        self.device_name = socket.gethostname() or 'client'
         self.session = requests.Session()
+        # One pooled connection per worker, reused across requests
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.jobs)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.state_path = state_path or os.path.join(os.getcwd(), "sync_client.db")
+        self.hash_cache = HashCache(self.state_path)
+        self._state(
+            "CREATE TABLE IF NOT EXISTS cursors ("
+            "server_url TEXT NOT NULL, data_path TEXT NOT NULL, "
+            "epoch TEXT NOT NULL, generation INTEGER NOT NULL, "
+            "PRIMARY KEY (server_url, data_path))"
+        )
+        self._state(
+            "CREATE TABLE IF NOT EXISTS partials (part_path TEXT PRIMARY KEY, etag TEXT NOT NULL)"
+        )
+        # Content both sides had after the last bidirectional sync
+        self._state(
+            "CREATE TABLE IF NOT EXISTS sync_base ("
+            "server_url TEXT NOT NULL, data_path TEXT NOT NULL, "
+            "path TEXT NOT NULL, hash TEXT NOT NULL, "
+            "PRIMARY KEY (server_url, data_path, path))"
+        )
+        # Files pull syncs installed since, folded into sync_base by the next
+        # bidirectional sync if they are still unmodified
+        self._state(
+            "CREATE TABLE IF NOT EXISTS sync_pulled ("
+            "server_url TEXT NOT NULL, data_path TEXT NOT NULL, path TEXT NOT NULL, "
+            "dev INTEGER NOT NULL, inode INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "PRIMARY KEY (server_url, data_path, path))"
+        )
+        self._remote_cursor = None
 
         # Ensure data directory exists
+        self._recover_interrupted_swap()
         os.makedirs(self.data_path, exist_ok=True)
 
         print(f"数据同步客户端已初始化")
@@ -74,7 +145,9 @@ class SyncClient:
     def check_server_health(self):
         """Check if server is healthy and accessible"""
         try:
+            started = time.monotonic()
             response = self._request('health')
+            self.link_latency = time.monotonic() - started
             data = response.json()
             print(f"服务器状态: 健康")
             print(f"服务器数据路径: {data.get('data_path', 'N/A')}")
@@ -83,6 +156,31 @@ class SyncClient:
             print(f"服务器健康检查失败: {e}")
             return False
 
+    def measure_link(self, probe_size=512 * 1024):
+        """
+        Measure round-trip latency and throughput to the server
+
+        Latency comes from a plain health check, throughput from a padded
+        one. Servers without probe support send a tiny reply; the
+        throughput is then left unknown.
+
+        Returns:
+            tuple: (latency in seconds, throughput in bytes/s or None)
+        """
+        started = time.monotonic()
+        self._request('health')
+        self.link_latency = time.monotonic() - started
+
+        started = time.monotonic()
+        response = self._request('health', params={'probe': probe_size})
+        elapsed = time.monotonic() - started
+        received = len(response.content)
+        if received >= probe_size:
+            transfer_time = max(elapsed - self.link_latency, 1e-3)
+            self.link_throughput = received / transfer_time
+
+        return self.link_latency, self.link_throughput
+
     def get_server_info(self):
         """Get server information"""
         try:
@@ -92,21 +190,39 @@ class SyncClient:
             print(f"获取服务器信息失败: {e}")
             return None
 
-    def get_remote_manifest(self):
-        """Get file manifest from remote server"""
+    def get_remote_manifest(self, with_hash=False):
+        """
+        Get file manifest from remote server
+
+        Args:
+            with_hash (bool): Request content hashes (ignored by older servers)
+        """
         try:
-            response = self._request('manifest')
+            params = {'hash': 1} if with_hash else None
+            response = self._request('manifest', params=params)
             data = response.json()
             if data.get('success'):
-                return data['manifest']
+                manifest = data['manifest']
+                if data.get('epoch') is not None:
+                    self._remote_cursor = (data['epoch'], data['generation'])
+                # Hashes from an unknown algorithm can't be compared locally
+                if with_hash and data.get('hash_algo') != HASH_ALGO:
+                    for item in manifest:
+                        item.pop('hash', None)
+                return manifest
             else:
                 raise Exception(data.get('error', '未知错误'))
         except Exception as e:
             print(f"获取远程文件清单失败: {e}")
             return None
 
-    def get_local_manifest(self):
-        """Generate local file manifest"""
+    def get_local_manifest(self, with_hash=False):
+        """
+        Generate local file manifest
+
+        Args:
+            with_hash (bool): Include content hashes (served from the hash cache)
+        """
         manifest = []
 
         for root, dirs, files in os.walk(self.data_path):
@@ -123,23 +239,36 @@ class SyncClient:
 
                 try:
                     stat_info = os.stat(file_path)
-                    manifest.append({
+                    entry = {
                         'path': relative_path.replace('\\', '/'),  # Normalize to forward slashes
                         'size': stat_info.st_size,
                         'mtime': stat_info.st_mtime,
+                        'mtime_ns': stat_info.st_mtime_ns,
                         'modified': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
                         'is_dir': False
-                    })
+                    }
+                    if with_hash:
+                        entry['hash'] = self.hash_cache.get(file_path, stat_key(stat_info))
+                    manifest.append(entry)
                 except OSError:
                     # Skip files that can't be accessed
                     continue
 
+        if with_hash:
+            self.hash_cache.flush()
         return manifest
 
     def sync_full_zip(self, backup=True):
         """
         Synchronize using full ZIP download
 
+        The archive is unpacked into a staging folder that only replaces the
+        data folder once it is complete, so a failed sync leaves the local
+        data untouched and nothing has to be restored from the backup. Local
+        files missing from the archive (local-only or hidden files) are
+        carried over into the staging folder: like extracting over the data
+        folder, a ZIP sync adds and updates files but never deletes them.
+
         Args:
             backup (bool): Whether to backup existing data
 
@@ -153,108 +282,156 @@ class SyncClient:
                 print("备份失败，取消同步")
                 return False
 
-        try:
-            # Download ZIP file
-            print("正在下载 ZIP 文件...")
-            response = self._request('zip', stream=True)
-
-            # Create temporary zip file
-            with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as temp_file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        temp_file.write(chunk)
-                temp_zip_path = temp_file.name
+        # Unpack into a staging folder next to the data folder (same
+        # filesystem), then swap it in with renames
+        staging_path = self._sibling_path('sync-staging')
+        shutil.rmtree(staging_path, ignore_errors=True)
 
-            # Extract ZIP file
-            print("正在解压 ZIP 文件...")
-            self._extract_zip_with_progress(temp_zip_path, self.data_path)
-
-            # Clean up temp file
-            os.unlink(temp_zip_path)
+        try:
+            # Entries are unpacked as they arrive, no archive is stored
+            print("正在下载并解压 ZIP 数据...")
+            os.makedirs(staging_path)
+            extracted = self._stream_extract_zip(staging_path)
+            self._carry_local_files(staging_path)
+            self._swap_in(staging_path)
+            self._record_pulled((path, None) for path in extracted)
 
             print("ZIP 全量同步完成")
             return True
 
         except Exception as e:
             print(f"ZIP 同步失败: {e}")
-            if backup:
-                print("尝试恢复备份...")
-                self._restore_backup()
+            print("本地数据未被修改")
+            shutil.rmtree(staging_path, ignore_errors=True)
             return False
 
-    def sync_incremental(self):
+    def _sibling_path(self, tag):
+        """Hidden path next to the data folder, e.g. .default-user.sync-staging"""
+        parent, name = os.path.split(os.path.abspath(self.data_path))
+        return os.path.join(parent, f".{name}.{tag}")
+
+    def _carry_local_files(self, staging_path):
+        """
+        Link files the archive didn't contain from the data folder into staging
+
+        Hard links keep this cheap and leave the data folder itself as it
+        is until the swap; files that can't be linked are copied.
+        """
+        for root, dirs, files in os.walk(self.data_path):
+            rel_root = os.path.relpath(root, self.data_path)
+            target_root = os.path.normpath(os.path.join(staging_path, rel_root))
+            for name in dirs + files:
+                src = os.path.join(root, name)
+                dst = os.path.join(target_root, name)
+                if os.path.lexists(dst) or (name in dirs and not os.path.islink(src)):
+                    continue
+                try:
+                    os.makedirs(target_root, exist_ok=True)
+                    if os.path.islink(src):
+                        os.symlink(os.readlink(src), dst)
+                    else:
+                        try:
+                            os.link(src, dst)
+                        except OSError:
+                            shutil.copy2(src, dst)
+                except OSError as e:
+                    print(f"保留本地文件失败 {os.path.relpath(src, self.data_path)}: {e}")
+            # Recreate local-only empty folders too
+            if not files and not dirs:
+                try:
+                    os.makedirs(target_root, exist_ok=True)
+                except OSError:
+                    pass
+
+    def _swap_in(self, staging_path):
+        """
+        Replace the data folder with a fully extracted staging folder
+
+        The old folder is renamed aside first and renamed back if the second
+        rename fails, so rollback never copies data.
+        """
+        old_path = self._sibling_path('sync-old')
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        os.rename(self.data_path, old_path)
+        try:
+            os.rename(staging_path, self.data_path)
+        except OSError:
+            os.rename(old_path, self.data_path)
+            raise
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def _recover_interrupted_swap(self):
+        """Put the data folder back if a previous run stopped between the swap renames"""
+        old_path = self._sibling_path('sync-old')
+        if os.path.isdir(old_path) and not os.path.exists(self.data_path):
+            print("检测到未完成的数据替换，正在恢复原数据...")
+            os.rename(old_path, self.data_path)
+
+    def sync_incremental(self, dry_run=False, plan=None):
         """
         Synchronize using incremental file-by-file approach
 
+        Args:
+            dry_run (bool): Only print the plan and estimated transfer cost
+            plan (SyncPlan): Plan computed just before, planned here if omitted
+
         Returns:
-            bool: Success status
+            bool: Success status (False if any file failed to download)
         """
         print("开始增量同步...")
 
         try:
-            # Get remote and local manifests
-            print("获取文件清单...")
-            remote_manifest = self.get_remote_manifest()
-            local_manifest = self.get_local_manifest()
-
-            if not remote_manifest:
-                print("无法获取远程文件清单")
+            if plan is None:
+                plan = self.plan_incremental()
+            if plan is None:
                 return False
 
-            # Create local manifest lookup
-            local_files = {item['path']: item for item in local_manifest}
-
-            # Analyze differences
-            files_to_download = []
-            files_to_delete = []
-            total_size = 0
-
-            for remote_file in remote_manifest:
-                path = remote_file['path']
-                local_file = local_files.get(path)
-
-                if not local_file:
-                    # File exists remotely but not locally - download
-                    files_to_download.append(remote_file)
-                    total_size += remote_file['size']
-                elif remote_file['mtime'] > local_file['mtime']:
-                    # Remote file is newer - download
-                    files_to_download.append(remote_file)
-                    total_size += remote_file['size']
-
-            # Check for local files that don't exist remotely
-            for local_path in local_files:
-                if local_path not in [f['path'] for f in remote_manifest]:
-                    files_to_delete.append(local_path)
-
-            if not files_to_download and not files_to_delete:
+            if plan.is_empty():
+                if not dry_run:
+                    self._save_cursor()
                 print("数据已是最新，无需同步")
                 return True
 
-            print(f"需要下载 {len(files_to_download)} 个文件 ({self._format_size(total_size)})")
-            print(f"需要删除 {len(files_to_delete)} 个文件")
+            self._print_plan(plan)
+            if dry_run:
+                print("预演模式，未修改任何文件")
+                return True
+
+            # Move renamed files, anything that can't be moved is downloaded
+            files_to_download = plan.download + self._apply_renames(plan.rename)
+            retried = {f['path'] for f in files_to_download}
+            moved = [entry for _, entry in plan.rename if entry['path'] not in retried]
+            removed = [old_path for old_path, entry in plan.rename if entry['path'] not in retried]
 
             # Delete obsolete files
-            for file_path in files_to_delete:
+            for file_path in plan.delete:
                 full_path = os.path.join(self.data_path, file_path)
                 try:
                     os.remove(full_path)
                     print(f"已删除: {file_path}")
+                    removed.append(file_path)
                 except Exception as e:
                     print(f"删除文件失败 {file_path}: {e}")
 
             # Download new/updated files
-            downloaded_size = 0
-            for i, file_info in enumerate(files_to_download, 1):
-                success = self._download_file(file_info)
-                if success:
-                    downloaded_size += file_info['size']
-                    progress = (i / len(files_to_download)) * 100
-                    print(f"进度: {i}/{len(files_to_download)} ({progress:.1f}%) - "
-                          f"{self._format_size(downloaded_size)}/{self._format_size(total_size)}")
-                else:
-                    print(f"下载失败: {file_info['path']}")
-
+            total_size = sum(f['size'] for f in files_to_download)
+            failed = self._download_files(files_to_download, total_size)
+
+            self.hash_cache.flush()
+            failed_paths = set(failed)
+            self._record_pulled(
+                [(f['path'], f.get('hash')) for f in moved + files_to_download
+                 if f['path'] not in failed_paths],
+                removed
+            )
+            # Only advance the cursor when every change was applied
+            if failed:
+                print(f"{len(failed)} 个文件下载失败:")
+                for path in failed:
+                    print(f"  {path}")
+                return False
+            self._save_cursor()
             print("增量同步完成")
             return True
 
@@ -262,13 +439,218 @@ class SyncClient:
             print(f"增量同步失败: {e}")
             return False
 
-    def sync(self, prefer_zip=True, backup=True):
+    def watch(self, poll_timeout=25):
+        """
+        Keep the local data following the server
+
+        Does one incremental sync, then long-polls /events and applies each
+        batch of changed paths as it arrives; the tree is only compared again
+        if the server's journal can no longer cover the gap. Runs until
+        interrupted.
+
+        Args:
+            poll_timeout (int): Seconds each long-poll may wait on the server
+
+        Returns:
+            bool: False if the server can't be reached or has no /events
+        """
+        if not self.check_server_health():
+            return False
+        if not self.sync_incremental():
+            print("初始同步未完成，将在监听期间重试")
+
+        print("正在监听服务器变更 (按 Ctrl+C 停止)...")
+        failures = 0
+        while True:
+            cursor = self._load_cursor()
+            if cursor is None:
+                # Initial sync failed or had download failures - compare again
+                self.sync_incremental()
+                time.sleep(self.retry_backoff)
+                continue
+
+            epoch, generation = cursor
+            try:
+                response = self.session.get(
+                    f"{self.server_url}/events",
+                    params={'since': generation, 'epoch': epoch, 'hash': 1,
+                            'timeout': poll_timeout},
+                    timeout=poll_timeout + self.timeout
+                )
+                response.raise_for_status()
+                data = response.json()
+                failures = 0
+            except (requests.exceptions.RequestException, ValueError) as e:
+                failures += 1
+                delay = min(self.retry_backoff * 2 ** (failures - 1), 60)
+                print(f"等待变更失败: {e}，{delay:.0f} 秒后重试")
+                time.sleep(delay)
+                continue
+
+            if not data.get('success') or 'changes' not in data:
+                print("服务器不支持变更通知 (/events)")
+                return False
+            if data.get('full_resync'):
+                print("变更日志已过期，重新比较目录")
+                self._clear_cursor()
+                self.sync_incremental()
+                continue
+            if not data['changes']:
+                continue
+
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] 收到 {len(data['changes'])} 项变更 "
+                  f"(第 {generation} → {data['generation']} 代)")
+            plan = self._plan_from_changes(data)
+            plan.detect_renames(self._local_size, self._local_hash)
+            self.sync_incremental(plan=plan)
+
+    def _clear_cursor(self):
+        """Forget the cursor so the next plan does a full comparison"""
+        self._state(
+            "DELETE FROM cursors WHERE server_url = ? AND data_path = ?",
+            (self.server_url, os.path.abspath(self.data_path))
+        )
+
+    def plan_incremental(self):
+        """
+        Work out what an incremental sync has to do, without changing files
+
+        Uses the change journal when we have a cursor, then the digest tree,
+        then the flat manifest.
+
+        Returns:
+            SyncPlan: Plan with renames detected, or None on failure
+        """
+        self._remote_cursor = None
+        plan = self._plan_from_cursor()
+        if plan is None:
+            plan = self._plan_from_tree()
+        if plan is None:
+            plan = self._plan_from_manifest()
+        if plan is None:
+            return None
+
+        plan.detect_renames(self._local_size, self._local_hash)
+        self.hash_cache.flush()
+        return plan
+
+    def _choose_method(self, plan, total_size, backup):
+        """
+        Pick the cheaper strategy from the plan and measured link speed
+
+        ZIP cost is the full (uncompressed, as an upper bound) data size plus
+        the local backup (a full copy for the first snapshot, mostly links
+        after that); incremental cost is the changed bytes plus one round
+        trip per request, spread over the download workers.
+
+        Args:
+            plan (SyncPlan): Incremental plan
+            total_size (int): Remote data size
+            backup (bool): Whether a ZIP sync would copy the local data first
+
+        Returns:
+            str: 'zip' or 'incremental'
+        """
+        if plan.is_empty():
+            print("选择增量同步: 数据已是最新")
+            return 'incremental'
+
+        try:
+            latency, throughput = self.measure_link()
+        except Exception:
+            latency, throughput = self.link_latency, self.link_throughput
+        latency = latency if latency is not None else 0.05
+        throughput = throughput or self.default_throughput
+
+        requests_needed = self._estimate_requests(plan.download)
+        incremental_time = (
+            -(-requests_needed // self.jobs) * latency + plan.download_bytes / throughput
+        )
+
+        zip_time = latency + total_size / throughput
+        backup_bytes = 0
+        if backup:
+            local_files = plan.skip_count + len(plan.delete)
+            if self._snapshot_store().list_snapshots():
+                # Roughly a stat + link per file against the previous snapshot
+                zip_time += local_files * 0.0005
+            else:
+                backup_bytes = plan.skip_bytes + sum(
+                    self._local_size(path) or 0 for path in plan.delete
+                )
+                zip_time += backup_bytes / self.local_copy_throughput
+
+        print(f"链路估计: 延迟 {latency * 1000:.0f} ms，吞吐 {self._format_size(throughput)}/s")
+        print(f"  增量同步: {self._format_size(plan.download_bytes)}，"
+              f"{requests_needed} 个请求，预计 {incremental_time:.1f} 秒")
+        print(f"  ZIP 同步: {self._format_size(total_size)}"
+              + (f" + 备份 {self._format_size(backup_bytes)}" if backup_bytes else "")
+              + f"，预计 {zip_time:.1f} 秒")
+
+        if zip_time < incremental_time:
+            print("选择 ZIP 全量同步: 变更文件多，单次传输更快")
+            return 'zip'
+        print("选择增量同步: 只需传输变更部分")
+        return 'incremental'
+
+    def _local_size(self, rel_path):
+        """Size of a local file, or None if it doesn't exist"""
+        try:
+            return os.path.getsize(os.path.join(self.data_path, rel_path))
+        except OSError:
+            return None
+
+    def _local_hash(self, rel_path):
+        """Cached content hash of a local file"""
+        return self.hash_cache.get(os.path.join(self.data_path, rel_path))
+
+    def _print_plan(self, plan):
+        """Print plan totals and the estimated transfer cost"""
+        print(f"需要下载 {len(plan.download)} 个文件 ({self._format_size(plan.download_bytes)})")
+        if plan.rename:
+            print(f"本地移动 {len(plan.rename)} 个文件 (免下载 {self._format_size(plan.rename_bytes)})")
+        print(f"需要删除 {len(plan.delete)} 个文件")
+        if plan.skip_count:
+            print(f"无需变更 {plan.skip_count} 个文件 ({self._format_size(plan.skip_bytes)})")
+        if plan.download:
+            print(f"预计传输 {self._format_size(plan.download_bytes)}，"
+                  f"约 {self._estimate_requests(plan.download)} 个请求")
+
+    def _apply_renames(self, renames):
+        """
+        Move local files to their new remote paths
+
+        Args:
+            renames (list): (old relative path, remote manifest entry) pairs
+
+        Returns:
+            list: Entries that couldn't be moved and must be downloaded
+        """
+        fallback = []
+        for old_path, entry in renames:
+            src = os.path.join(self.data_path, old_path)
+            dst = os.path.join(self.data_path, entry['path'])
+            try:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(src, dst)
+                os.utime(dst, (entry['mtime'], entry['mtime']))
+                self.hash_cache.put(dst, entry['hash'])
+                print(f"已移动: {old_path} -> {entry['path']}")
+            except OSError as e:
+                print(f"移动文件失败 {old_path}: {e}")
+                fallback.append(entry)
+        return fallback
+
+    def sync(self, method='auto', backup=True, dry_run=False):
         """
         Synchronize data with automatic fallback
 
         Args:
-            prefer_zip (bool): Try ZIP sync first, fallback to incremental
+            method (str): 'zip' or 'incremental' to try that first and fall
+                back to the other; 'auto' to pick the cheaper one; 'twoway'
+                to also send local changes to the server
             backup (bool): Whether to backup existing data for ZIP sync
+            dry_run (bool): Only print the plan and estimated costs
 
         Returns:
             bool: Success status
@@ -286,7 +668,27 @@ class SyncClient:
             print(f"  文件数量: {server_info.get('server_info', {}).get('file_count', 0)}")
             print(f"  总大小: {self._format_size(server_info.get('server_info', {}).get('total_size', 0))}")
 
-        if prefer_zip:
+        if method == 'twoway':
+            return self.sync_bidirectional(dry_run=dry_run)
+
+        plan = None
+        if method == 'auto' or dry_run:
+            total_size = (server_info or {}).get('server_info', {}).get('total_size')
+            plan = self.plan_incremental()
+            if plan is not None and total_size is not None:
+                method = self._choose_method(plan, total_size, backup)
+            elif method == 'auto':
+                method = 'zip'
+
+        if dry_run:
+            if plan is None:
+                return False
+            if not plan.is_empty():
+                self._print_plan(plan)
+            print("预演模式，未修改任何文件")
+            return True
+
+        if method == 'zip':
             # Try ZIP sync first
             print("尝试 ZIP 全量同步...")
             if self.sync_full_zip(backup=backup):
@@ -297,103 +699,1093 @@ class SyncClient:
         else:
             # Try incremental sync first
             print("尝试增量同步...")
-            if self.sync_incremental():
+            if self.sync_incremental(plan=plan):
                 return True
             else:
                 print("增量同步失败，尝试 ZIP 同步...")
                 return self.sync_full_zip(backup=backup)
 
-    def _download_file(self, file_info):
-        """Download single file from server"""
+    def sync_bidirectional(self, dry_run=False):
+        """
+        Synchronize in both directions
+
+        Both sides are compared with the content they had after the last
+        bidirectional sync: files changed on one side are copied to the
+        other, and files changed on both become a conflict copy next to the
+        newer version instead of being overwritten. Uploads only succeed if
+        the server still has the content seen in its manifest, so a change
+        made there meanwhile is never lost.
+
+        Args:
+            dry_run (bool): Only print the plan
+
+        Returns:
+            bool: Success status (False if anything failed to transfer)
+        """
+        print("开始双向同步...")
+
         try:
-            response = self._request('file', params={'path': file_info['path']}, stream=True)
+            remote_manifest = self.get_remote_manifest(with_hash=True)
+            if remote_manifest is None:
+                return False
+            if any(not item.get('hash') for item in remote_manifest):
+                print("服务器未提供内容哈希，无法进行双向同步")
+                return False
 
-            # Ensure directory exists
-            file_path = os.path.join(self.data_path, file_info['path'])
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            local_manifest = self.get_local_manifest(with_hash=True)
+            # Unreadable files must not look deleted, so leave them out entirely
+            unreadable = {item['path'] for item in local_manifest if not item.get('hash')}
+            if unreadable:
+                print(f"跳过 {len(unreadable)} 个无法读取的本地文件")
+            local_manifest = [item for item in local_manifest if item['path'] not in unreadable]
+            remote_manifest = [item for item in remote_manifest if item['path'] not in unreadable]
+            base = self._load_base()
+            pulled = self._pulled_base()
+            for path, digest in pulled.items():
+                if digest is None:
+                    base.pop(path, None)
+                else:
+                    base[path] = digest
+            base = {path: digest for path, digest in base.items() if path not in unreadable}
+            if not dry_run and pulled:
+                self._save_base(pulled)
+                self._state(
+                    "DELETE FROM sync_pulled WHERE server_url = ? AND data_path = ?",
+                    (self.server_url, os.path.abspath(self.data_path))
+                )
+
+            when = datetime.now()
+            devices = {
+                'local': self.device_name,
+                'remote': urlparse(self.server_url).hostname or 'server'
+            }
+            plan = diff_three_way(
+                local_manifest, remote_manifest, base,
+                lambda path, loser: conflict_path(path, devices[loser], when)
+            )
+
+            if plan.is_empty():
+                if not dry_run:
+                    self._save_base(plan.in_sync)
+                print("两端数据一致，无需同步")
+                return True
 
-            # Save file
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            self._print_two_way_plan(plan)
+            if dry_run:
+                print("预演模式，未修改任何文件")
+                return True
 
-            # Set modification time to match remote
-            os.utime(file_path, (file_info['mtime'], file_info['mtime']))
+            results, failed = self._apply_two_way(plan)
+            self._save_base(results)
+            self.hash_cache.flush()
+
+            if failed:
+                print(f"{len(failed)} 个文件未能同步，下次同步时重试:")
+                for path in failed:
+                    print(f"  {path}")
+                return False
+            # Everything agrees now, so pull-only syncs can start from here
+            self._save_cursor()
+            print("双向同步完成")
             return True
 
         except Exception as e:
-            print(f"下载文件失败 {file_info['path']}: {e}")
+            print(f"双向同步失败: {e}")
             return False
 
-    def _backup_existing_data(self):
-        """Backup existing data directory"""
-        if not os.path.exists(self.data_path) or not os.listdir(self.data_path):
-            print("本地数据目录为空，无需备份")
-            return True
+    def _apply_two_way(self, plan):
+        """
+        Carry out a bidirectional plan
+
+        Local renames for conflicts come first, then uploads and remote
+        deletions, then local deletions and downloads, so conflict copies
+        created on the server can be fetched in the same run.
+
+        Args:
+            plan (TwoWayPlan): Plan to apply
+
+        Returns:
+            tuple: (path -> hash both sides now agree on, None for deleted
+                on both; list of paths that failed). Failed paths keep
+                their old base entry, so the next sync decides them again.
+        """
+        results = dict(plan.in_sync)
+        failed = []
+        uploads = [(entry, remote_hash, None) for entry, remote_hash in plan.upload]
+        downloads = list(plan.download)
+        # Conflict copies to fetch once their upload went through
+        pending_copies = {}
+
+        for path, winner, copy_path, local, remote in plan.conflicts:
+            print(f"冲突: {path} 两端都已修改，保留较新的{'本地' if winner == 'local' else '服务器'}版本，"
+                  f"另一版本另存为 {copy_path}")
+            if winner == 'local':
+                # The server moves its version aside while taking ours
+                uploads.append((local, remote['hash'], copy_path))
+                pending_copies[path] = dict(remote, path=copy_path)
+                continue
+            src = os.path.join(self.data_path, path)
+            dst = os.path.join(self.data_path, copy_path)
+            try:
+                os.replace(src, dst)
+            except OSError as e:
+                print(f"保存冲突副本失败 {path}: {e}")
+                failed.append(path)
+                continue
+            self.hash_cache.put(dst, local['hash'])
+            uploads.append((dict(local, path=copy_path), None, None))
+            downloads.append(remote)
+
+        if uploads:
+            total = sum(entry['size'] for entry, _, _ in uploads)
+            print(f"正在上传 {len(uploads)} 个文件 ({self._format_size(total)})...")
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                outcomes = executor.map(lambda item: self._upload_file(*item), uploads)
+                for (entry, _, copy_path), success in zip(uploads, outcomes):
+                    if not success:
+                        failed.append(entry['path'])
+                        continue
+                    results[entry['path']] = entry['hash']
+                    if copy_path is not None:
+                        downloads.append(pending_copies[entry['path']])
+
+        for path, remote_hash in plan.delete_remote:
+            if self._delete_remote(path, remote_hash):
+                results[path] = None
+            else:
+                failed.append(path)
+
+        for path, local_hash in plan.delete_local:
+            full_path = os.path.join(self.data_path, path)
+            if self.hash_cache.get(full_path) != local_hash:
+                print(f"本地文件已变化，暂不删除: {path}")
+                failed.append(path)
+                continue
+            try:
+                os.remove(full_path)
+                print(f"已删除: {path}")
+                results[path] = None
+            except OSError as e:
+                print(f"删除文件失败 {path}: {e}")
+                failed.append(path)
+
+        if downloads:
+            total = sum(entry['size'] for entry in downloads)
+            print(f"正在下载 {len(downloads)} 个文件 ({self._format_size(total)})...")
+            download_failed = set(self._download_files(downloads, total))
+            failed.extend(download_failed)
+            for entry in downloads:
+                if entry['path'] not in download_failed:
+                    results[entry['path']] = entry['hash']
+
+        return results, failed
+
+    def _upload_file(self, entry, base_hash, conflict_copy=None):
+        """
+        Upload one local file with PUT /file
+
+        Args:
+            entry (dict): Local manifest entry ('path', 'size', 'mtime', 'hash')
+            base_hash (str): Hash the server's file must still have, None
+                if it must not exist
+            conflict_copy (str): Path the server moves its current version
+                to before replacing it
 
-        # Create backup in ./backup folder
-        backup_dir = "./backup"
-        os.makedirs(backup_dir, exist_ok=True)
-        backup_path = os.path.join(backup_dir, f"default-user.backup.{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        Returns:
+            bool: True if the server took the file
+        """
+        headers = {
+            'X-Base-Hash': base_hash or '',
+            'X-Content-Hash': entry['hash'],
+            'X-Mtime': repr(entry['mtime'])
+        }
+        if conflict_copy:
+            headers['X-Conflict-Copy'] = conflict_copy
+
+        try:
+            with open(os.path.join(self.data_path, entry['path']), 'rb') as f:
+                response = self.session.put(
+                    f"{self.server_url}/file", params={'path': entry['path']},
+                    data=f, headers=headers, timeout=self.timeout
+                )
+        except (requests.exceptions.RequestException, OSError) as e:
+            print(f"上传文件失败 {entry['path']}: {e}")
+            return False
+
+        if response.status_code == 412:
+            print(f"服务器端文件已变化，下次同步时处理: {entry['path']}")
+            return False
+        if response.status_code == 403:
+            print(f"服务器未允许上传 (需在服务器端启用 sync.allow_upload): {entry['path']}")
+            return False
+        if response.status_code != 200:
+            try:
+                error = response.json().get('error')
+            except ValueError:
+                error = f"HTTP {response.status_code}"
+            print(f"上传文件失败 {entry['path']}: {error}")
+            return False
+        print(f"已上传: {entry['path']}")
+        return True
 
+    def _delete_remote(self, path, base_hash):
+        """
+        Delete a file on the server if it still has the expected content
+
+        Returns:
+            bool: True if the file is gone from the server
+        """
         try:
-            print(f"备份现有数据到: {backup_path}")
-            shutil.copytree(self.data_path, backup_path)
+            response = self.session.delete(
+                f"{self.server_url}/file", params={'path': path},
+                headers={'X-Base-Hash': base_hash}, timeout=self.timeout
+            )
+        except requests.exceptions.RequestException as e:
+            print(f"删除服务器文件失败 {path}: {e}")
+            return False
 
-            # Store backup path for potential restore
-            self._last_backup_path = backup_path
+        if response.status_code in (200, 404):
+            print(f"已删除服务器文件: {path}")
             return True
+        if response.status_code == 412:
+            print(f"服务器端文件已变化，暂不删除: {path}")
+        elif response.status_code == 403:
+            print(f"服务器未允许删除 (需在服务器端启用 sync.allow_upload): {path}")
+        else:
+            print(f"删除服务器文件失败 {path}: HTTP {response.status_code}")
+        return False
+
+    def _print_two_way_plan(self, plan):
+        """Print what a bidirectional sync is going to do"""
+        print(f"需要上传 {len(plan.upload)} 个文件，下载 {len(plan.download)} 个文件")
+        if plan.delete_remote:
+            print(f"需要删除服务器上 {len(plan.delete_remote)} 个文件")
+        if plan.delete_local:
+            print(f"需要删除本地 {len(plan.delete_local)} 个文件")
+        if plan.conflicts:
+            print(f"{len(plan.conflicts)} 个文件两端都有修改，将保留冲突副本:")
+            for path, _, copy_path, _, _ in plan.conflicts:
+                print(f"  {path} -> {copy_path}")
+        in_sync = sum(1 for digest in plan.in_sync.values() if digest is not None)
+        if in_sync:
+            print(f"无需变更 {in_sync} 个文件")
+        print(f"预计上传 {self._format_size(plan.upload_bytes)}，"
+              f"下载 {self._format_size(plan.download_bytes)}")
+
+    def _load_base(self):
+        """Get path -> hash of the last bidirectional sync with this server"""
+        with self.hash_cache.lock:
+            return dict(self.hash_cache.conn.execute(
+                "SELECT path, hash FROM sync_base WHERE server_url = ? AND data_path = ?",
+                (self.server_url, os.path.abspath(self.data_path))
+            ))
+
+    def _save_base(self, results):
+        """
+        Record the content both sides agree on
 
+        Args:
+            results (dict): path -> hash, None for files deleted on both sides
+        """
+        key = (self.server_url, os.path.abspath(self.data_path))
+        with self.hash_cache.lock:
+            self.hash_cache.conn.executemany(
+                "INSERT OR REPLACE INTO sync_base (server_url, data_path, path, hash) "
+                "VALUES (?, ?, ?, ?)",
+                [key + (path, digest) for path, digest in results.items() if digest is not None]
+            )
+            self.hash_cache.conn.executemany(
+                "DELETE FROM sync_base WHERE server_url = ? AND data_path = ? AND path = ?",
+                [key + (path,) for path, digest in results.items() if digest is None]
+            )
+            self.hash_cache.conn.commit()
+
+    def _record_pulled(self, entries, deleted=()):
+        """
+        Update the bidirectional base with files a pull sync just applied
+
+        Files whose server hash came with the plan go straight into the
+        base. For the rest (ZIP syncs) nothing is hashed here: their stat is
+        remembered, and the next bidirectional sync uses the file's hash as
+        the base if it is still unmodified (see _pulled_base).
+
+        Args:
+            entries (iterable): (relative path, server hash or None) of files
+                now holding the server's version
+            deleted (iterable): Relative paths removed because the server
+                doesn't have them
+        """
+        key = (self.server_url, os.path.abspath(self.data_path))
+        hashed, stats = [], []
+        for path, digest in entries:
+            if digest is not None:
+                hashed.append(key + (path, digest))
+                continue
+            try:
+                st = os.stat(os.path.join(self.data_path, path))
+            except OSError:
+                continue
+            stats.append(key + (path,) + stat_key(st))
+        # Gone on both sides, like a deletion in a bidirectional sync
+        forget = [key + (path,) for path in deleted]
+
+        with self.hash_cache.lock:
+            conn = self.hash_cache.conn
+            conn.executemany(
+                "DELETE FROM sync_pulled WHERE server_url = ? AND data_path = ? AND path = ?",
+                [row[:3] for row in hashed] + forget
+            )
+            conn.executemany(
+                "DELETE FROM sync_base WHERE server_url = ? AND data_path = ? AND path = ?",
+                forget
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO sync_base (server_url, data_path, path, hash) "
+                "VALUES (?, ?, ?, ?)",
+                hashed
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO sync_pulled "
+                "(server_url, data_path, path, dev, inode, size, mtime_ns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                stats
+            )
+            conn.commit()
+
+    def _pulled_base(self):
+        """
+        Base entries for files ZIP syncs installed since the last bidirectional sync
+
+        A pulled file that is still unmodified holds the content the server
+        had, so its current hash is the base; for a modified one the base is
+        unknown, and differences are kept as conflict copies.
+
+        Returns:
+            dict: path -> hash, None where the base is unknown
+        """
+        with self.hash_cache.lock:
+            rows = self.hash_cache.conn.execute(
+                "SELECT path, dev, inode, size, mtime_ns FROM sync_pulled "
+                "WHERE server_url = ? AND data_path = ?",
+                (self.server_url, os.path.abspath(self.data_path))
+            ).fetchall()
+
+        result = {}
+        for path, *recorded in rows:
+            full_path = os.path.join(self.data_path, path)
+            try:
+                key = stat_key(os.stat(full_path))
+            except OSError:
+                result[path] = None
+                continue
+            result[path] = self.hash_cache.get(full_path, key) if key == tuple(recorded) else None
+        return result
+
+    def _state(self, sql, params=()):
+        """
+        Run a statement against the client state database
+
+        Shares the hash cache connection, since both live in the same file
+        and a second connection would be locked out by its pending writes.
+
+        Returns:
+            tuple: First result row, or None
+        """
+        with self.hash_cache.lock:
+            row = self.hash_cache.conn.execute(sql, params).fetchone()
+            if not sql.lstrip().upper().startswith('SELECT'):
+                self.hash_cache.conn.commit()
+            return row
+
+    def _load_cursor(self):
+        """Get the stored (epoch, generation) for this server and data path"""
+        return self._state(
+            "SELECT epoch, generation FROM cursors WHERE server_url = ? AND data_path = ?",
+            (self.server_url, os.path.abspath(self.data_path))
+        )
+
+    def _save_cursor(self):
+        """Store the cursor received during the current sync"""
+        if self._remote_cursor is None:
+            return
+        epoch, generation = self._remote_cursor
+        self._state(
+            "INSERT OR REPLACE INTO cursors (server_url, data_path, epoch, generation) "
+            "VALUES (?, ?, ?, ?)",
+            (self.server_url, os.path.abspath(self.data_path), epoch, generation)
+        )
+
+    def _plan_from_cursor(self):
+        """
+        Get changes from the server journal since the stored cursor
+
+        Only server-side changes are reported, so local edits are left alone
+        until the next full comparison (after a journal wrap or epoch change).
+
+        Returns:
+            SyncPlan: Plan, or None when there is no cursor or a full
+                comparison is required
+        """
+        cursor = self._load_cursor()
+        if cursor is None:
+            return None
+
+        epoch, generation = cursor
+        try:
+            response = self._request('manifest', params={
+                'since': generation, 'epoch': epoch, 'hash': 1
+            })
+            data = response.json()
         except Exception as e:
-            print(f"备份失败: {e}")
-            return False
+            print(f"获取变更日志失败: {e}")
+            return None
+
+        # Older servers ignore 'since' and return a full manifest
+        if not data.get('success') or 'changes' not in data:
+            return None
+        if data.get('full_resync'):
+            print("变更日志已过期，需要完整比较")
+            return None
+
+        plan = self._plan_from_changes(data)
+        print(f"根据变更日志获取到 {len(data['changes'])} 项变更 "
+              f"(第 {generation} → {data['generation']} 代)")
+        return plan
+
+    def _plan_from_changes(self, data):
+        """
+        Turn a change list (/manifest?since= or /events) into a plan
+
+        Args:
+            data (dict): Response with 'epoch', 'generation' and 'changes'
+
+        Returns:
+            SyncPlan: Plan; the response's cursor is saved once it is applied
+        """
+        self._remote_cursor = (data['epoch'], data['generation'])
+        plan = SyncPlan()
+
+        for entry in data['changes']:
+            if data.get('hash_algo') != HASH_ALGO:
+                entry.pop('hash', None)
+            local_path = os.path.join(self.data_path, entry['path'])
+
+            if entry['op'] == 'delete':
+                if os.path.exists(local_path):
+                    plan.delete.append(entry['path'])
+                continue
+
+            try:
+                stat_info = os.stat(local_path)
+            except OSError:
+                plan.download.append(entry)
+                continue
+
+            local_file = {
+                'path': entry['path'],
+                'size': stat_info.st_size,
+                'mtime': stat_info.st_mtime
+            }
+            if self._is_changed(entry, local_file):
+                plan.download.append(entry)
+            else:
+                plan.skip_count += 1
+                plan.skip_bytes += entry['size']
+
+        return plan
+
+    def _plan_from_manifest(self):
+        """
+        Compare full remote and local manifests
+
+        Returns:
+            SyncPlan: Plan, or None on failure
+        """
+        print("获取文件清单...")
+        remote_manifest = self.get_remote_manifest(with_hash=True)
+        local_manifest = self.get_local_manifest()
+
+        if not remote_manifest:
+            print("无法获取远程文件清单")
+            return None
+
+        return diff_manifests(remote_manifest, local_manifest, self._is_changed)
+
+    def get_remote_tree(self, path=''):
+        """
+        Get one directory node of the remote digest tree
+
+        Args:
+            path (str): Directory relative to the data path ('' for the root)
+
+        Returns:
+            dict: Node with 'digest', 'files' and 'dirs'
+        """
+        response = self._request('tree', params={'path': path})
+        data = response.json()
+        if not data.get('success'):
+            raise Exception(data.get('error', '未知错误'))
+        return data
+
+    def _plan_from_tree(self):
+        """
+        Compare remote and local Merkle digest trees
+
+        Only directories whose digests differ are requested, so a no-op sync
+        costs one request and a single changed file costs one request per
+        directory level.
+
+        Returns:
+            SyncPlan: Plan, or None if the server has no /tree endpoint
+        """
+        try:
+            root = self.get_remote_tree('')
+        except Exception as e:
+            print(f"服务器不支持目录摘要树，使用完整文件清单 ({e})")
+            return None
 
-    def _restore_backup(self):
-        """Restore data from last backup"""
-        if not hasattr(self, '_last_backup_path'):
-            print("没有找到备份文件")
+        if root.get('epoch') is not None:
+            self._remote_cursor = (root['epoch'], root['generation'])
+
+        print("比较目录摘要树...")
+        local_manifest = self.get_local_manifest(with_hash=True)
+        local_tree = build_digest_tree(local_manifest)
+
+        plan = SyncPlan()
+        requests_made = 1
+        pending = [root]
+
+        while pending:
+            node = pending.pop()
+            path = node['path']
+            local_node = local_tree.get(path)
+            if local_node is not None and local_node['digest'] == node['digest']:
+                continue
+
+            local_files = local_node['files'] if local_node else {}
+            local_dirs = local_node['dirs'] if local_node else {}
+
+            remote_names = set()
+            for remote_file in node['files']:
+                remote_names.add(remote_file['name'])
+                local_file = local_files.get(remote_file['name'])
+                if (local_file is None or local_file['size'] != remote_file['size']
+                        or local_file['hash'] != remote_file['hash']):
+                    entry = dict(remote_file)
+                    entry['path'] = join_rel(path, remote_file['name'])
+                    plan.download.append(entry)
+
+            for name, local_file in local_files.items():
+                if name not in remote_names:
+                    plan.delete.append(local_file['path'])
+
+            remote_dirs = {d['name']: d['digest'] for d in node['dirs']}
+            for name, digest in remote_dirs.items():
+                if local_dirs.get(name) != digest:
+                    pending.append(self.get_remote_tree(join_rel(path, name)))
+                    requests_made += 1
+
+            # Whole local subtrees that no longer exist remotely
+            for name in local_dirs:
+                if name not in remote_dirs:
+                    plan.delete.extend(self._tree_files(local_tree, join_rel(path, name)))
+
+        plan.count_skipped(local_manifest)
+        print(f"目录摘要比较完成，共请求 {requests_made} 个目录")
+        return plan
+
+    def _tree_files(self, tree, path):
+        """List file paths below a directory of a digest tree"""
+        paths = []
+        pending = [path]
+        while pending:
+            dir_path = pending.pop()
+            node = tree[dir_path]
+            paths.extend(entry['path'] for entry in node['files'].values())
+            pending.extend(join_rel(dir_path, name) for name in node['dirs'])
+        return paths
+
+    def _is_changed(self, remote_file, local_file):
+        """
+        Check whether a remote file differs from the local copy
+
+        Compares content hashes when the server provides them, so clock skew
+        and touched-but-identical files don't cause downloads. Falls back to
+        mtime for servers without hash support.
+        """
+        if remote_file['size'] != local_file['size']:
+            return True
+
+        remote_hash = remote_file.get('hash')
+        if remote_hash:
+            local_path = os.path.join(self.data_path, local_file['path'])
+            return self.hash_cache.get(local_path) != remote_hash
+
+        return remote_file['mtime'] > local_file['mtime']
+
+    def _download_files(self, files_to_download, total_size):
+        """
+        Download files concurrently with aggregated progress
+
+        Small files go first, grouped into POST /files batches, so the many
+        tiny files cost a handful of requests while large transfers are still
+        pending, keeping the connection busy.
+
+        Args:
+            files_to_download (list): Remote manifest entries
+            total_size (int): Total bytes to download
+
+        Returns:
+            list: Paths that failed to download
+        """
+        ordered = sorted(files_to_download, key=lambda f: f['size'])
+        total = len(ordered)
+
+        # Small files travel in POST /files batches, spread over the workers
+        small = [f for f in ordered if f['size'] <= self.batch_file_limit]
+        large = ordered[len(small):]
+        per_batch = self._batch_size(len(small))
+        tasks = [
+            (self._download_batch, small[i:i + per_batch])
+            for i in range(0, len(small), per_batch)
+        ]
+        tasks += [(self._download_single, f) for f in large]
+
+        lock = threading.Lock()
+        state = {'done': 0, 'bytes': 0, 'percent': -1}
+        failed = []
+
+        def report(file_info, success):
+            with lock:
+                state['done'] += 1
+                if success:
+                    state['bytes'] += file_info['size']
+                else:
+                    failed.append(file_info['path'])
+                    print(f"下载失败: {file_info['path']}")
+                # Print on whole-percent steps instead of once per file
+                percent = int(state['done'] * 100 / total)
+                if percent != state['percent'] or state['done'] == total:
+                    state['percent'] = percent
+                    print(f"进度: {state['done']}/{total} ({percent}%) - "
+                          f"{self._format_size(state['bytes'])}/{self._format_size(total_size)}")
+
+        if self.jobs == 1:
+            for func, arg in tasks:
+                for file_info, success in func(arg):
+                    report(file_info, success)
+            return failed
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(func, arg) for func, arg in tasks]
+            for future in as_completed(futures):
+                for file_info, success in future.result():
+                    report(file_info, success)
+
+        return failed
+
+    def _batch_size(self, small_count):
+        """Files per POST /files batch, spread so every worker gets one"""
+        return max(1, min(self.batch_max_files, -(-small_count // self.jobs)))
+
+    def _estimate_requests(self, files):
+        """Estimate HTTP requests needed to download files"""
+        small = sum(1 for f in files if f['size'] <= self.batch_file_limit)
+        batches = -(-small // self._batch_size(small)) if small else 0
+        return batches + len(files) - small
+
+    def _download_single(self, file_info):
+        """Download one file, in the result format of _download_batch"""
+        return [(file_info, self._download_file(file_info))]
+
+    def _download_resumable(self, endpoint, params, part_path):
+        """
+        Download to a .part file, resuming after connection failures
+
+        The server's ETag is remembered with the partial file and sent back
+        as If-Range, so a resumed transfer only continues when the remote
+        content is unchanged; otherwise the server answers 200 and the
+        download restarts from zero.
+
+        Args:
+            endpoint (str): Server endpoint
+            params (dict): Query parameters
+            part_path (str): Partial file path, kept across attempts and runs
+        """
+        url = f"{self.server_url}/{endpoint}"
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+        attempt = 0
+
+        while True:
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            row = self._state("SELECT etag FROM partials WHERE part_path = ?", (part_path,))
+            headers = {}
+            if offset and row:
+                headers['Range'] = f"bytes={offset}-"
+                headers['If-Range'] = row[0]
+
+            try:
+                response = self.session.get(
+                    url, params=params, headers=headers, timeout=self.timeout, stream=True
+                )
+                if response.status_code == 416:
+                    # Partial file doesn't fit the current content - start over
+                    self._discard_partial(part_path)
+                    raise requests.exceptions.RequestException("请求范围无效")
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    content_range = response.headers.get('Content-Range', '')
+                    if not content_range.startswith(f"bytes {offset}-"):
+                        self._discard_partial(part_path)
+                        raise requests.exceptions.RequestException("续传位置不匹配")
+                    mode = 'ab'
+                    if attempt:
+                        print(f"从 {self._format_size(offset)} 处继续传输")
+                else:
+                    mode = 'wb'
+
+                etag = response.headers.get('ETag')
+                if etag:
+                    self._state(
+                        "INSERT OR REPLACE INTO partials (part_path, etag) VALUES (?, ?)",
+                        (part_path, etag)
+                    )
+                else:
+                    self._state("DELETE FROM partials WHERE part_path = ?", (part_path,))
+
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        if chunk:
+                            f.write(chunk)
+
+                expected = response.headers.get('Content-Length')
+                if expected is not None and mode == 'wb' and os.path.getsize(part_path) != int(expected):
+                    raise requests.exceptions.RequestException("传输不完整")
+                return
+
+            except (requests.exceptions.RequestException, OSError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise Exception(f"请求失败 {endpoint}: {e}")
+                delay = min(self.retry_backoff * (2 ** (attempt - 1)), 60)
+                print(f"传输中断 ({e})，{delay:.0f} 秒后重试 ({attempt}/{self.max_retries})...")
+                time.sleep(delay)
+
+    def _discard_partial(self, part_path):
+        """Delete a partial download and its stored ETag"""
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        self._state("DELETE FROM partials WHERE part_path = ?", (part_path,))
+
+    def _part_path(self, file_info):
+        """
+        Get the partial download path for a file, creating its directory
+
+        The hidden .part file is ignored by manifests until it is complete.
+        """
+        file_path = os.path.join(self.data_path, file_info['path'])
+        directory, name = os.path.split(file_path)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, f".{name}.part")
+
+    def _install_part(self, file_info, part_path):
+        """Verify a completed .part file and move it into place"""
+        file_path = os.path.join(self.data_path, file_info['path'])
+        digest = hash_file(part_path)
+        expected_hash = file_info.get('hash')
+        if expected_hash and digest != expected_hash:
+            self._discard_partial(part_path)
+            raise Exception("文件校验失败 (内容哈希不匹配)")
+
+        os.replace(part_path, file_path)
+        self._discard_partial(part_path)
+
+        # Set modification time to match remote
+        os.utime(file_path, (file_info['mtime'], file_info['mtime']))
+        self.hash_cache.put(file_path, digest)
+
+    def _download_append(self, file_info):
+        """
+        Fetch only the new tail of an append-only .jsonl chat file
+
+        The server compares our file's hash with the same-length prefix of
+        its copy and only sends the remaining bytes if they match. The tail
+        is appended to a copy of the file, which replaces the original only
+        once its hash is verified, so SillyTavern never sees a half-written
+        or wrong chat.
+
+        Returns:
+            bool: True if the file was completed by appending; False if the
+                file isn't eligible or the prefix differs (download it whole)
+        """
+        if not file_info['path'].endswith('.jsonl'):
+            return False
+        file_path = os.path.join(self.data_path, file_info['path'])
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return False
+        if st.st_size == 0 or st.st_size >= file_info['size']:
             return False
 
-        backup_path = self._last_backup_path
-        if not os.path.exists(backup_path):
-            print("备份文件不存在")
+        base_hash = self.hash_cache.get(file_path, stat_key(st))
+        if base_hash is None:
             return False
 
+        response = self.session.get(
+            f"{self.server_url}/file",
+            params={'path': file_info['path'], 'base_hash': base_hash},
+            headers={'Range': f"bytes={st.st_size}-"},
+            timeout=self.timeout, stream=True
+        )
+        with response:
+            # Without the marker an older server may ignore base_hash
+            if (response.status_code != 206
+                    or response.headers.get('X-Base-Hash') != 'match'
+                    or not response.headers.get('Content-Range', '').startswith(f"bytes {st.st_size}-")):
+                return False
+
+            directory, name = os.path.split(file_path)
+            append_path = os.path.join(directory, f".{name}.append")
+            try:
+                shutil.copyfile(file_path, append_path)
+                if os.path.getsize(append_path) != st.st_size:
+                    # Changed while copying, the server's prefix check no longer applies
+                    return False
+                with open(append_path, 'ab') as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        if chunk:
+                            f.write(chunk)
+
+                digest = hash_file(append_path)
+                expected_hash = file_info.get('hash')
+                if expected_hash and digest != expected_hash:
+                    return False
+
+                os.utime(append_path, (file_info['mtime'], file_info['mtime']))
+                os.replace(append_path, file_path)
+            finally:
+                if os.path.exists(append_path):
+                    os.remove(append_path)
+
+        self.hash_cache.put(file_path, digest)
+        return True
+
+    def _download_file(self, file_info):
+        """Download single file from server"""
         try:
-            print(f"从备份恢复: {backup_path}")
+            try:
+                if self._download_append(file_info):
+                    return True
+            except (requests.exceptions.RequestException, OSError):
+                # Fall back to a full download, which replaces the file
+                pass
+
+            part_path = self._part_path(file_info)
+            self._download_resumable('file', {'path': file_info['path']}, part_path)
+            self._install_part(file_info, part_path)
+            return True
+
+        except Exception as e:
+            print(f"下载文件失败 {file_info['path']}: {e}")
+            return False
+
+    def _download_batch(self, batch):
+        """
+        Download several small files with one POST /files request
+
+        Anything the batch didn't deliver (server error, interrupted stream,
+        hash mismatch) is retried with a regular per-file download.
+
+        Args:
+            batch (list): Remote manifest entries
 
-            # Remove current data
-            if os.path.exists(self.data_path):
-                shutil.rmtree(self.data_path)
+        Returns:
+            list: (file_info, success) pairs
+        """
+        by_path = {f['path']: f for f in batch}
+        received = set()
+
+        if self._batch_supported:
+            response = None
+            try:
+                response = self.session.post(
+                    f"{self.server_url}/files", json={'paths': list(by_path)},
+                    timeout=self.timeout, stream=True
+                )
+                if response.status_code in (404, 405):
+                    # Older server without the batch endpoint
+                    self._batch_supported = False
+                    print("服务器不支持批量下载，改为逐个下载")
+                else:
+                    response.raise_for_status()
+                    reader = BatchReader(response.raw)
+                    while True:
+                        header = reader.next_entry()
+                        if header is None:
+                            break
+                        file_info = by_path.get(header.get('path'))
+                        if 'error' in header:
+                            continue
+                        if file_info is None:
+                            for _ in reader.iter_content(header['size']):
+                                pass
+                            continue
+
+                        part_path = self._part_path(file_info)
+                        with open(part_path, 'wb') as f:
+                            for chunk in reader.iter_content(header['size']):
+                                f.write(chunk)
+                        try:
+                            self._install_part(file_info, part_path)
+                            received.add(file_info['path'])
+                        except Exception as e:
+                            print(f"批量下载文件失败 {file_info['path']}: {e}")
+
+            except (requests.exceptions.RequestException, OSError, BatchFormatError, ValueError) as e:
+                print(f"批量下载中断 ({e})，改为逐个下载剩余文件")
+            finally:
+                if response is not None:
+                    response.close()
+
+        return [
+            (f, f['path'] in received or self._download_file(f))
+            for f in batch
+        ]
+
+    def _backup_existing_data(self):
+        """Snapshot existing data directory (unchanged files are hardlinked)"""
+        if not os.path.exists(self.data_path) or not os.listdir(self.data_path):
+            print("本地数据目录为空，无需备份")
+            return True
 
-            # Restore backup
-            shutil.copytree(backup_path, self.data_path)
-            print("数据恢复完成")
+        store = self._snapshot_store()
+        try:
+            print(f"创建数据快照到: {store.backup_dir}")
+            backup_path, stats = store.create(self.data_path)
+            print(f"快照完成: {os.path.basename(backup_path)} "
+                  f"(链接 {stats['linked']} 个未变文件，复制 {stats['copied']} 个文件 "
+                  f"{self._format_size(stats['copied_bytes'])})")
+
+            for path in store.prune():
+                print(f"已清理旧快照: {os.path.basename(path)}")
             return True
 
         except Exception as e:
-            print(f"恢复备份失败: {e}")
+            print(f"备份失败: {e}")
             return False
 
-    def _extract_zip_with_progress(self, zip_path, extract_path):
-        """Extract ZIP file with progress reporting"""
-        with zipfile.ZipFile(zip_path, 'r') as zip_file:
-            files = zip_file.namelist()
-            total_files = len(files)
+    def _snapshot_store(self):
+        """Snapshot store for this data folder"""
+        return SnapshotStore(
+            self.backup_dir, os.path.basename(os.path.normpath(self.data_path)),
+            keep_last=self.backup_keep_last, keep_daily=self.backup_keep_daily
+        )
 
-            for i, file in enumerate(files, 1):
-                # Skip directories
-                if file.endswith('/'):
-                    continue
+    def _stream_extract_zip(self, extract_path):
+        """
+        Download /zip and extract it while it arrives
 
-                # Extract file
-                zip_file.extract(file, extract_path)
+        After a connection failure the transfer resumes with Range + If-Range
+        from the first entry that isn't fully extracted yet; if the archive
+        changed in between, the server sends it whole and extraction restarts.
 
-                # Show progress for large archives
-                if total_files > 10 and i % max(1, total_files // 10) == 0:
-                    progress = (i / total_files) * 100
-                    print(f"解压进度: {i}/{total_files} ({progress:.1f}%)")
+        Args:
+            extract_path (str): Empty staging directory to extract into
+
+        Returns:
+            list: Relative paths of the extracted files
+        """
+        url = f"{self.server_url}/zip"
+        state = {'offset': 0, 'files': 0, 'bytes': 0, 'percent': -1, 'total': None,
+                 'reused': 0, 'reused_bytes': 0}
+        extracted = []
+        etag = None
+        attempt = 0
+
+        def reuse(name, file_size, crc):
+            # Identical file in the current data folder (same filesystem as staging)
+            local_path = os.path.join(self.data_path, *name.split('/'))
+            try:
+                st = os.stat(local_path)
+            except OSError:
+                return None
+            if st.st_size != file_size or self.hash_cache.get_crc(local_path, stat_key(st)) != crc:
+                return None
+            return local_path
+
+        def on_entry(name, file_size, next_offset, reused):
+            state['offset'] = next_offset
+            state['files'] += 1
+            extracted.append(name)
+            state['bytes'] += file_size
+            if reused:
+                state['reused'] += 1
+                state['reused_bytes'] += file_size
+            total = state['total']
+            if total:
+                percent = int(next_offset * 100 / total)
+                if percent // 10 != state['percent'] // 10:
+                    state['percent'] = percent
+                    print(f"解压进度: {state['files']} 个文件 ({percent}%) - "
+                          f"{self._format_size(state['bytes'])}")
+            elif state['files'] % 500 == 0:
+                print(f"解压进度: {state['files']} 个文件 - {self._format_size(state['bytes'])}")
+
+        while True:
+            headers = {}
+            if state['offset'] and etag:
+                headers['Range'] = f"bytes={state['offset']}-"
+                headers['If-Range'] = etag
+
+            try:
+                params = {} if self.zip_level is None else {'level': self.zip_level}
+                response = self.session.get(url, params=params, headers=headers,
+                                            timeout=self.timeout, stream=True)
+                with response:
+                    if response.status_code == 416:
+                        state['offset'] = 0
+                    response.raise_for_status()
+                    if response.status_code == 206:
+                        content_range = response.headers.get('Content-Range', '')
+                        if not content_range.startswith(f"bytes {state['offset']}-"):
+                            raise requests.exceptions.RequestException("续传位置不匹配")
+                        print(f"从 {self._format_size(state['offset'])} 处继续传输")
+                    else:
+                        # Full archive (first attempt, or it changed meanwhile);
+                        # drop entries of an outdated archive from the staging folder
+                        if state['files']:
+                            shutil.rmtree(extract_path)
+                            os.makedirs(extract_path)
+                        state.update(offset=0, files=0, bytes=0, percent=-1,
+                                     reused=0, reused_bytes=0)
+                        extracted.clear()
+                        length = response.headers.get('Content-Length')
+                        state['total'] = int(length) if length else None
+
+                    etag = response.headers.get('ETag')
+                    extract_stream(
+                        response.iter_content(chunk_size=64 * 1024), extract_path,
+                        offset=state['offset'], on_entry=on_entry, reuse=reuse
+                    )
+
+                self.hash_cache.flush()
+                print(f"已解压 {state['files']} 个文件 ({self._format_size(state['bytes'])})")
+                if state['reused']:
+                    print(f"跳过 {state['reused']} 个未变文件，"
+                          f"避免写入 {self._format_size(state['reused_bytes'])}")
+                return extracted
+
+            except (requests.exceptions.RequestException, ZipStreamError, OSError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise Exception(f"ZIP 传输失败: {e}")
+                delay = min(self.retry_backoff * (2 ** (attempt - 1)), 60)
+                print(f"传输中断 ({e})，{delay:.0f} 秒后重试 ({attempt}/{self.max_retries})...")
+                time.sleep(delay)
 
     def _format_size(self, size_bytes):
         """Format file size in human readable format"""
@@ -414,26 +1806,41 @@ def main():
     parser = argparse.ArgumentParser(description='SillyTavern 数据同步客户端')
     parser.add_argument('server_url', help='服务器地址 (例如: http://192.168.1.100:5000)')
     parser.add_argument('--data-path', '-d', help='本地数据目录路径 (默认自动检测)')
-    parser.add_argument('--method', '-m', choices=['zip', 'incremental', 'auto'],
-                       default='auto', help='同步方法 (默认: auto)')
+    parser.add_argument('--method', '-m', choices=['zip', 'incremental', 'auto', 'twoway'],
+                       default='auto', help='同步方法 (默认: auto, twoway=双向同步)')
     parser.add_argument('--no-backup', action='store_true', help='ZIP同步时不备份现有数据')
     parser.add_argument('--timeout', '-t', type=int, default=30, help='请求超时时间 (秒)')
+    parser.add_argument('--jobs', '-j', type=int, default=4, help='增量同步并发下载数 (默认: 4)')
+    parser.add_argument('--dry-run', action='store_true', help='只显示同步计划，不修改文件')
+    parser.add_argument('--zip-level', type=int, choices=range(10), metavar='0-9',
+                       help='ZIP压缩级别 (0=不压缩, 默认由服务器决定)')
+    parser.add_argument('--watch', action='store_true', help='同步后持续监听服务器变更并实时应用')
 
     args = parser.parse_args()
 
     try:
-        client = SyncClient(args.server_url, args.data_path, args.timeout)
+        client = SyncClient(args.server_url, args.data_path, args.timeout, jobs=args.jobs)
+        client.zip_level = args.zip_level
 
         # Choose sync method
-        prefer_zip = args.method in ['zip', 'auto']
         backup = not args.no_backup
 
-        if args.method == 'incremental':
+        if args.watch:
+            try:
+                success = client.watch()
+            except KeyboardInterrupt:
+                print("\n已停止监听")
+                success = True
+        elif args.dry_run:
+            success = client.sync(method=args.method, backup=backup, dry_run=True)
+        elif args.method == 'incremental':
             success = client.sync_incremental()
         elif args.method == 'zip':
             success = client.sync_full_zip(backup=backup)
+        elif args.method == 'twoway':
+            success = client.sync_bidirectional()
         else:  # auto
-            success = client.sync(prefer_zip=prefer_zip, backup=backup)
+            success = client.sync(method='auto', backup=backup)
 
         if success:
             print("同步完成!")
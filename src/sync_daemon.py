@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Daemon
+Runs SyncServer as a detached background process with a pidfile and a
+UNIX-domain control socket (status / stop / reload)
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+# Add current directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+PID_FILE = "sync_daemon.pid"
+SOCKET_FILE = "sync_daemon.sock"
+LOG_FILE = "sync_daemon.log"
+
+
+def _paths(run_dir):
+    """(pidfile, control socket, log file) inside run_dir"""
+    return tuple(os.path.join(run_dir, name) for name in (PID_FILE, SOCKET_FILE, LOG_FILE))
+
+
+def _is_daemon(pid):
+    """Check whether pid is a live sync daemon process"""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        # Zombies have an empty cmdline; a reused PID runs something else
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            return b'sync_daemon' in f.read()
+    except OSError:
+        return True
+
+
+def _read_sync_config(run_dir):
+    """
+    Read the 'sync' section of run_dir/config.json
+
+    Unlike ConfigManager this never writes a default config, so callers
+    can tell which settings were actually configured.
+
+    Returns:
+        dict: Sync settings present in the file (empty if there is none)
+    """
+    try:
+        with open(os.path.join(run_dir, "config.json"), 'r') as f:
+            sync = json.load(f).get("sync")
+    except (OSError, ValueError, AttributeError):
+        return {}
+    return sync if isinstance(sync, dict) else {}
+
+
+def _read_pid(pid_path):
+    """PID recorded in the pidfile if that process is still a live daemon, else None"""
+    try:
+        with open(pid_path, 'r') as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    return pid if _is_daemon(pid) else None
+
+
+def daemon_pid(run_dir=None):
+    """
+    PID of the daemon serving run_dir, even if its control socket is busy
+
+    Returns:
+        int: PID, or None if no daemon is running
+    """
+    return _read_pid(_paths(os.path.abspath(run_dir or os.getcwd()))[0])
+
+
+def send_command(run_dir, command, timeout=10):
+    """
+    Send a command to the running daemon
+
+    Args:
+        run_dir (str): Directory holding the daemon's control socket
+        command (str): 'status', 'stop' or 'reload'
+        timeout (float): Seconds to wait for the reply
+
+    Returns:
+        dict: Reply from the daemon, or None if it isn't reachable
+    """
+    sock_path = _paths(run_dir)[1]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(sock_path)
+            sock.sendall(json.dumps({'command': command}).encode('utf-8') + b'\n')
+            data = b''
+            while not data.endswith(b'\n'):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        return json.loads(data.decode('utf-8')) if data else None
+    except (OSError, ValueError):
+        return None
+
+
+def _port_free(host, port):
+    """Check that the HTTP port can be bound, before the daemon spends time indexing"""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            # Same option as the HTTP server, so a port in TIME_WAIT counts as free
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((host, port))
+        return True
+    except OSError:
+        return False
+
+
+def start_daemon(data_path, port, host='0.0.0.0', engine='pooled', run_dir=None, timeout=60):
+    """
+    Launch the daemon as a detached process and wait until it answers
+
+    The daemon answers on its control socket while the first index scan is
+    still running (status 'indexing'), so a large data folder doesn't count
+    against the timeout.
+
+    Args:
+        data_path (str): SillyTavern data directory to serve
+        port (int): HTTP port
+        host (str): HTTP host address
+        engine (str): SyncServer engine
+        run_dir (str): Directory for pidfile, socket, log and index
+            (default: current directory)
+        timeout (float): Seconds to wait for the control socket to come up
+
+    Returns:
+        dict: Daemon status ('running' or 'indexing'), or None if it failed
+            to start
+    """
+    run_dir = os.path.abspath(run_dir or os.getcwd())
+    pid_path, _, log_path = _paths(run_dir)
+
+    status = send_command(run_dir, 'status')
+    if status is not None:
+        print(f"同步守护进程已在运行 (PID {status['pid']})")
+        return status
+
+    command = [
+        sys.executable, '-u', os.path.abspath(__file__), 'run',
+        '--data-path', data_path, '--port', str(port), '--host', host,
+        '--engine', engine, '--run-dir', run_dir
+    ]
+    with open(log_path, 'ab') as log:
+        # New session: the daemon survives the terminal and the launcher
+        process = subprocess.Popen(
+            command, cwd=run_dir, stdin=subprocess.DEVNULL, stdout=log,
+            stderr=subprocess.STDOUT, start_new_session=True
+        )
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            print(f"同步守护进程启动失败，详见日志: {log_path}")
+            return None
+        status = send_command(run_dir, 'status', timeout=2)
+        if status is not None and (status.get('running') or status.get('indexing')):
+            return status
+        time.sleep(0.2)
+
+    print(f"等待同步守护进程超时，详见日志: {log_path}")
+    return None
+
+
+def stop_daemon(run_dir=None, timeout=30):
+    """
+    Stop the running daemon
+
+    Falls back to SIGTERM via the pidfile when the control socket doesn't
+    answer.
+
+    Returns:
+        bool: True if a daemon was stopped
+    """
+    run_dir = os.path.abspath(run_dir or os.getcwd())
+    pid_path = _paths(run_dir)[0]
+    pid = _read_pid(pid_path)
+
+    reply = send_command(run_dir, 'stop')
+    if reply is None:
+        if pid is None:
+            return False
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            return False
+    elif pid is None:
+        pid = reply.get('pid')
+
+    deadline = time.monotonic() + timeout
+    while pid is not None and time.monotonic() < deadline:
+        if not _is_daemon(pid):
+            return True
+        time.sleep(0.2)
+    return pid is None
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            reply = self.server.daemon.handle_command(request.get('command'))
+        except ValueError:
+            reply = {'success': False, 'error': 'invalid request'}
+        self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+
+
+class _ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class SyncDaemon:
+    def __init__(self, data_path, port, host='0.0.0.0', engine='pooled', run_dir=None):
+        """
+        Initialize sync daemon (runs inside the detached process)
+
+        Args:
+            data_path (str): SillyTavern data directory to serve
+            port (int): HTTP port
+            host (str): HTTP host address
+            engine (str): SyncServer engine
+            run_dir (str): Directory for pidfile, socket and index
+        """
+        self.data_path = data_path
+        self.port = port
+        self.host = host
+        self.engine = engine
+        self.run_dir = os.path.abspath(run_dir or os.getcwd())
+        self.pid_path, self.sock_path, _ = _paths(self.run_dir)
+        self.server = None
+        self.control = None
+        self.started = None
+        self.stopping = threading.Event()
+
+    def _write_pidfile(self):
+        """Claim the pidfile; False if another daemon owns it"""
+        if _read_pid(self.pid_path) not in (None, os.getpid()):
+            return False
+        temp_path = f"{self.pid_path}.{os.getpid()}"
+        with open(temp_path, 'w') as f:
+            f.write(str(os.getpid()))
+        os.replace(temp_path, self.pid_path)
+        return True
+
+    def _warm_caches(self):
+        """Hash changed files in the background so hash manifests are ready"""
+        def warm():
+            try:
+                self.server.index.refresh()
+                self.server.index.manifest(with_hash=True)
+                self.server.index.hash_cache.flush()
+                print("文件哈希缓存已预热")
+            except Exception as e:
+                print(f"预热缓存失败: {e}")
+
+        threading.Thread(target=warm, daemon=True).start()
+
+    def handle_command(self, command):
+        """
+        Execute a control command
+
+        Args:
+            command (str): 'status', 'stop' or 'reload'
+
+        Returns:
+            dict: Reply sent back over the control socket
+        """
+        if command == 'status':
+            return self.status()
+        if command == 'stop':
+            self.stopping.set()
+            return {'success': True, 'pid': os.getpid()}
+        if command == 'reload':
+            return self.reload()
+        return {'success': False, 'error': f'unknown command: {command}'}
+
+    def status(self):
+        """Current daemon state ('indexing' until the first index scan is done)"""
+        if self.server is None:
+            return {
+                'success': True,
+                'pid': os.getpid(),
+                'running': False,
+                'indexing': True,
+                'host': self.host,
+                'port': self.port,
+                'engine': self.engine,
+                'data_path': self.data_path,
+                'uptime': int(time.time() - self.started)
+            }
+        index = self.server.index
+        file_count, total_size = index.totals()
+        return {
+            'success': True,
+            'pid': os.getpid(),
+            'running': self.server.running,
+            'indexing': False,
+            'host': self.server.host,
+            'port': self.server.port,
+            'engine': self.server.engine,
+            'allow_upload': self.server.allow_upload,
+            'data_path': self.data_path,
+            'uptime': int(time.time() - self.started),
+            'file_count': file_count,
+            'total_size': total_size,
+            'generation': index.generation,
+            'watching': index.watching
+        }
+
+    def reload(self):
+        """
+        Re-read the sync config, rebind if the address changed and rescan
+
+        Only settings present in config.json are applied; anything missing
+        keeps the value the daemon is running with.
+
+        Returns:
+            dict: Status after reloading
+        """
+        if self.server is None:
+            return {'success': False, 'error': '正在建立文件索引，请稍后再试'}
+        config = _read_sync_config(self.run_dir)
+        host = config.get("host", self.server.host)
+        port = config.get("port", self.server.port)
+        self.server.allow_upload = bool(config.get("allow_upload", self.server.allow_upload))
+        if (host, port) != (self.server.host, self.server.port):
+            print(f"监听地址变更为 {host}:{port}")
+            if not self.server.restart(host, port):
+                return {'success': False, 'error': f'无法监听 {host}:{port}'}
+
+        changed = self.server.index.refresh(force=True)
+        print(f"已重新加载: 索引更新 {changed} 项变更")
+        self._warm_caches()
+        return self.status()
+
+    def run(self):
+        """
+        Serve until stopped via the control socket, SIGTERM or SIGINT
+
+        Returns:
+            int: Exit code
+        """
+        from sync_server import SyncServer
+
+        if not self._write_pidfile():
+            print(f"另一个同步守护进程正在运行 (PID {_read_pid(self.pid_path)})")
+            return 1
+
+        try:
+            if not _port_free(self.host, self.port):
+                print(f"无法监听 {self.host}:{self.port}: 端口已被占用")
+                return 1
+            self.started = time.time()
+
+            # Answer status/stop while the first index scan is still running
+            if os.path.exists(self.sock_path):
+                # Left behind by a daemon that didn't exit cleanly
+                os.remove(self.sock_path)
+            self.control = _ControlServer(self.sock_path, _ControlHandler)
+            self.control.daemon = self
+            threading.Thread(target=self.control.serve_forever, daemon=True).start()
+
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stopping.set())
+            signal.signal(signal.SIGINT, lambda signum, frame: self.stopping.set())
+            signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+                target=self.reload, daemon=True).start())
+
+            # SyncServer scans the data folder when created; build it in the
+            # background so a stop request doesn't have to wait for the scan
+            built = threading.Event()
+
+            def build():
+                try:
+                    self.server = SyncServer(
+                        data_path=self.data_path, port=self.port, host=self.host,
+                        engine=self.engine,
+                        allow_upload=bool(_read_sync_config(self.run_dir).get("allow_upload", False))
+                    )
+                except Exception as e:
+                    print(f"初始化同步服务器失败: {e}")
+                finally:
+                    built.set()
+
+            threading.Thread(target=build, daemon=True).start()
+            while not built.is_set():
+                if self.stopping.wait(0.2):
+                    print("建立文件索引时收到停止请求")
+                    return 0
+            if self.server is None or not self.server.start(block=False):
+                return 1
+
+            print(f"同步守护进程已启动 (PID {os.getpid()})")
+            self._warm_caches()
+            while not self.stopping.wait(1):
+                pass
+
+            print("正在停止同步守护进程...")
+            return 0
+        finally:
+            if self.control is not None:
+                self.control.shutdown()
+                self.control.server_close()
+            if self.server is not None:
+                self.server.stop()
+                self.server.index.close()
+            for path in (self.sock_path, self.pid_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def main():
+    """Entry point of the detached daemon process"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SillyTavern 数据同步守护进程')
+    parser.add_argument('command', choices=['run', 'start', 'stop', 'status', 'reload'])
+    parser.add_argument('--data-path', '-d', help='SillyTavern数据目录路径')
+    parser.add_argument('--port', '-p', type=int, default=9999, help='服务器端口 (默认: 9999)')
+    parser.add_argument('--host', default='0.0.0.0', help='服务器主机地址 (默认: 0.0.0.0)')
+    parser.add_argument('--engine', choices=['pooled', 'werkzeug'], default='pooled',
+                       help='服务器引擎 (默认: pooled)')
+    parser.add_argument('--run-dir', help='pid/socket/索引文件目录 (默认: 当前目录)')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        daemon = SyncDaemon(args.data_path, args.port, args.host, args.engine, args.run_dir)
+        return daemon.run()
+
+    if args.command == 'start':
+        if not args.data_path:
+            print("请提供数据目录: --data-path")
+            return 1
+        status = start_daemon(args.data_path, args.port, args.host, args.engine, args.run_dir)
+        return 0 if status else 1
+
+    if args.command == 'stop':
+        if stop_daemon(args.run_dir):
+            print("同步守护进程已停止")
+            return 0
+        print("同步守护进程未运行")
+        return 1
+
+    reply = send_command(os.path.abspath(args.run_dir or os.getcwd()), args.command)
+    if reply is None:
+        print("同步守护进程未运行")
+        return 1
+    print(json.dumps(reply, ensure_ascii=False, indent=2))
+    return 0 if reply.get('success') else 1
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Server Discovery
+Finds sync servers on the local network by a UDP broadcast query answered by
+running servers and a concurrent /health scan of the local /24, ranked by latency
+"""
+
+import ipaddress
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+DISCOVERY_PORT = 9998
+DISCOVERY_QUERY = b'ST-SYNC-DISCOVER 1'
+SERVICE_NAME = 'sillytavern-sync'
+
+
+def local_ipv4():
+    """
+    Address of the interface that carries the default route
+
+    Returns:
+        str: IPv4 address, or None if there is no usable network
+    """
+    try:
+        # Connecting a UDP socket only picks a route, nothing is sent
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            address = s.getsockname()[0]
+    except OSError:
+        return None
+    return None if address.startswith('127.') else address
+
+
+def probe_server(server_url, timeout=1.0):
+    """
+    Check whether a sync server answers /health
+
+    Args:
+        server_url (str): Base URL, e.g. http://192.168.1.100:9999
+        timeout (float): Connect and read timeout in seconds
+
+    Returns:
+        dict: {'url', 'latency', 'data_path'}, or None if nothing healthy answered
+    """
+    server_url = server_url.rstrip('/')
+    try:
+        started = time.monotonic()
+        response = requests.get(f"{server_url}/health", timeout=timeout)
+        latency = time.monotonic() - started
+        data = response.json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+    if response.status_code != 200 or data.get('status') != 'healthy':
+        return None
+    return {'url': server_url, 'latency': latency, 'data_path': data.get('data_path')}
+
+
+def probe_servers(server_urls, timeout=2.0, workers=16):
+    """
+    Probe several servers at once for latency and data totals
+
+    Args:
+        server_urls (list): Base URLs
+        timeout (float): Per-request timeout in seconds
+        workers (int): Concurrent probes
+
+    Returns:
+        list: One {'url', 'reachable', 'latency', 'file_count', 'total_size'}
+            dict per URL (values None when unknown), reachable servers
+            first, fastest first
+    """
+    def probe(url):
+        result = {'url': url, 'reachable': False, 'latency': None,
+                  'file_count': None, 'total_size': None}
+        health = probe_server(url, timeout)
+        if health is None:
+            return result
+        result.update(reachable=True, latency=health['latency'])
+        try:
+            info = requests.get(f"{health['url']}/info", timeout=timeout).json()
+            result['file_count'] = info['server_info']['file_count']
+            result['total_size'] = info['server_info']['total_size']
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+            # Reachable but without totals, still usable for syncing
+            pass
+        return result
+
+    if not server_urls:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(len(server_urls), workers))) as pool:
+        results = list(pool.map(probe, server_urls))
+    return sorted(results, key=lambda r: (not r['reachable'], r['latency'] or 0))
+
+
+def _port_open(host, port, timeout):
+    """Quick TCP connect check, so only listening hosts get an HTTP request"""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def scan_subnet(port=9999, address=None, timeout=0.5, workers=128):
+    """
+    Probe every host of the local /24 for a sync server
+
+    Args:
+        port (int): Sync server port
+        address (str): Address inside the network to scan (default: the
+            detected interface address)
+        timeout (float): Per-host connect timeout in seconds
+        workers (int): Concurrent probes
+
+    Returns:
+        list: Responders as returned by probe_server
+    """
+    address = address or local_ipv4()
+    if address is None:
+        return []
+    network = ipaddress.ip_network(f"{address}/24", strict=False)
+
+    def check(host):
+        if not _port_open(str(host), port, timeout):
+            return None
+        return probe_server(f"http://{host}:{port}", timeout=timeout * 2)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(check, network.hosts())
+        return [result for result in results if result is not None]
+
+
+def query_broadcast(timeout=1.0, discovery_port=DISCOVERY_PORT, address=None):
+    """
+    Ask running servers to identify themselves via UDP broadcast
+
+    Args:
+        timeout (float): Seconds to collect answers
+        discovery_port (int): UDP port servers listen on
+        address (str): Local interface address, used for the directed
+            broadcast of its /24
+
+    Returns:
+        dict: Server URL -> name it announced
+    """
+    address = address or local_ipv4()
+    targets = ['255.255.255.255']
+    if address is not None:
+        targets.append(str(ipaddress.ip_network(f"{address}/24", strict=False).broadcast_address))
+
+    servers = {}
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        for target in targets:
+            try:
+                sock.sendto(DISCOVERY_QUERY, (target, discovery_port))
+            except OSError:
+                # No route for this broadcast address
+                continue
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, (host, _) = sock.recvfrom(4096)
+                reply = json.loads(data.decode('utf-8'))
+            except socket.timeout:
+                break
+            except (OSError, ValueError):
+                continue
+            # Anyone on the network can answer, so ignore malformed replies
+            if not isinstance(reply, dict) or reply.get('service') != SERVICE_NAME:
+                continue
+            try:
+                port = int(reply.get('port'))
+            except (TypeError, ValueError):
+                continue
+            if not 1 <= port <= 65535:
+                continue
+            name = reply.get('name')
+            servers[f"http://{host}:{port}"] = name if isinstance(name, str) else None
+    return servers
+
+
+def discover(port=9999, timeout=0.5, broadcast_timeout=1.0, workers=128):
+    """
+    Find sync servers on the local network
+
+    The UDP query and the subnet scan run at the same time; servers found
+    by the broadcast are probed over HTTP as well, so every result has a
+    measured latency.
+
+    Args:
+        port (int): Port scanned on every host of the /24
+        timeout (float): Per-host connect timeout of the scan
+        broadcast_timeout (float): Seconds to wait for UDP answers
+        workers (int): Concurrent scan probes
+
+    Returns:
+        list: {'url', 'latency', 'data_path', 'source', 'name'} dicts,
+            fastest first; source is 'scan' or 'broadcast' and name is
+            only known for servers that answered the broadcast
+    """
+    address = local_ipv4()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        scan = pool.submit(scan_subnet, port, address, timeout, workers)
+        broadcast = pool.submit(query_broadcast, broadcast_timeout, DISCOVERY_PORT, address)
+        scanned = scan.result()
+        announced = broadcast.result()
+
+    found = {}
+    for result in scanned:
+        found[result['url']] = dict(result, source='scan', name=announced.get(result['url']))
+    # Servers on another port, or hosts the scan couldn't reach in time
+    unknown = [url for url in announced if url not in found]
+    with ThreadPoolExecutor(max_workers=max(1, min(len(unknown), 16))) as pool:
+        for result in pool.map(lambda url: probe_server(url, timeout * 2), unknown):
+            if result is not None:
+                found[result['url']] = dict(result, source='broadcast',
+                                            name=announced[result['url']])
+
+    return sorted(found.values(), key=lambda result: result['latency'])
+
+
+class DiscoveryResponder:
+    def __init__(self, http_port, name=None, discovery_port=DISCOVERY_PORT, host='0.0.0.0'):
+        """
+        Answer discovery queries for a running sync server
+
+        Args:
+            http_port (int): Port of the sync server being announced
+            name (str): Name shown to clients (default: host name)
+            discovery_port (int): UDP port to listen on
+            host (str): Address the sync server listens on; for a single
+                interface address only queries from that address's /24 are
+                answered
+        """
+        self.http_port = http_port
+        self.name = name or socket.gethostname()
+        self.discovery_port = discovery_port
+        self.network = None
+        if host not in ('', '0.0.0.0'):
+            self.network = ipaddress.ip_network(f"{socket.gethostbyname(host)}/24", strict=False)
+        self.sock = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """
+        Start listening
+
+        Returns:
+            bool: False if the UDP port couldn't be bound
+        """
+        if self.running:
+            return True
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Several servers on one machine can share the discovery port
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            except OSError:
+                pass
+        try:
+            # Broadcasts only reach sockets bound to the wildcard address,
+            # so a single-interface server filters by sender instead
+            sock.bind(('', self.discovery_port))
+        except OSError:
+            sock.close()
+            return False
+        sock.settimeout(0.5)
+
+        self.sock = sock
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stop listening"""
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join(timeout=2)
+        self.thread = None
+        self.sock.close()
+        self.sock = None
+
+    def _run(self):
+        while self.running:
+            try:
+                data, sender = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if data.strip() != DISCOVERY_QUERY:
+                continue
+            if self.network is not None and ipaddress.ip_address(sender[0]) not in self.network:
+                continue
+            reply = json.dumps({
+                'service': SERVICE_NAME,
+                'port': self.http_port,
+                'name': self.name
+            }).encode('utf-8')
+            try:
+                self.sock.sendto(reply, sender)
+            except OSError:
+                pass
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Change Notifications
+Turns watcher events (or periodic polling without inotify) into debounced
+index refreshes and wakes clients long-polling /events
+"""
+
+import threading
+import time
+
+
+class ChangeNotifier:
+    def __init__(self, index, debounce=0.5, max_delay=2.0, poll_interval=5.0):
+        """
+        Initialize change notifier
+
+        Args:
+            index (ManifestIndex): Index to refresh and report on
+            debounce (float): Quiet time after the last event before refreshing
+            max_delay (float): Refresh at the latest this long after the first
+                event of a burst (e.g. a chat being appended to continuously)
+            poll_interval (float): Rescan period while clients are waiting
+                and no watcher is available
+        """
+        self.index = index
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.cond = threading.Condition()
+        self.poked = threading.Event()
+        self.waiters = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the refresh thread"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the refresh thread and release waiting clients"""
+        self.running = False
+        self.poked.set()
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+
+    def poke(self, rel_dir=None):
+        """Watcher callback: something below the data path changed"""
+        self.poked.set()
+
+    def _run(self):
+        while self.running:
+            polling = not self.index.watching and self.waiters > 0
+            fired = self.poked.wait(self.poll_interval if polling else None)
+            if not self.running:
+                return
+
+            if fired:
+                # Let a burst of writes settle, but not for longer than max_delay
+                first = time.monotonic()
+                while True:
+                    self.poked.clear()
+                    remaining = self.max_delay - (time.monotonic() - first)
+                    if remaining <= 0 or not self.poked.wait(min(self.debounce, remaining)):
+                        break
+                    if not self.running:
+                        return
+
+            try:
+                # Without a watcher only a full rescan sees in-place edits
+                self.index.refresh(full=not self.index.watching, force=True)
+            except Exception as e:
+                print(f"刷新文件索引失败: {e}")
+                continue
+            with self.cond:
+                self.cond.notify_all()
+
+    def wait(self, since, epoch=None, timeout=25):
+        """
+        Block until the index moves past a generation
+
+        Args:
+            since (int): Generation the client already has
+            epoch (str): Epoch that generation belongs to
+            timeout (float): Longest wait in seconds
+
+        Returns:
+            bool: True if there is something newer (or the epoch changed)
+        """
+        def changed():
+            return (not self.running or self.index.generation > since
+                    or (epoch is not None and epoch != self.index.epoch))
+
+        with self.cond:
+            self.waiters += 1
+            try:
+                if not self.index.watching:
+                    # Check right away, then every poll_interval while waiting
+                    self.poked.set()
+                return self.cond.wait_for(changed, timeout) and self.running
+            finally:
+                self.waiters -= 1
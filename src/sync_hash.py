@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Content Hashing
+BLAKE2 file hashes, CRC32s and ZIP entry layouts backed by a SQLite cache keyed on
+file stat, so only new or changed files are read again
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+HASH_ALGO = 'blake2b-128'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (dev, inode)
+);
+CREATE TABLE IF NOT EXISTS crcs (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    PRIMARY KEY (dev, inode)
+);
+CREATE TABLE IF NOT EXISTS zip_entries (
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    method INTEGER NOT NULL,
+    level INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    compress_size INTEGER NOT NULL,
+    mode INTEGER NOT NULL,
+    PRIMARY KEY (dev, inode, method, level)
+);
+"""
+
+
+def hash_file(file_path, chunk_size=1024 * 1024, length=None):
+    """
+    Hash file content
+
+    Args:
+        file_path (str): File to hash
+        chunk_size (int): Read size
+        length (int): Only hash the first length bytes (None for the whole file)
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    remaining = length
+    with open(file_path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            data = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not data:
+                break
+            digest.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return digest.hexdigest()
+
+
+def crc_file(file_path, chunk_size=1024 * 1024):
+    """
+    Compute the CRC32 of file content (as stored in ZIP headers)
+
+    Args:
+        file_path (str): File to checksum
+        chunk_size (int): Read size
+
+    Returns:
+        int: CRC32
+    """
+    crc = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    return crc
+
+
+def stat_key(st):
+    """Build the (dev, inode, size, mtime_ns) cache key from a stat result"""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class HashCache:
+    def __init__(self, db_path, settle_time=2.0, commit_every=256):
+        """
+        Initialize hash cache
+
+        Args:
+            db_path (str): SQLite database path
+            settle_time (float): Files modified more recently than this are
+                hashed but not cached, since a second write within the same
+                mtime tick would go unnoticed
+            commit_every (int): Number of new hashes per transaction
+        """
+        self.db_path = db_path
+        self.settle_time = settle_time
+        self.commit_every = commit_every
+        self.lock = threading.RLock()
+        self._pending = 0
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def get(self, file_path, key=None):
+        """
+        Get content hash, reading the file only on a cache miss
+
+        Args:
+            file_path (str): File to hash
+            key (tuple): Known (dev, inode, size, mtime_ns), stat'ed if omitted
+
+        Returns:
+            str: Hex digest, or None if the file can't be read
+        """
+        try:
+            if key is None:
+                key = stat_key(os.stat(file_path))
+            dev, inode, size, mtime_ns = key
+
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT size, mtime_ns, hash FROM hashes WHERE dev = ? AND inode = ?",
+                    (dev, inode)
+                ).fetchone()
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                return row[2]
+
+            digest = hash_file(file_path)
+            st = os.stat(file_path)
+        except OSError:
+            return None
+
+        # Only cache when the file didn't change underneath us
+        if stat_key(st) == key:
+            self._store(key, digest)
+        return digest
+
+    def put(self, file_path, digest):
+        """
+        Record a known hash for a file, e.g. one just downloaded and verified
+
+        Args:
+            file_path (str): File the hash belongs to
+            digest (str): Hex digest of the current content
+        """
+        try:
+            key = stat_key(os.stat(file_path))
+        except OSError:
+            return
+        self._store(key, digest)
+
+    def _store(self, key, digest):
+        """Cache a hash unless the file was modified too recently to trust its mtime"""
+        if time.time() - key[3] / 1e9 < self.settle_time:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO hashes (dev, inode, size, mtime_ns, hash) "
+                "VALUES (?, ?, ?, ?, ?)",
+                key + (digest,)
+            )
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self.flush()
+
+    def get_crc(self, file_path, key=None):
+        """
+        Get the CRC32 of a file, reading it only on a cache miss
+
+        Args:
+            file_path (str): File to checksum
+            key (tuple): Known (dev, inode, size, mtime_ns), stat'ed if omitted
+
+        Returns:
+            int: CRC32, or None if the file can't be read
+        """
+        try:
+            if key is None:
+                key = stat_key(os.stat(file_path))
+            dev, inode, size, mtime_ns = key
+
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT size, mtime_ns, crc FROM crcs WHERE dev = ? AND inode = ?",
+                    (dev, inode)
+                ).fetchone()
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                return row[2]
+
+            crc = crc_file(file_path)
+            st = os.stat(file_path)
+        except OSError:
+            return None
+
+        if stat_key(st) == key and time.time() - mtime_ns / 1e9 >= self.settle_time:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO crcs (dev, inode, size, mtime_ns, crc) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    key + (crc,)
+                )
+                self._pending += 1
+                if self._pending >= self.commit_every:
+                    self.flush()
+        return crc
+
+    def get_zip_entry(self, key, method, level):
+        """
+        Get the cached ZIP layout of a file
+
+        Args:
+            key (tuple): (dev, inode, size, mtime_ns) of the file
+            method (int): ZIP compression method
+            level (int): Compression level
+
+        Returns:
+            dict: {'crc', 'compress_size', 'mode'}, or None if unknown
+        """
+        dev, inode, size, mtime_ns = key
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, crc, compress_size, mode FROM zip_entries "
+                "WHERE dev = ? AND inode = ? AND method = ? AND level = ?",
+                (dev, inode, method, level)
+            ).fetchone()
+        if row is None or row[0] != size or row[1] != mtime_ns:
+            return None
+        return {'crc': row[2], 'compress_size': row[3], 'mode': row[4]}
+
+    def put_zip_entry(self, key, method, level, crc, compress_size, mode):
+        """Cache the ZIP layout of a file (see get_zip_entry)"""
+        if time.time() - key[3] / 1e9 < self.settle_time:
+            return
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO zip_entries "
+                "(dev, inode, size, mtime_ns, method, level, crc, compress_size, mode) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (method, level, crc, compress_size, mode)
+            )
+            self._pending += 1
+            if self._pending >= self.commit_every:
+                self.flush()
+
+    def flush(self):
+        """Commit pending cache entries"""
+        with self.lock:
+            if self._pending:
+                self.conn.commit()
+                self._pending = 0
+
+    def prune(self, live_keys):
+        """
+        Drop cache entries for files that no longer exist
+
+        Args:
+            live_keys (iterable): (dev, inode) pairs still in use
+        """
+        live = set(live_keys)
+        with self.lock:
+            stale = [
+                row for row in self.conn.execute("SELECT dev, inode FROM hashes")
+                if row not in live
+            ]
+            self.conn.executemany("DELETE FROM hashes WHERE dev = ? AND inode = ?", stale)
+            stale = [
+                row for row in self.conn.execute("SELECT dev, inode FROM crcs")
+                if row not in live
+            ]
+            self.conn.executemany("DELETE FROM crcs WHERE dev = ? AND inode = ?", stale)
+            stale = [
+                row for row in self.conn.execute("SELECT DISTINCT dev, inode FROM zip_entries")
+                if row not in live
+            ]
+            self.conn.executemany("DELETE FROM zip_entries WHERE dev = ? AND inode = ?", stale)
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self):
+        """Flush and close database connection"""
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
+
+def dir_digest(files, dirs):
+    """
+    Compute a Merkle digest for one directory
+
+    Only names, sizes and content hashes are covered, so the digest does not
+    depend on mtimes or on which device produced it.
+
+    Args:
+        files (dict): name -> manifest entry with 'size' and 'hash'
+        dirs (dict): name -> digest of a non-empty subdirectory
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(files):
+        entry = files[name]
+        digest.update(f"F\0{name}\0{entry['size']}\0{entry.get('hash') or ''}\n".encode('utf-8'))
+    for name in sorted(dirs):
+        digest.update(f"D\0{name}\0{dirs[name]}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def build_digest_tree(manifest):
+    """
+    Build per-directory Merkle digests from a hashed manifest
+
+    Directories without files anywhere below them are left out, so empty
+    folders never make two trees differ.
+
+    Args:
+        manifest (list): Manifest entries with 'path', 'size' and 'hash'
+
+    Returns:
+        dict: dir path ('' for the root) -> {'digest', 'files', 'dirs'}
+    """
+    tree = {'': {'files': {}, 'dirs': {}}}
+    for entry in manifest:
+        parent, _, name = entry['path'].rpartition('/')
+        tree.setdefault(parent, {'files': {}, 'dirs': {}})['files'][name] = entry
+        # Register every ancestor so digests can be rolled up
+        while parent:
+            parent = parent.rpartition('/')[0]
+            if parent in tree:
+                break
+            tree[parent] = {'files': {}, 'dirs': {}}
+
+    # Children before parents
+    for path in sorted(tree, key=lambda p: p.count('/') + (1 if p else 0), reverse=True):
+        node = tree[path]
+        node['digest'] = dir_digest(node['files'], node['dirs'])
+        if path:
+            parent, _, name = path.rpartition('/')
+            tree[parent]['dirs'][name] = node['digest']
+
+    return tree
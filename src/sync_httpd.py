@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync HTTP Engine
+Threaded WSGI server with a bounded worker pool, HTTP/1.1 keep-alive,
+request timeouts and graceful shutdown (no dependencies beyond the stdlib)
+"""
+
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import unquote_to_bytes
+
+from sync_sendfile import SOCKET_KEY
+
+
+class _RequestBody:
+    def __init__(self, rfile, length):
+        """
+        wsgi.input limited to the request's Content-Length
+
+        Args:
+            rfile: Buffered connection reader
+            length (int): Body size
+        """
+        self.rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def drain(self, limit):
+        """Discard the unread body so the next request starts cleanly; False if too large"""
+        if self.remaining > limit:
+            return False
+        while self.remaining:
+            if not self.read(min(self.remaining, 64 * 1024)):
+                return False
+        return True
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Longest request body discarded to keep a connection that the app didn't read
+    drain_limit = 1024 * 1024
+
+    def setup(self):
+        super().setup()
+        self.idle = False
+        self.requests_served = 0
+        self.server.register(self)
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            self.server.unregister(self)
+
+    def handle_one_request(self):
+        """Read one request (waiting keepalive_timeout between requests) and run the app"""
+        server = self.server
+        self.connection.settimeout(
+            server.keepalive_timeout if self.requests_served else server.request_timeout
+        )
+        self.idle = True
+        try:
+            if server.closing:
+                self.close_connection = True
+                return
+            self.raw_requestline = self.rfile.readline(65537)
+        except (OSError, ValueError):
+            # Idle timeout, reset, or the socket was shut down for closing
+            self.close_connection = True
+            return
+        finally:
+            self.idle = False
+
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        self.connection.settimeout(server.request_timeout)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+
+        try:
+            self.run_wsgi()
+        except (OSError, ValueError):
+            # Client went away or stalled past request_timeout
+            self.close_connection = True
+        self.requests_served += 1
+
+    def make_environ(self, body):
+        """Build the WSGI environ for the parsed request"""
+        path, _, query = self.path.partition('?')
+        host, port = self.server.server_address[:2]
+        environ = {
+            'REQUEST_METHOD': self.command,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': str(host),
+            'SERVER_PORT': str(port),
+            'SERVER_PROTOCOL': self.request_version,
+            'REMOTE_ADDR': self.client_address[0],
+            'REMOTE_PORT': str(self.client_address[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            SOCKET_KEY: self.connection,
+        }
+        for key, value in self.headers.items():
+            key = key.upper().replace('-', '_')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+                continue
+            key = 'HTTP_' + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def run_wsgi(self):
+        """Run the application and write its response"""
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            # Clients here always send Content-Length
+            self.send_error(411)
+            self.close_connection = True
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self.send_error(400, "Bad Content-Length")
+            self.close_connection = True
+            return
+
+        body = _RequestBody(self.rfile, max(length, 0))
+        environ = self.make_environ(body)
+        state = {'status': None, 'headers': None, 'sent': False, 'chunked': False}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state['sent']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            state['status'] = status
+            state['headers'] = headers
+            return write
+
+        def send_headers():
+            code, _, message = state['status'].partition(' ')
+            code = int(code)
+            keys = {key.lower() for key, _ in state['headers']}
+            bodyless = self.command == 'HEAD' or code < 200 or code in (204, 304)
+
+            if self.server.closing or self.server.waiting():
+                # Give the worker back so queued connections get served
+                self.close_connection = True
+            if 'content-length' not in keys and not bodyless:
+                if self.request_version == 'HTTP/1.1':
+                    state['chunked'] = True
+                else:
+                    self.close_connection = True
+
+            self.send_response(code, message)
+            for key, value in state['headers']:
+                if key.lower() != 'connection':
+                    self.send_header(key, value)
+            if state['chunked']:
+                self.send_header('Transfer-Encoding', 'chunked')
+            if self.close_connection:
+                self.send_header('Connection', 'close')
+            elif self.request_version != 'HTTP/1.1':
+                self.send_header('Connection', 'keep-alive')
+            self.end_headers()
+            state['sent'] = True
+
+        def write(data):
+            if not state['sent']:
+                send_headers()
+            if data:
+                if state['chunked']:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                else:
+                    self.wfile.write(data)
+
+        try:
+            result = self.server.app(environ, start_response)
+        except Exception:
+            self.server.handle_app_error(self.client_address)
+            self.send_error(500)
+            self.close_connection = True
+            return
+
+        try:
+            for data in result:
+                write(data)
+            if not state['sent']:
+                send_headers()
+            if state['chunked']:
+                self.wfile.write(b'0\r\n\r\n')
+        except Exception as e:
+            self.close_connection = True
+            if not isinstance(e, OSError):
+                self.server.handle_app_error(self.client_address)
+                if not state['sent']:
+                    self.send_error(500)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        if not self.close_connection and not body.drain(self.drain_limit):
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        if self.server.quiet:
+            return
+        super().log_message(format, *args)
+
+
+class PooledWSGIServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 64
+
+    def __init__(self, host, port, app, max_workers=16, request_timeout=60,
+                 keepalive_timeout=15, quiet=True):
+        """
+        Initialize pooled WSGI server
+
+        Connections are handled by at most max_workers threads. Once they
+        are all busy, up to max_workers more connections wait for a worker
+        and the rest stay in the listen backlog. While connections are
+        waiting, finished responses close their connection instead of
+        keeping it alive.
+
+        Args:
+            host (str): Address to bind
+            port (int): Port to bind
+            app: WSGI application
+            max_workers (int): Worker threads
+            request_timeout (int): Seconds a request may stall while being
+                read or written
+            keepalive_timeout (int): Seconds an idle connection is kept open
+            quiet (bool): Don't log every request
+        """
+        if ':' in host:
+            self.address_family = socket.AF_INET6
+        super().__init__((host, port), KeepAliveHandler)
+        self.app = app
+        self.max_workers = max_workers
+        self.request_timeout = request_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.quiet = quiet
+        self.closing = False
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sync-http')
+        self.slots = threading.BoundedSemaphore(max_workers * 2)
+        self.lock = threading.Condition()
+        self.handlers = set()
+        self.queued = 0
+        self.serving = False
+
+    def serve_forever(self, poll_interval=0.5):
+        self.serving = True
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self.serving = False
+
+    def process_request(self, request, client_address):
+        """Hand the connection to the pool (called by serve_forever)"""
+        while not self.slots.acquire(timeout=0.5):
+            if self.closing:
+                self.shutdown_request(request)
+                return
+        with self.lock:
+            self.queued += 1
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        with self.lock:
+            self.queued -= 1
+        try:
+            if not self.closing:
+                self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def waiting(self):
+        """Number of accepted connections waiting for a worker"""
+        return self.queued
+
+    def register(self, handler):
+        with self.lock:
+            self.handlers.add(handler)
+
+    def unregister(self, handler):
+        with self.lock:
+            self.handlers.discard(handler)
+            self.lock.notify_all()
+
+    def handle_app_error(self, client_address):
+        """Report an exception raised by the application"""
+        print(f"处理来自 {client_address[0]} 的请求时出错:", file=sys.stderr)
+        traceback.print_exc()
+
+    def close(self, grace=10):
+        """
+        Stop serving and release the port
+
+        The listening socket is closed first, idle keep-alive connections
+        are dropped, and requests in progress get up to grace seconds to
+        finish before their connections are shut down too.
+
+        Args:
+            grace (float): Seconds to wait for requests in progress
+        """
+        self.closing = True
+        if self.serving:
+            # Must not be called from the serve_forever thread
+            self.shutdown()
+        self.server_close()
+
+        deadline = time.monotonic() + grace
+        with self.lock:
+            while self.handlers:
+                for handler in list(self.handlers):
+                    if handler.idle:
+                        self._shutdown_socket(handler.connection)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.lock.wait(min(remaining, 0.2))
+            for handler in list(self.handlers):
+                self._shutdown_socket(handler.connection)
+        self.pool.shutdown(wait=True)
+
+    def _shutdown_socket(self, sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def make_server(host, port, app, **kwargs):
+    """
+    Create a PooledWSGIServer bound to host:port
+
+    Raises:
+        OSError: The address can't be bound (e.g. port in use)
+    """
+    return PooledWSGIServer(host, port, app, **kwargs)
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Manifest Index
+Persistent SQLite index of the data directory, refreshed incrementally by
+directory mtime so manifests don't require a full tree walk
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sync_hash import HashCache, build_digest_tree
+
+
+SCHEMA_VERSION = '3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs(parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    dev INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files(dir);
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    generation INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    op TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journal_generation ON journal(generation);
+"""
+
+
+def is_ignored_dir(name):
+    """Hidden directories are never synced"""
+    return name.startswith('.')
+
+
+def is_ignored_file(name):
+    """Hidden and temporary files are never synced"""
+    return name.startswith('.') or name.endswith('.tmp')
+
+
+def join_rel(parent, name):
+    """Join relative index paths with forward slashes"""
+    return f"{parent}/{name}" if parent else name
+
+
+class ManifestIndex:
+    def __init__(self, data_path, db_path, min_interval=1.0, full_rescan_interval=600,
+                 journal_limit=20000):
+        """
+        Initialize manifest index
+
+        Directories whose mtime is unchanged are not listed again, because
+        adding, removing or atomically replacing a file (SillyTavern writes
+        through temp file + rename) always bumps the directory mtime. In-place
+        writes are picked up from watcher notifications (mark_dirty) or by a
+        full stat pass every full_rescan_interval seconds.
+
+        Every refresh that changes something bumps the generation counter and
+        records the changed paths in a bounded journal, so clients can ask
+        for changes since a generation they have already seen.
+
+        Args:
+            data_path (str): Data directory to index
+            db_path (str): SQLite database path
+            min_interval (float): Minimum seconds between two quick refreshes
+            full_rescan_interval (float): Seconds between full rescans (0 disables)
+            journal_limit (int): Maximum number of journal entries kept
+        """
+        self.data_path = os.path.abspath(data_path)
+        self.db_path = db_path
+        self.min_interval = min_interval
+        self.full_rescan_interval = full_rescan_interval
+        self.journal_limit = journal_limit
+        self.lock = threading.RLock()
+        self.watching = False
+        self._dirty_dirs = set()
+        self._needs_full = False
+        self._last_refresh = 0
+        self._last_full_refresh = time.time()
+        self._manifest_cache = {}
+        self._tree_cache = None
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+        # Rebuild when the schema is outdated or the index belongs to another data directory
+        meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        if meta.get('schema_version') != SCHEMA_VERSION or meta.get('data_path') != self.data_path:
+            with self.conn:
+                self.conn.execute("DROP TABLE IF EXISTS dirs")
+                self.conn.execute("DROP TABLE IF EXISTS files")
+                self.conn.execute("DROP TABLE IF EXISTS journal")
+                self.conn.execute("DELETE FROM meta")
+                # A new epoch tells clients that old generations are meaningless
+                self.conn.executemany(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)",
+                    [('schema_version', SCHEMA_VERSION), ('data_path', self.data_path),
+                     ('epoch', uuid.uuid4().hex), ('generation', '0'), ('journal_floor', '0')]
+                )
+            meta = dict(self.conn.execute("SELECT key, value FROM meta"))
+        self.conn.executescript(SCHEMA)
+
+        self.epoch = meta['epoch']
+        self.generation = int(meta['generation'])
+        self.journal_floor = int(meta['journal_floor'])
+
+        # Content hashes share the index database
+        self.hash_cache = HashCache(db_path)
+
+    def close(self):
+        """Close database connections"""
+        with self.lock:
+            self.hash_cache.close()
+            self.conn.close()
+
+    def mark_dirty(self, rel_dir):
+        """
+        Force a directory to be re-listed on the next refresh
+
+        Args:
+            rel_dir (str): Directory relative to the data path, or None to
+                request a full rescan (e.g. after lost watcher events)
+        """
+        with self.lock:
+            if rel_dir is None:
+                self._needs_full = True
+            else:
+                self._dirty_dirs.add(rel_dir)
+
+    def refresh(self, full=False, force=False):
+        """
+        Bring the index up to date with the data directory
+
+        Args:
+            full (bool): Re-list every directory instead of only changed ones
+            force (bool): Ignore min_interval throttling
+
+        Returns:
+            int: Number of changed file entries
+        """
+        with self.lock:
+            now = time.time()
+            if self._needs_full or (self.full_rescan_interval and not self.watching
+                                    and now - self._last_full_refresh >= self.full_rescan_interval):
+                full = True
+            if not full and not force:
+                if now - self._last_refresh < self.min_interval:
+                    return 0
+                # With a live watcher, nothing outside the dirty set can have changed
+                if self.watching and not self._dirty_dirs:
+                    return 0
+
+            known_dirs = dict(self.conn.execute("SELECT path, mtime_ns FROM dirs"))
+            dirty_dirs = self._dirty_dirs
+            self._dirty_dirs = set()
+            self._needs_full = False
+            seen_dirs = set()
+            changes = []
+            stack = ['']
+
+            with self.conn:
+                while stack:
+                    rel_dir = stack.pop()
+                    abs_dir = os.path.join(self.data_path, rel_dir)
+                    try:
+                        dir_mtime_ns = os.stat(abs_dir).st_mtime_ns
+                    except OSError:
+                        continue
+                    seen_dirs.add(rel_dir)
+
+                    if (not full and rel_dir not in dirty_dirs
+                            and known_dirs.get(rel_dir) == dir_mtime_ns):
+                        # Listing unchanged - reuse known subdirectories
+                        stack.extend(row[0] for row in self.conn.execute(
+                            "SELECT path FROM dirs WHERE parent = ?", (rel_dir,)
+                        ))
+                        continue
+
+                    subdirs = self._rescan_dir(rel_dir, dir_mtime_ns, changes)
+                    stack.extend(subdirs)
+
+                for rel_dir in set(known_dirs) - seen_dirs:
+                    self._drop_dir_tree(rel_dir, changes)
+
+                if changes:
+                    self._record_changes(changes)
+
+            self._last_refresh = time.time()
+            if full:
+                self._last_full_refresh = self._last_refresh
+            return len(changes)
+
+    def _record_changes(self, changes):
+        """Append changes to the journal under a new generation and trim it"""
+        self.generation += 1
+        self.conn.executemany(
+            "INSERT INTO journal (generation, path, op) VALUES (?, ?, ?)",
+            [(self.generation, path, op) for path, op in changes]
+        )
+
+        cutoff = self.conn.execute(
+            "SELECT seq, generation FROM journal ORDER BY seq DESC LIMIT 1 OFFSET ?",
+            (self.journal_limit,)
+        ).fetchone()
+        if cutoff is not None:
+            self.conn.execute("DELETE FROM journal WHERE seq <= ?", (cutoff[0],))
+            # Generations at or below the floor are no longer complete
+            self.journal_floor = max(self.journal_floor, cutoff[1])
+
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [('generation', str(self.generation)), ('journal_floor', str(self.journal_floor))]
+        )
+
+    def _rescan_dir(self, rel_dir, dir_mtime_ns, changes):
+        """
+        List one directory and update its file rows
+
+        Args:
+            rel_dir (str): Directory relative to the data path
+            dir_mtime_ns (int): Directory mtime at the time of listing
+            changes (list): Receives (path, op) tuples for changed files
+
+        Returns:
+            list: Subdirectory paths
+        """
+        abs_dir = os.path.join(self.data_path, rel_dir)
+        existing = {
+            row[0]: row[1:] for row in self.conn.execute(
+                "SELECT path, size, mtime_ns, inode, dev FROM files WHERE dir = ?", (rel_dir,)
+            )
+        }
+        subdirs = []
+
+        try:
+            entries = list(os.scandir(abs_dir))
+        except OSError:
+            entries = []
+
+        for entry in entries:
+            rel_path = join_rel(rel_dir, entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not is_ignored_dir(entry.name):
+                        subdirs.append(rel_path)
+                    continue
+                if not entry.is_file() or is_ignored_file(entry.name):
+                    continue
+                st = entry.stat()
+            except OSError:
+                # Skip files that can't be accessed
+                continue
+
+            record = (st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev)
+            previous = existing.pop(rel_path, None)
+            if previous != record:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO files (path, dir, size, mtime_ns, inode, dev) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (rel_path, rel_dir) + record
+                )
+                changes.append((rel_path, 'add' if previous is None else 'modify'))
+
+        for rel_path in existing:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+            changes.append((rel_path, 'delete'))
+
+        # Forget subdirectories that disappeared from this listing
+        known_subdirs = {row[0] for row in self.conn.execute(
+            "SELECT path FROM dirs WHERE parent = ?", (rel_dir,)
+        )}
+        for gone in known_subdirs - set(subdirs):
+            self._drop_dir_tree(gone, changes)
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+            (rel_dir, None if rel_dir == '' else rel_dir.rpartition('/')[0], dir_mtime_ns)
+        )
+        return subdirs
+
+    def _drop_dir_tree(self, rel_dir, changes):
+        """Remove a directory and everything below it from the index"""
+        pattern = rel_dir.replace('%', r'\%').replace('_', r'\_') + '/%'
+        changes.extend((row[0], 'delete') for row in self.conn.execute(
+            "SELECT path FROM files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (rel_dir, pattern)
+        ))
+        self.conn.execute(
+            "DELETE FROM files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (rel_dir, pattern)
+        )
+        self.conn.execute(
+            "DELETE FROM dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (rel_dir, pattern)
+        )
+
+    def iter_files(self):
+        """
+        Iterate indexed files ordered by path
+
+        Returns:
+            list: (path, size, mtime_ns, inode, dev) tuples
+        """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT path, size, mtime_ns, inode, dev FROM files ORDER BY path"
+            ).fetchall()
+
+    def totals(self):
+        """
+        Get file count and total size
+
+        Returns:
+            tuple: (file_count, total_size)
+        """
+        with self.lock:
+            count, size = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files"
+            ).fetchone()
+            return count, size
+
+    def manifest(self, with_hash=False):
+        """
+        Get the file manifest, rebuilt only when the index changed
+
+        Args:
+            with_hash (bool): Include content hashes (served from the hash cache)
+
+        Returns:
+            list: Manifest entries in the /manifest format
+        """
+        with self.lock:
+            cached = self._manifest_cache.get(with_hash)
+            if cached is not None and cached[0] == self.generation:
+                return cached[1]
+
+            rows = self.iter_files()
+            manifest = [self._entry(row, with_hash) for row in rows]
+
+            if with_hash:
+                self.hash_cache.prune((row[4], row[3]) for row in rows)
+
+            self._manifest_cache[with_hash] = (self.generation, manifest)
+            return manifest
+
+    def _entry(self, row, with_hash):
+        """Build a manifest entry from a files row"""
+        path, size, mtime_ns, inode, dev = row
+        mtime = mtime_ns / 1e9
+        entry = {
+            'path': path,
+            'size': size,
+            'mtime': mtime,
+            'mtime_ns': mtime_ns,
+            'modified': datetime.fromtimestamp(mtime).isoformat(),
+            'is_dir': False
+        }
+        if with_hash:
+            entry['hash'] = self.hash_cache.get(
+                os.path.join(self.data_path, path), (dev, inode, size, mtime_ns)
+            )
+        return entry
+
+    def changes_since(self, since, epoch=None, with_hash=False):
+        """
+        Get entries changed after a generation
+
+        Args:
+            since (int): Last generation the client has applied
+            epoch (str): Epoch the generation belongs to
+            with_hash (bool): Include content hashes for added/modified files
+
+        Returns:
+            dict: {'epoch', 'generation', 'full_resync', 'changes'}; changes
+                are manifest entries with an 'op' of add/modify/delete
+        """
+        with self.lock:
+            result = {
+                'epoch': self.epoch,
+                'generation': self.generation,
+                'full_resync': False,
+                'changes': []
+            }
+            if ((epoch is not None and epoch != self.epoch)
+                    or since > self.generation or since < self.journal_floor):
+                result['full_resync'] = True
+                return result
+
+            ops = {}
+            for path, op in self.conn.execute(
+                "SELECT path, op FROM journal WHERE generation > ? ORDER BY seq", (since,)
+            ):
+                # Keep 'add' for files created within the window
+                ops[path] = 'add' if ops.get(path) == 'add' and op != 'delete' else op
+
+            for path, op in sorted(ops.items()):
+                row = self.conn.execute(
+                    "SELECT path, size, mtime_ns, inode, dev FROM files WHERE path = ?", (path,)
+                ).fetchone()
+                if row is None:
+                    result['changes'].append({'path': path, 'op': 'delete'})
+                    continue
+                entry = self._entry(row, with_hash)
+                entry['op'] = 'modify' if op == 'delete' else op
+                result['changes'].append(entry)
+
+            if with_hash:
+                # An open cache transaction would lock out the next refresh
+                self.hash_cache.flush()
+            return result
+
+    def tree_node(self, path=''):
+        """
+        Get one directory of the Merkle digest tree
+
+        Args:
+            path (str): Directory relative to the data path ('' for the root)
+
+        Returns:
+            dict: {'path', 'digest', 'files', 'dirs'}; digest is None when the
+                directory holds no files
+        """
+        with self.lock:
+            if self._tree_cache is None or self._tree_cache[0] != self.generation:
+                self._tree_cache = (self.generation,
+                                    build_digest_tree(self.manifest(with_hash=True)))
+            tree = self._tree_cache[1]
+
+        node = tree.get(path)
+        if node is None:
+            return {'path': path, 'digest': None, 'files': [], 'dirs': []}
+
+        return {
+            'path': path,
+            'digest': node['digest'],
+            'files': [
+                {
+                    'name': name,
+                    'size': entry['size'],
+                    'mtime': entry['mtime'],
+                    'hash': entry['hash']
+                }
+                for name, entry in sorted(node['files'].items())
+            ],
+            'dirs': [
+                {'name': name, 'digest': digest}
+                for name, digest in sorted(node['dirs'].items())
+            ]
+        }
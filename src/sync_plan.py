@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Planning
+Diff remote and local manifests into a plan of downloads, deletions and
+renames using hashed lookups only, so planning stays linear in file count;
+bidirectional plans compare both sides with the state of the last sync
+"""
+
+import os
+
+
+class SyncPlan:
+    def __init__(self, download=None, delete=None, skip_count=0, skip_bytes=0):
+        """
+        Initialize sync plan
+
+        Args:
+            download (list): Remote manifest entries to fetch
+            delete (list): Local relative paths to remove
+            skip_count (int): Files already up to date
+            skip_bytes (int): Size of files already up to date
+        """
+        self.download = download or []
+        self.delete = delete or []
+        # (local path to move, remote manifest entry it becomes)
+        self.rename = []
+        self.skip_count = skip_count
+        self.skip_bytes = skip_bytes
+
+    @property
+    def download_bytes(self):
+        """Bytes that have to be transferred"""
+        return sum(entry['size'] for entry in self.download)
+
+    @property
+    def rename_bytes(self):
+        """Bytes saved by moving local files instead of downloading them"""
+        return sum(entry['size'] for _, entry in self.rename)
+
+    def is_empty(self):
+        """Check whether nothing needs to change"""
+        return not (self.download or self.delete or self.rename)
+
+    def count_skipped(self, local_manifest):
+        """
+        Count local files the plan leaves untouched
+
+        Args:
+            local_manifest (list): Local manifest entries with 'path' and 'size'
+        """
+        touched = {entry['path'] for entry in self.download}
+        touched.update(self.delete)
+        touched.update(old for old, _ in self.rename)
+        self.skip_count = 0
+        self.skip_bytes = 0
+        for item in local_manifest:
+            if item['path'] not in touched:
+                self.skip_count += 1
+                self.skip_bytes += item['size']
+
+    def detect_renames(self, local_size, local_hash):
+        """
+        Turn download/delete pairs with identical content into renames
+
+        Deleted files are grouped by size first, so only files that could
+        match a download are hashed.
+
+        Args:
+            local_size (callable): Relative path -> size of the local file, or None
+            local_hash (callable): Relative path -> content hash of the local file
+        """
+        if not self.delete or not self.download:
+            return
+
+        candidates = {}
+        sizes = {entry['size'] for entry in self.download if entry.get('hash')}
+        for path in self.delete:
+            size = local_size(path)
+            if size in sizes:
+                candidates.setdefault(size, []).append(path)
+        if not candidates:
+            return
+
+        by_hash = {}
+        for size, paths in candidates.items():
+            for path in paths:
+                digest = local_hash(path)
+                if digest:
+                    by_hash.setdefault((size, digest), []).append(path)
+
+        remaining = []
+        renamed = set()
+        for entry in self.download:
+            sources = by_hash.get((entry['size'], entry.get('hash')))
+            if sources:
+                source = sources.pop()
+                self.rename.append((source, entry))
+                renamed.add(source)
+            else:
+                remaining.append(entry)
+
+        self.download = remaining
+        self.delete = [path for path in self.delete if path not in renamed]
+
+
+def diff_manifests(remote_manifest, local_manifest, is_changed):
+    """
+    Compare full remote and local manifests
+
+    Args:
+        remote_manifest (list): Remote entries with 'path' and 'size'
+        local_manifest (list): Local entries with 'path' and 'size'
+        is_changed (callable): (remote_entry, local_entry) -> bool
+
+    Returns:
+        SyncPlan: Plan without renames (see SyncPlan.detect_renames)
+    """
+    local_files = {item['path']: item for item in local_manifest}
+    remote_paths = set()
+    plan = SyncPlan()
+
+    for remote_file in remote_manifest:
+        path = remote_file['path']
+        remote_paths.add(path)
+        local_file = local_files.get(path)
+        if local_file is None or is_changed(remote_file, local_file):
+            plan.download.append(remote_file)
+        else:
+            plan.skip_count += 1
+            plan.skip_bytes += remote_file['size']
+
+    plan.delete = [path for path in local_files if path not in remote_paths]
+    return plan
+
+
+def conflict_path(path, device, when):
+    """
+    Name for the conflict copy of a file
+
+    The marker goes before the extension, so 'chats/a.jsonl' becomes
+    'chats/a.sync-conflict-20240101-120000-phone.jsonl' and SillyTavern
+    still recognises the file type.
+
+    Args:
+        path (str): Relative path of the file
+        device (str): Device whose version is kept as the copy
+        when (datetime): Time of the sync
+
+    Returns:
+        str: Relative path of the copy
+    """
+    parent, _, name = path.rpartition('/')
+    stem, ext = os.path.splitext(name)
+    if not stem:
+        stem, ext = name, ''
+    device = ''.join(c if c.isalnum() or c in '-_' else '_' for c in device) or 'device'
+    copy = f"{stem}.sync-conflict-{when.strftime('%Y%m%d-%H%M%S')}-{device}{ext}"
+    return f"{parent}/{copy}" if parent else copy
+
+
+class TwoWayPlan:
+    def __init__(self):
+        """
+        Plan of a bidirectional sync
+
+        Entries are manifest dicts with 'path', 'size', 'mtime' and 'hash'.
+        Conflicts are (path, winner, copy_path, local_entry, remote_entry)
+        where winner is 'local' or 'remote': the winner's version stays at
+        path and the other one is kept on both sides as copy_path.
+        """
+        self.download = []
+        # (local entry, hash the server must still have, None for absent)
+        self.upload = []
+        # (path, hash the file must still have on that side)
+        self.delete_local = []
+        self.delete_remote = []
+        self.conflicts = []
+        # path -> hash both sides already agree on (None: deleted on both)
+        self.in_sync = {}
+
+    @property
+    def download_bytes(self):
+        """Bytes coming from the server, conflict copies included"""
+        return (sum(entry['size'] for entry in self.download)
+                + sum(remote['size'] for _, _, _, _, remote in self.conflicts))
+
+    @property
+    def upload_bytes(self):
+        """Bytes going to the server, conflict copies included"""
+        return (sum(entry['size'] for entry, _ in self.upload)
+                + sum(local['size'] for _, _, _, local, _ in self.conflicts))
+
+    def is_empty(self):
+        """Check whether neither side needs to change"""
+        return not (self.download or self.upload or self.delete_local
+                    or self.delete_remote or self.conflicts)
+
+
+def diff_three_way(local_manifest, remote_manifest, base, make_conflict_path):
+    """
+    Compare both sides against the state of the last sync
+
+    A side changed a file if its hash differs from the base. Changes on
+    one side are copied to the other; when both changed a file differently,
+    the newer version wins and the other becomes a conflict copy. Deleting
+    a file that the other side modified restores it instead of deleting the
+    modification. Files that differ without a base (never synced, e.g. on
+    the first bidirectional sync) are treated as changed on both sides, so
+    the older version is kept as a conflict copy rather than overwritten.
+
+    Args:
+        local_manifest (list): Local entries with 'path', 'size', 'mtime' and 'hash'
+        remote_manifest (list): Remote entries with the same keys
+        base (dict): path -> hash both sides had after the last sync
+        make_conflict_path (callable): (path, loser) -> path of the conflict
+            copy, loser being 'local' or 'remote'
+
+    Returns:
+        TwoWayPlan: Plan
+    """
+    local_files = {item['path']: item for item in local_manifest}
+    remote_files = {item['path']: item for item in remote_manifest}
+    plan = TwoWayPlan()
+
+    for path in sorted(set(local_files) | set(remote_files) | set(base)):
+        local = local_files.get(path)
+        remote = remote_files.get(path)
+        local_hash = local['hash'] if local else None
+        remote_hash = remote['hash'] if remote else None
+        base_hash = base.get(path)
+
+        if local_hash == remote_hash:
+            plan.in_sync[path] = local_hash
+        elif local_hash == base_hash:
+            # Only the server changed
+            if remote is None:
+                plan.delete_local.append((path, local_hash))
+            else:
+                plan.download.append(remote)
+        elif remote_hash == base_hash:
+            # Only this side changed
+            if local is None:
+                plan.delete_remote.append((path, remote_hash))
+            else:
+                plan.upload.append((local, remote_hash))
+        elif local is None:
+            plan.download.append(remote)
+        elif remote is None:
+            plan.upload.append((local, None))
+        else:
+            winner = 'local' if local['mtime'] > remote['mtime'] else 'remote'
+            loser = 'remote' if winner == 'local' else 'local'
+            plan.conflicts.append((path, winner, make_conflict_path(path, loser), local, remote))
+
+    return plan
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync File Serving
+File responses sent with socket.sendfile (zero-copy on Linux) including
+byte ranges, ETag/Last-Modified validators and 304 responses
+"""
+
+import mimetypes
+import os
+from datetime import datetime, timezone
+
+from flask import Response
+from werkzeug.http import is_resource_modified
+from werkzeug.serving import WSGIRequestHandler
+
+
+# WSGI environ key under which the request handler exposes the client socket
+SOCKET_KEY = 'sync.socket'
+
+
+class SendfileRequestHandler(WSGIRequestHandler):
+    """Werkzeug request handler that lets FileRegion reach the socket"""
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ[SOCKET_KEY] = self.connection
+        return environ
+
+
+class FileRegion:
+    def __init__(self, f, offset, count, environ, chunk_size=256 * 1024):
+        """
+        Response body for a byte range of an open file
+
+        With a socket in the environ (see SendfileRequestHandler) the bytes
+        go out with socket.sendfile; otherwise they are read in chunks.
+
+        Args:
+            f: File opened in binary mode, closed with the response
+            offset (int): First byte to send
+            count (int): Number of bytes to send
+            environ (dict): WSGI environ of the request
+            chunk_size (int): Read size for the fallback path
+        """
+        self.file = f
+        self.offset = offset
+        self.count = count
+        self.sock = environ.get(SOCKET_KEY)
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        if not self.count:
+            return
+        if self.sock is not None:
+            # An empty first chunk makes the server send status and headers
+            yield b''
+            sent = self.sock.sendfile(self.file, self.offset, self.count)
+            if sent < self.count:
+                # File shrank - Content-Length can't be honoured
+                raise ConnectionAbortedError("file truncated while sending")
+            return
+
+        self.file.seek(self.offset)
+        remaining = self.count
+        while remaining:
+            data = self.file.read(min(self.chunk_size, remaining))
+            if not data:
+                raise ConnectionAbortedError("file truncated while sending")
+            remaining -= len(data)
+            yield data
+
+    def close(self):
+        self.file.close()
+
+
+def file_response(request, path, conditional=True, etag=None, mimetype=None,
+                  download_name=None):
+    """
+    Build a response serving a file
+
+    Args:
+        request: Current Flask request
+        path (str): File to send
+        conditional (bool): Honour If-None-Match / If-Modified-Since (304)
+            and Range / If-Range (206)
+        etag (str): ETag to use (default: derived from mtime and size)
+        mimetype (str): Content type (default: guessed from the name)
+        download_name (str): Name for an inline Content-Disposition
+
+    Returns:
+        Response: 200, 206, 304 or 416 response
+    """
+    f = open(path, 'rb')
+    try:
+        st = os.fstat(f.fileno())
+        size = st.st_size
+        if etag is None:
+            etag = f"{st.st_mtime_ns:x}-{size:x}"
+        # HTTP dates have second resolution
+        last_modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+
+        headers = {'Accept-Ranges': 'bytes'}
+        if download_name:
+            headers['Content-Disposition'] = f'inline; filename="{download_name}"'
+
+        status = 200
+        start, count = 0, size
+        if conditional:
+            if not is_resource_modified(request.environ, etag=etag,
+                                        last_modified=last_modified,
+                                        ignore_if_range=True):
+                f.close()
+                response = Response(status=304, headers=headers)
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                return response
+
+            byte_range = request.range
+            if_range = request.if_range
+            if byte_range is not None and len(byte_range.ranges) == 1:
+                if if_range.etag:
+                    use_range = if_range.etag == etag
+                elif if_range.date:
+                    use_range = if_range.date >= last_modified
+                else:
+                    use_range = True
+                if use_range:
+                    window = byte_range.range_for_length(size)
+                    if window is None:
+                        f.close()
+                        return Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+                    start, stop = window
+                    count = stop - start
+                    status = 206
+                    headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+        headers['Content-Length'] = str(count)
+        response = Response(
+            FileRegion(f, start, count, request.environ),
+            status=status,
+            mimetype=mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            headers=headers,
+            direct_passthrough=True
+        )
+    except BaseException:
+        f.close()
+        raise
+
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return response
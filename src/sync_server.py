@@ -4,20 +4,37 @@ SillyTavern Data Sync Server
 Flask HTTP service for providing SillyTavern user data to clients
 """
 
+import ipaddress
 import os
 import json
-import zipfile
-import io
 import hashlib
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file, Response
+from flask import Flask, request, jsonify, Response
+from werkzeug.serving import make_server as werkzeug_make_server
+import socket
 import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from sync_batch import MAX_BATCH_PATHS, iter_batch
+from sync_discovery import DiscoveryResponder
+from sync_events import ChangeNotifier
+from sync_hash import HASH_ALGO, hash_file
+from sync_httpd import PooledWSGIServer, make_server
+from sync_index import ManifestIndex, is_ignored_dir, is_ignored_file
+from sync_sendfile import SendfileRequestHandler, file_response
+from sync_watch import InotifyWatcher
+from sync_zipcache import ZipCache
+from sync_zipstream import (
+    METHOD_DEFLATED, METHOD_STORED, ZipLayoutChanged, archive_size, iter_zip, measure_file
+)
 
 
 class SyncServer:
-    def __init__(self, data_path=None, port=9999, host='0.0.0.0'):
+    def __init__(self, data_path=None, port=9999, host='0.0.0.0', index_path=None,
+                 engine='pooled', allow_upload=False):
         """
         Initialize sync server
 
@@ -25,6 +42,13 @@ class SyncServer:
             data_path (str): Path to SillyTavern data directory
             port (int): Server port
             host (str): Server host address
+            index_path (str): Manifest index database (default: ./sync_index.db)
+            engine (str): 'pooled' (bounded worker pool with keep-alive) or
+                'werkzeug' (development server)
+            allow_upload (bool): Accept PUT/DELETE /file from clients
+                (bidirectional sync). Off by default: the server has no
+                authentication, so this lets anyone who can reach it write
+                to the data directory
         """
         self.app = Flask(__name__)
         self.port = port
@@ -32,17 +56,64 @@ class SyncServer:
         self.data_path = data_path or self._find_data_path()
         self.running = False
         self.server_thread = None
+        self.httpd = None
+        self.responder = None
+        self.engine = engine
+        # Pooled engine tuning
+        self.max_workers = 16
+        self.request_timeout = 60
+        self.keepalive_timeout = 15
+        self.shutdown_grace = 10
+        self.zip_level = 6
+        # Parallel ZIP compression: worker threads and read-ahead limit
+        self.zip_workers = os.cpu_count() or 1
+        self.zip_window = 64 * 1024 * 1024
+        self.allow_upload = allow_upload
+        # Serializes the check-and-replace of uploads and deletions
+        self.upload_lock = threading.Lock()
 
         # Validate data path
         if not os.path.exists(self.data_path):
             raise FileNotFoundError(f"数据目录不存在: {self.data_path}")
 
+        # Persistent manifest index, only changed directories are rescanned
+        self.index_path = index_path or os.path.join(os.getcwd(), "sync_index.db")
+        self.index = ManifestIndex(self.data_path, self.index_path)
+
+        # Built archives, reused until the index generation changes
+        self.zip_cache = ZipCache(
+            os.path.join(os.path.dirname(os.path.abspath(self.index_path)), "sync_zip_cache"),
+            max_bytes=1024 * 1024 * 1024
+        )
+
+        # Debounced refreshes that wake clients waiting on /events
+        self.notifier = ChangeNotifier(self.index)
+
+        # Watch for changes before the first scan so nothing slips in between
+        self.watcher = InotifyWatcher(self.data_path, self._on_fs_change)
+        self.index.watching = self.watcher.start()
+        if self.index.watching:
+            print("已启用 inotify 文件监控")
+        else:
+            print("文件监控不可用，将按需重新扫描目录")
+
+        print("正在更新文件索引...")
+        changed = self.index.refresh(force=True)
+        file_count, _ = self.index.totals()
+        print(f"文件索引已就绪: {file_count} 个文件 ({changed} 项变更)")
+        self.notifier.start()
+
         print(f"数据同步服务已初始化")
         print(f"数据路径: {self.data_path}")
         print(f"监听地址: {host}:{port}")
 
         self._setup_routes()
 
+    def _on_fs_change(self, rel_dir):
+        """Watcher callback: mark the directory dirty and schedule a refresh"""
+        self.index.mark_dirty(rel_dir)
+        self.notifier.poke(rel_dir)
+
     def _find_data_path(self):
         """Auto-detect SillyTavern data path"""
         # Common SillyTavern data locations
@@ -68,24 +139,109 @@ class SyncServer:
 
         @self.app.route('/health', methods=['GET'])
         def health_check():
-            """Health check endpoint"""
-            return jsonify({
+            """Health check endpoint (?probe=N pads the reply to measure throughput)"""
+            data = {
                 'status': 'healthy',
                 'timestamp': datetime.now().isoformat(),
                 'data_path': self.data_path
-            })
+            }
+            probe = request.args.get('probe', 0, type=int)
+            if probe > 0:
+                data['padding'] = '0' * min(probe, 4 * 1024 * 1024)
+            return jsonify(data)
 
         @self.app.route('/manifest', methods=['GET'])
         def get_manifest():
-            """Get file manifest with metadata"""
+            """
+            Get file manifest with metadata
+
+            hash=1 adds content hashes. since=<generation> (with the epoch
+            from a previous response) returns only the entries changed since
+            then, or full_resync when the journal no longer covers it.
+            """
             try:
-                manifest = self._generate_manifest()
-                return jsonify({
+                with_hash = request.args.get('hash', '0') in ('1', 'true', 'yes')
+                since = request.args.get('since', type=int)
+
+                if since is not None:
+                    self.index.refresh()
+                    result = self.index.changes_since(
+                        since, request.args.get('epoch'), with_hash=with_hash
+                    )
+                    result['success'] = True
+                    if with_hash:
+                        result['hash_algo'] = HASH_ALGO
+                    return jsonify(result)
+
+                # Read the cursor first so it never runs ahead of the data
+                self.index.refresh()
+                epoch, generation = self.index.epoch, self.index.generation
+                manifest = self._generate_manifest(with_hash=with_hash)
+                result = {
                     'success': True,
                     'manifest': manifest,
                     'total_files': len(manifest),
+                    'epoch': epoch,
+                    'generation': generation,
                     'generated_at': datetime.now().isoformat()
-                })
+                }
+                if with_hash:
+                    result['hash_algo'] = HASH_ALGO
+                return jsonify(result)
+            except Exception as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 500
+
+        @self.app.route('/events', methods=['GET'])
+        def get_events():
+            """
+            Long-poll for changes
+
+            Waits up to timeout seconds (max 60) until the index moves past
+            since=<generation>, then answers like /manifest?since=. Without
+            since, the current epoch and generation are returned at once, so
+            a client can start following from now.
+            """
+            try:
+                with_hash = request.args.get('hash', '0') in ('1', 'true', 'yes')
+                since = request.args.get('since', type=int)
+                epoch = request.args.get('epoch')
+                timeout = min(max(request.args.get('timeout', 25, type=float), 0), 60)
+
+                if since is None:
+                    return jsonify({
+                        'success': True,
+                        'epoch': self.index.epoch,
+                        'generation': self.index.generation
+                    })
+
+                self.notifier.wait(since, epoch, timeout)
+                result = self.index.changes_since(since, epoch, with_hash=with_hash)
+                result['success'] = True
+                if with_hash:
+                    result['hash_algo'] = HASH_ALGO
+                return jsonify(result)
+            except Exception as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 500
+
+        @self.app.route('/tree', methods=['GET'])
+        def get_tree():
+            """Get Merkle digest of one directory with its files and subdirectory digests"""
+            try:
+                # Only used as an index key, never touches the filesystem
+                path = request.args.get('path', '').replace('\\', '/').strip('/')
+                self.index.refresh()
+                epoch, generation = self.index.epoch, self.index.generation
+                node = self.index.tree_node(path)
+                node['success'] = True
+                node['epoch'] = epoch
+                node['generation'] = generation
+                return jsonify(node)
             except Exception as e:
                 return jsonify({
                     'success': False,
@@ -94,15 +250,15 @@ class SyncServer:
 
         @self.app.route('/zip', methods=['GET'])
         def get_zip():
-            """Get all data as ZIP file"""
+            """Stream all data as ZIP file (supports Range/If-Range for resuming)"""
             try:
-                zip_buffer = self._create_zip()
-                return send_file(
-                    io.BytesIO(zip_buffer.getvalue()),
-                    mimetype='application/zip',
-                    as_attachment=False,
-                    download_name='sillytavern_data.zip'
-                )
+                level = request.args.get('level', self.zip_level, type=int)
+                if not 0 <= level <= 9:
+                    return jsonify({
+                        'success': False,
+                        'error': 'level must be between 0 and 9'
+                    }), 400
+                return self._zip_response(level)
             except Exception as e:
                 return jsonify({
                     'success': False,
@@ -120,26 +276,21 @@ class SyncServer:
                 }), 400
 
             try:
-                # Security check - prevent directory traversal
-                file_path = os.path.normpath(file_path).replace('..', '')
-                full_path = os.path.join(self.data_path, file_path)
-
-                if not os.path.exists(full_path):
+                # Anything outside the data folder looks like a missing file
+                full_path = self._resolve_data_file(file_path)
+                if full_path is None:
                     return jsonify({
                         'success': False,
                         'error': f'File not found: {file_path}'
                     }), 404
 
-                if not os.path.isfile(full_path):
-                    return jsonify({
-                        'success': False,
-                        'error': f'Not a file: {file_path}'
-                    }), 400
+                base_hash = request.args.get('base_hash')
+                if base_hash and request.range is not None:
+                    return self._append_response(full_path, base_hash)
 
-                return send_file(
-                    full_path,
-                    as_attachment=False,
-                    download_name=os.path.basename(full_path)
+                # Answers Range/If-Range with 206 and re-checks with 304
+                return file_response(
+                    request, full_path, download_name=os.path.basename(full_path)
                 )
 
             except Exception as e:
@@ -148,9 +299,110 @@ class SyncServer:
                     'error': str(e)
                 }), 500
 
+        @self.app.route('/file', methods=['PUT'])
+        def put_file():
+            """
+            Upload a file (bidirectional sync)
+
+            X-Base-Hash must name the content the client last saw here
+            (empty if the file shouldn't exist yet); if the file changed
+            since, nothing is written and 412 is returned. X-Content-Hash
+            is checked against the received bytes, X-Mtime sets the
+            modification time, and X-Conflict-Copy moves the current file
+            to that path before it is replaced.
+            """
+            if not self.allow_upload:
+                return jsonify({
+                    'success': False,
+                    'error': 'Uploads are disabled on this server'
+                }), 403
+
+            rel_path = request.args.get('path', '')
+            full_path = self._resolve_upload_path(rel_path)
+            if full_path is None:
+                return jsonify({
+                    'success': False,
+                    'error': f'Invalid path: {rel_path}'
+                }), 400
+
+            try:
+                return self._receive_upload(full_path)
+            except Exception as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 500
+
+        @self.app.route('/file', methods=['DELETE'])
+        def delete_file():
+            """Delete a file if it still has the content named by X-Base-Hash (412 otherwise)"""
+            if not self.allow_upload:
+                return jsonify({
+                    'success': False,
+                    'error': 'Uploads are disabled on this server'
+                }), 403
+
+            rel_path = request.args.get('path', '')
+            full_path = self._resolve_upload_path(rel_path)
+            base_hash = request.headers.get('X-Base-Hash')
+            if full_path is None or not base_hash:
+                return jsonify({
+                    'success': False,
+                    'error': 'Missing path or X-Base-Hash'
+                }), 400
+
+            try:
+                with self.upload_lock:
+                    current = self._current_hash(full_path)
+                    if current is None:
+                        return jsonify({
+                            'success': False,
+                            'error': f'File not found: {rel_path}'
+                        }), 404
+                    if current != base_hash:
+                        return jsonify({
+                            'success': False,
+                            'error': 'File changed on the server',
+                            'hash': current
+                        }), 412
+                    os.remove(full_path)
+                self._mark_written(full_path)
+                return jsonify({'success': True})
+            except Exception as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 500
+
+        @self.app.route('/files', methods=['POST'])
+        def get_files():
+            """Stream several files in one batch container (see sync_batch)"""
+            payload = request.get_json(silent=True) or {}
+            paths = payload.get('paths')
+            if not isinstance(paths, list) or not paths:
+                return jsonify({
+                    'success': False,
+                    'error': 'Missing paths'
+                }), 400
+            if len(paths) > MAX_BATCH_PATHS:
+                return jsonify({
+                    'success': False,
+                    'error': f'Too many paths (max {MAX_BATCH_PATHS})'
+                }), 400
+
+            entries = [(str(path), self._resolve_data_file(str(path))) for path in paths]
+            return Response(
+                iter_batch(entries),
+                mimetype='application/octet-stream',
+                headers={'X-Accel-Buffering': 'no'},
+                direct_passthrough=True
+            )
+
         @self.app.route('/info', methods=['GET'])
         def get_info():
             """Get server information"""
+            self.index.refresh()
+            file_count, total_size = self.index.totals()
             return jsonify({
                 'success': True,
                 'server_info': {
@@ -158,109 +410,472 @@ class SyncServer:
                     'port': self.port,
                     'host': self.host,
                     'running': self.running,
-                    'total_size': self._calculate_total_size(),
-                    'file_count': len(self._generate_manifest())
+                    'total_size': total_size,
+                    'file_count': file_count
                 }
             })
 
-    def _generate_manifest(self):
-        """Generate file manifest with metadata"""
-        manifest = []
+    def _append_response(self, full_path, base_hash):
+        """
+        Answer an append request for a grown file (e.g. a .jsonl chat)
 
-        for root, dirs, files in os.walk(self.data_path):
-            # Skip hidden directories
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
+        The client sends the hash of its local copy and asks for the bytes
+        after it with Range. Only when that hash matches the same-length
+        prefix here is the tail sent (206, marked with X-Base-Hash: match);
+        otherwise the whole file is returned.
+        """
+        size = os.path.getsize(full_path)
+        window = request.range.range_for_length(size)
+        if window is not None and window[0] > 0 and window[1] == size:
+            if hash_file(full_path, length=window[0]) == base_hash:
+                response = file_response(request, full_path)
+                response.headers['X-Base-Hash'] = 'match'
+                return response
 
-            for file in files:
-                # Skip hidden files and temporary files
-                if file.startswith('.') or file.endswith('.tmp'):
-                    continue
+        return file_response(request, full_path, conditional=False)
 
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, self.data_path)
-
-                try:
-                    stat_info = os.stat(file_path)
-                    manifest.append({
-                        'path': relative_path.replace('\\', '/'),  # Normalize to forward slashes
-                        'size': stat_info.st_size,
-                        'mtime': stat_info.st_mtime,
-                        'modified': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
-                        'is_dir': False
-                    })
-                except OSError:
-                    # Skip files that can't be accessed
-                    continue
+    def _resolve_data_file(self, rel_path):
+        """
+        Map a client-supplied relative path to a regular file in the data folder
 
-        return manifest
+        Returns:
+            str: Absolute path, or None if it escapes the data folder or
+                isn't a file
+        """
+        root = os.path.realpath(self.data_path)
+        full_path = os.path.realpath(os.path.join(root, rel_path.lstrip('/\\')))
+        if not full_path.startswith(root + os.sep) or not os.path.isfile(full_path):
+            return None
+        return full_path
 
-    def _create_zip(self):
-        """Create ZIP file of all data"""
-        zip_buffer = io.BytesIO()
+    def _resolve_upload_path(self, rel_path):
+        """
+        Map a client-supplied relative path to a writable location
 
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for root, dirs, files in os.walk(self.data_path):
-                # Skip hidden directories
-                dirs[:] = [d for d in dirs if not d.startswith('.')]
+        Returns:
+            str: Absolute path, or None if the path escapes the data folder,
+                points at a directory, or names something the index ignores
+                (hidden or temporary files)
+        """
+        parts = rel_path.replace('\\', '/').strip('/').split('/')
+        if any(part in ('', '.', '..') or is_ignored_dir(part) for part in parts[:-1]):
+            return None
+        if parts[-1] in ('', '.', '..') or is_ignored_file(parts[-1]):
+            return None
+
+        root = os.path.realpath(self.data_path)
+        full_path = os.path.realpath(os.path.join(root, *parts))
+        if not full_path.startswith(root + os.sep) or os.path.isdir(full_path):
+            return None
+        return full_path
+
+    def _current_hash(self, full_path):
+        """Content hash of a data file, or None if it doesn't exist"""
+        if not os.path.isfile(full_path):
+            return None
+        digest = self.index.hash_cache.get(full_path)
+        # An open cache transaction would lock the index out of its refresh
+        self.index.hash_cache.flush()
+        return digest
+
+    def _mark_written(self, *full_paths):
+        """Have the index pick up files changed by a client and notify watchers"""
+        root = os.path.realpath(self.data_path)
+        for full_path in full_paths:
+            rel_dir = os.path.relpath(os.path.dirname(full_path), root)
+            self.index.mark_dirty('' if rel_dir == '.' else rel_dir.replace(os.sep, '/'))
+        self.notifier.poke()
+
+    def _receive_upload(self, full_path):
+        """
+        Write a PUT /file body into place (see put_file)
 
-                for file in files:
-                    # Skip hidden files and temporary files
-                    if file.startswith('.') or file.endswith('.tmp'):
-                        continue
+        The body goes to a hidden temp file next to the target, which the
+        index ignores, and is only moved into place once it is complete,
+        verified and the precondition still holds.
+        """
+        length = request.content_length
+        if length is None:
+            return jsonify({'success': False, 'error': 'Missing Content-Length'}), 411
+        expected_hash = request.headers.get('X-Content-Hash')
+        if 'X-Base-Hash' not in request.headers or not expected_hash:
+            return jsonify({
+                'success': False,
+                'error': 'Missing X-Base-Hash or X-Content-Hash'
+            }), 400
+        base_hash = request.headers['X-Base-Hash'] or None
+
+        copy_path = None
+        if request.headers.get('X-Conflict-Copy'):
+            copy_path = self._resolve_upload_path(request.headers['X-Conflict-Copy'])
+            if copy_path is None or copy_path == full_path:
+                return jsonify({'success': False, 'error': 'Invalid X-Conflict-Copy'}), 400
+
+        directory, name = os.path.split(full_path)
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f".{name}.upload-{uuid.uuid4().hex[:8]}")
+        digest = hashlib.blake2b(digest_size=16)
+        received = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                while received < length:
+                    data = request.stream.read(min(1024 * 1024, length - received))
+                    if not data:
+                        break
+                    f.write(data)
+                    digest.update(data)
+                    received += len(data)
+            if received != length:
+                return jsonify({'success': False, 'error': 'Incomplete upload'}), 400
+            if digest.hexdigest() != expected_hash:
+                return jsonify({
+                    'success': False,
+                    'error': 'Content hash mismatch'
+                }), 400
 
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, self.data_path)
+            mtime = request.headers.get('X-Mtime', type=float)
+            if mtime is not None:
+                os.utime(temp_path, (mtime, mtime))
 
-                    try:
-                        zip_file.write(file_path, relative_path)
-                    except OSError:
-                        # Skip files that can't be accessed
-                        continue
+            with self.upload_lock:
+                current = self._current_hash(full_path)
+                if current != base_hash:
+                    return jsonify({
+                        'success': False,
+                        'error': 'File changed on the server',
+                        'hash': current
+                    }), 412
+                if copy_path is not None and current is not None:
+                    if os.path.exists(copy_path):
+                        return jsonify({
+                            'success': False,
+                            'error': 'Conflict copy already exists'
+                        }), 409
+                    os.makedirs(os.path.dirname(copy_path), exist_ok=True)
+                    os.replace(full_path, copy_path)
+                os.replace(temp_path, full_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        self.index.hash_cache.put(full_path, expected_hash)
+        self.index.hash_cache.flush()
+        self._mark_written(*(path for path in (full_path, copy_path) if path))
+        return jsonify({'success': True, 'hash': expected_hash, 'size': received})
+
+    def _generate_manifest(self, with_hash=False):
+        """Generate file manifest with metadata from the index"""
+        self.index.refresh()
+        return self.index.manifest(with_hash=with_hash)
+
+    def _zip_plan(self, level):
+        """
+        Snapshot the index for one ZIP response
 
-        zip_buffer.seek(0)
-        return zip_buffer
+        Args:
+            level (int): Compression level of the archive
+
+        Returns:
+            tuple: (etag, list of (file_path, arcname, layout)) where layout
+                is the cached entry layout or None
+        """
+        self.index.refresh()
+        epoch, generation = self.index.epoch, self.index.generation
+        cache = self.index.hash_cache
+        files = []
+
+        for path, size, mtime_ns, inode, dev in self.index.iter_files():
+            key = (dev, inode, size, mtime_ns)
+            # Each file has exactly one method per level, so at most one hits
+            for method in (METHOD_DEFLATED, METHOD_STORED):
+                layout = cache.get_zip_entry(key, method, level)
+                if layout is not None:
+                    layout.update({'method': method, 'file_size': size, 'mtime': mtime_ns / 1e9})
+                    break
+            files.append((os.path.join(self.data_path, path), path, layout))
+
+        # Same generation + same settings always produce the same bytes
+        etag = f"{epoch}-{generation}-{level}"
+        return etag, files
+
+    def _remember_zip_entry(self, entry, level):
+        """Cache the layout of an entry that was just compressed at level"""
+        self.index.hash_cache.put_zip_entry(
+            entry['key'], entry['method'], level,
+            entry['crc'], entry['compress_size'], entry['mode']
+        )
+
+    def _complete_layout(self, files, level):
+        """Compress files with unknown layout (without sending) so the archive size is known"""
+        def measure(item):
+            file_path, arcname, _ = item
+            try:
+                return measure_file(file_path, arcname, level)
+            except OSError:
+                return None
+
+        unknown = [item for item in files if item[2] is None]
+        with ThreadPoolExecutor(max_workers=self.zip_workers) as pool:
+            measured = dict(zip((item[1] for item in unknown), pool.map(measure, unknown)))
+
+        completed = []
+        for file_path, arcname, layout in files:
+            if layout is None:
+                entry = measured[arcname]
+                if entry is None:
+                    # Unreadable files are skipped by the stream as well
+                    continue
+                self._remember_zip_entry(entry, level)
+                layout = {
+                    'method': entry['method'],
+                    'crc': entry['crc'],
+                    'compress_size': entry['compress_size'],
+                    'file_size': entry['file_size'],
+                    'mode': entry['mode'],
+                    'mtime': entry['key'][3] / 1e9
+                }
+            completed.append((file_path, arcname, layout))
+        self.index.hash_cache.flush()
+        return completed
+
+    def _zip_response(self, level):
+        """
+        Build the /zip response
+
+        The archive is deterministic per index generation, which serves as
+        its ETag. When every entry's layout is cached, Content-Length is
+        sent; a Range request fills in unknown layouts first so it can be
+        answered with an exact 206 that skips entries the client already has.
+
+        Full downloads go through the ZIP cache: a cached archive is served
+        from disk, and concurrent requests share one build.
+
+        Args:
+            level (int): Compression level; 0 stores every entry, otherwise
+                already-compressed media is stored and the rest deflated
+        """
+        etag, files = self._zip_plan(level)
+        headers = {
+            'Content-Disposition': 'inline; filename=sillytavern_data.zip',
+            'X-Accel-Buffering': 'no',
+            'Accept-Ranges': 'bytes'
+        }
+
+        byte_range = request.range
+        if_range = request.if_range
+        if (byte_range is not None and (if_range.etag or if_range.date)
+                and if_range.etag != etag):
+            # Archive changed since the partial download - send it all again
+            byte_range = None
+
+        cached = self.zip_cache.get(etag)
+        if cached is not None:
+            # Range/If-Range are checked against the same ETag
+            response = file_response(request, cached, etag=etag, mimetype='application/zip')
+            response.headers.update(headers)
+            return response
+
+        total = None
+        if byte_range is not None or all(layout is not None for _, _, layout in files):
+            if byte_range is not None:
+                files = self._complete_layout(files, level)
+            total = archive_size(
+                ((arcname, layout) for _, arcname, layout in files), level
+            )
+
+        status = 200
+        start, stop = 0, None
+        if byte_range is not None:
+            window = byte_range.range_for_length(total)
+            if window is None:
+                return Response(status=416, headers={'Content-Range': f'bytes */{total}'})
+            start, stop = window
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+            headers['Content-Length'] = str(stop - start)
+        elif total is not None:
+            headers['Content-Length'] = str(total)
+
+        def generate(start=0, stop=None):
+            try:
+                yield from iter_zip(
+                    files, compress_level=level, start=start, stop=stop,
+                    on_entry=lambda entry: self._remember_zip_entry(entry, level),
+                    workers=self.zip_workers, window_bytes=self.zip_window
+                )
+            except ZipLayoutChanged as e:
+                # Force a new generation so the ETag no longer matches
+                self.index.mark_dirty(e.args[0].rpartition('/')[0])
+                raise
+            finally:
+                self.index.hash_cache.flush()
+
+        if byte_range is None:
+            # Archives of older generations can never be requested again
+            current = etag.rsplit('-', 1)[0] + '-'
+            self.zip_cache.retain(lambda key: key.startswith(current))
+            # Uncompressed data size stands in while the layout isn't known
+            size_hint = total if total is not None else self.index.totals()[1]
+            body = self.zip_cache.stream(etag, generate, size_hint)
+        else:
+            body = generate(start, stop)
+
+        response = Response(
+            body,
+            status=status,
+            mimetype='application/zip',
+            headers=headers,
+            direct_passthrough=True
+        )
+        response.set_etag(etag)
+        return response
 
     def _calculate_total_size(self):
         """Calculate total size of data directory"""
-        total_size = 0
-        for root, dirs, files in os.walk(self.data_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                try:
-                    total_size += os.path.getsize(file_path)
-                except OSError:
-                    continue
-        return total_size
+        self.index.refresh()
+        return self.index.totals()[1]
+
+    def _make_httpd(self):
+        """Create and bind the HTTP server for the selected engine"""
+        if self.engine == 'werkzeug':
+            # The handler exposes the socket so file responses can use sendfile
+            return werkzeug_make_server(
+                self.host, self.port, self.app, threaded=True,
+                request_handler=SendfileRequestHandler
+            )
+        if self.engine != 'pooled':
+            raise ValueError(f"未知的服务器引擎: {self.engine}")
+        return make_server(
+            self.host, self.port, self.app,
+            max_workers=self.max_workers,
+            request_timeout=self.request_timeout,
+            keepalive_timeout=self.keepalive_timeout
+        )
 
     def start(self, block=False):
-        """Start the sync server"""
+        """
+        Start the sync server
+
+        The port is bound before this returns, so a port already in use is
+        reported here instead of in a background thread.
+
+        Args:
+            block (bool): Serve in the calling thread until stopped
+
+        Returns:
+            bool: True if the server was started
+        """
         if self.running:
             print("数据同步服务已在运行")
-            return
-
-        def run_server():
-            print(f"启动数据同步服务...")
-            self.app.run(host=self.host, port=self.port, debug=False)
+            return True
+
+        try:
+            self.httpd = self._make_httpd()
+        except (OSError, ValueError) as e:
+            print(f"无法监听 {self.host}:{self.port}: {e}")
+            return False
+        self.running = True
+        self.notifier.start()
+
+        # Answer LAN discovery broadcasts while serving, unless only this
+        # device can connect anyway
+        if self._loopback_only():
+            print("仅监听本机地址，不响应局域网发现")
+        elif not self._start_responder():
+            print(f"局域网发现端口 {self.responder.discovery_port}/udp 不可用，客户端仍可通过扫描找到本机")
+            self.responder = None
 
         if block:
-            self.running = True
-            run_server()
+            print(f"启动数据同步服务... (引擎: {self.engine})")
+            try:
+                self.httpd.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.stop()
         else:
-            self.server_thread = threading.Thread(target=run_server, daemon=True)
+            self.server_thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
             self.server_thread.start()
-            self.running = True
-            print(f"数据同步服务已启动在后台: http://{self.host}:{self.port}")
+            print(f"数据同步服务已启动在后台: http://{self.host}:{self.port} (引擎: {self.engine})")
             print("可用接口:")
             print("  GET /health      - 健康检查")
-            print("  GET /manifest    - 获取文件清单")
-            print("  GET /zip         - 下载所有数据(ZIP)")
+            print("  GET /manifest    - 获取文件清单 (?hash=1 包含内容哈希, ?since= 增量变更)")
+            print("  GET /tree?path=  - 获取目录摘要树")
+            print("  GET /events      - 等待数据变更 (长轮询, ?since=&timeout=)")
+            print("  GET /zip         - 下载所有数据(ZIP, ?level=0-9 压缩级别)")
             print("  GET /file?path=  - 下载指定文件")
+            print("  POST /files      - 批量下载多个文件")
+            if self.allow_upload:
+                print("  PUT /file?path=  - 上传文件 (双向同步)")
+                print("  DELETE /file?path= - 删除文件 (双向同步)")
             print("  GET /info        - 服务器信息")
+        return True
+
+    def _loopback_only(self):
+        """Check whether the listening address is only reachable from this device"""
+        try:
+            return ipaddress.ip_address(socket.gethostbyname(self.host)).is_loopback
+        except (OSError, ValueError):
+            return False
+
+    def _start_responder(self):
+        """Answer discovery queries for the current address; False if the UDP port is taken"""
+        self.responder = DiscoveryResponder(self.port, host=self.host)
+        return self.responder.start()
+
+    def _close_http(self):
+        """Shut down the HTTP server, close its listening socket and stop answering discovery"""
+        if self.responder is not None:
+            self.responder.stop()
+            self.responder = None
+        httpd, self.httpd = self.httpd, None
+        if isinstance(httpd, PooledWSGIServer):
+            httpd.close(self.shutdown_grace)
+        elif httpd is not None:
+            if self.server_thread is not None:
+                httpd.shutdown()
+            httpd.server_close()
+        if self.server_thread is not None:
+            self.server_thread.join(timeout=5)
+            self.server_thread = None
+
+    def restart(self, host=None, port=None):
+        """
+        Rebind the HTTP server, e.g. after the configured address changed
+
+        The index, watcher and caches stay as they are.
+
+        Args:
+            host (str): New host address (default: unchanged)
+            port (int): New port (default: unchanged)
+
+        Returns:
+            bool: True if the server is listening again
+        """
+        if self.running:
+            self._close_http()
+            self.running = False
+        self.host = host or self.host
+        self.port = port or self.port
+        return self.start(block=False)
 
     def stop(self):
-        """Stop the sync server"""
+        """
+        Stop the sync server
+
+        Closes the listening socket (the port is free again when this
+        returns) and lets requests in progress finish for shutdown_grace
+        seconds.
+        """
         if self.running:
             self.running = False
+            # Release long-polling /events clients before waiting on requests
+            self.notifier.stop()
+            self._close_http()
+            self.watcher.stop()
+            # Without the watcher a restarted server has to rescan on demand
+            self.index.watching = False
+            self.index.hash_cache.flush()
             print("数据同步服务已停止")
 
 
@@ -277,12 +892,21 @@ def main():
                        help='服务器主机地址 (默认: 0.0.0.0)')
     parser.add_argument('--block', action='store_true',
                        help='阻塞运行 (默认后台运行)')
+    parser.add_argument('--engine', choices=['pooled', 'werkzeug'], default='pooled',
+                       help='服务器引擎 (默认: pooled)')
+    parser.add_argument('--workers', type=int, default=16,
+                       help='最大并发连接处理线程数 (默认: 16)')
+    parser.add_argument('--allow-upload', action='store_true',
+                       help='允许客户端上传和删除文件 (双向同步，局域网内任何人都可写入数据)')
 
     args = parser.parse_args()
 
     try:
-        server = SyncServer(data_path=args.data_path, port=args.port, host=args.host)
-        server.start(block=args.block)
+        server = SyncServer(data_path=args.data_path, port=args.port, host=args.host,
+                            engine=args.engine, allow_upload=args.allow_upload)
+        server.max_workers = args.workers
+        if not server.start(block=args.block):
+            return 1
 
         if not args.block:
             print("按 Ctrl+C 停止服务...")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Snapshots
+Backup snapshots that hardlink unchanged files against the previous snapshot
+(rsync --link-dest style), with a keep-last / keep-per-day retention policy
+"""
+
+import os
+import shutil
+from datetime import datetime
+
+
+class SnapshotStore:
+    def __init__(self, backup_dir, name='default-user', keep_last=5, keep_daily=7):
+        """
+        Initialize snapshot store
+
+        Snapshots are named '<name>.backup.<YYYYmmdd_HHMMSS>', the same as
+        the plain copies made by earlier versions, so those serve as link
+        bases too.
+
+        Args:
+            backup_dir (str): Directory holding the snapshots
+            name (str): Snapshot name prefix
+            keep_last (int): Always keep this many newest snapshots
+            keep_daily (int): Also keep the newest snapshot of this many days
+        """
+        self.backup_dir = backup_dir
+        self.name = name
+        self.keep_last = keep_last
+        self.keep_daily = keep_daily
+        self.prefix = f"{name}.backup."
+
+    def list_snapshots(self):
+        """
+        List complete snapshots
+
+        Returns:
+            list: Snapshot paths, oldest first
+        """
+        try:
+            names = os.listdir(self.backup_dir)
+        except OSError:
+            return []
+        return [
+            os.path.join(self.backup_dir, entry) for entry in sorted(names)
+            if entry.startswith(self.prefix)
+            and os.path.isdir(os.path.join(self.backup_dir, entry))
+        ]
+
+    def create(self, src_path):
+        """
+        Snapshot a directory
+
+        Files whose size and mtime match the previous snapshot are hardlinked
+        to it; everything else is copied. Live data is never linked, so
+        in-place writes (e.g. chat appends) can't alter a snapshot. The
+        snapshot is built under a hidden name and renamed when complete.
+
+        Args:
+            src_path (str): Directory to snapshot
+
+        Returns:
+            tuple: (snapshot path, stats dict with 'linked', 'copied', 'copied_bytes')
+        """
+        os.makedirs(self.backup_dir, exist_ok=True)
+        snapshots = self.list_snapshots()
+        base = snapshots[-1] if snapshots else None
+
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(self.backup_dir, f"{self.prefix}{stamp}")
+        suffix = 1
+        while os.path.exists(path):
+            path = os.path.join(self.backup_dir, f"{self.prefix}{stamp}_{suffix}")
+            suffix += 1
+
+        temp_path = os.path.join(self.backup_dir, f".{os.path.basename(path)}.tmp")
+        if os.path.exists(temp_path):
+            shutil.rmtree(temp_path)
+
+        stats = {'linked': 0, 'copied': 0, 'copied_bytes': 0}
+        try:
+            for root, dirs, files in os.walk(src_path):
+                rel_dir = os.path.relpath(root, src_path)
+                target_dir = os.path.normpath(os.path.join(temp_path, rel_dir))
+                os.makedirs(target_dir, exist_ok=True)
+
+                for name in files:
+                    src_file = os.path.join(root, name)
+                    target = os.path.join(target_dir, name)
+                    st = os.stat(src_file)
+                    if base and self._link_unchanged(
+                        os.path.join(base, rel_dir, name), target, st
+                    ):
+                        stats['linked'] += 1
+                        continue
+                    shutil.copy2(src_file, target)
+                    stats['copied'] += 1
+                    stats['copied_bytes'] += st.st_size
+
+            os.rename(temp_path, path)
+        except BaseException:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+
+        return path, stats
+
+    def _link_unchanged(self, base_file, target, st):
+        """Hardlink base_file to target if it matches the source stat"""
+        try:
+            base_st = os.stat(base_file)
+        except OSError:
+            return False
+        if base_st.st_size != st.st_size or base_st.st_mtime_ns != st.st_mtime_ns:
+            return False
+        try:
+            os.link(base_file, target)
+            return True
+        except OSError:
+            # No hardlink support (e.g. shared storage) - copy instead
+            return False
+
+    def restore(self, snapshot_path, dest_path):
+        """
+        Make dest_path match a snapshot
+
+        Only files that differ are copied back (never linked, so the snapshot
+        stays intact), and files absent from the snapshot are removed.
+
+        Args:
+            snapshot_path (str): Snapshot to restore
+            dest_path (str): Directory to restore into
+
+        Returns:
+            tuple: (files copied, files removed)
+        """
+        copied = 0
+        removed = 0
+        wanted = set()
+
+        for root, dirs, files in os.walk(snapshot_path):
+            rel_dir = os.path.relpath(root, snapshot_path)
+            dest_dir = os.path.normpath(os.path.join(dest_path, rel_dir))
+            os.makedirs(dest_dir, exist_ok=True)
+            wanted.add(os.path.normpath(rel_dir))
+
+            for name in files:
+                wanted.add(os.path.normpath(os.path.join(rel_dir, name)))
+                src_file = os.path.join(root, name)
+                dest_file = os.path.join(dest_dir, name)
+                st = os.stat(src_file)
+                try:
+                    dest_st = os.stat(dest_file)
+                    if (dest_st.st_size == st.st_size
+                            and dest_st.st_mtime_ns == st.st_mtime_ns):
+                        continue
+                except OSError:
+                    pass
+
+                temp_file = os.path.join(dest_dir, f".{name}.restore")
+                shutil.copy2(src_file, temp_file)
+                os.replace(temp_file, dest_file)
+                copied += 1
+
+        for root, dirs, files in os.walk(dest_path, topdown=False):
+            rel_dir = os.path.relpath(root, dest_path)
+            for name in files:
+                if os.path.normpath(os.path.join(rel_dir, name)) not in wanted:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+            if os.path.normpath(rel_dir) not in wanted:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+
+        return copied, removed
+
+    def prune(self):
+        """
+        Apply the retention policy
+
+        Returns:
+            list: Removed snapshot paths
+        """
+        snapshots = self.list_snapshots()
+        keep = set(snapshots[-self.keep_last:]) if self.keep_last > 0 else set()
+
+        days = set()
+        for path in reversed(snapshots):
+            day = os.path.basename(path)[len(self.prefix):][:8]
+            if day not in days and len(days) < self.keep_daily:
+                days.add(day)
+                keep.add(path)
+
+        removed = []
+        for path in snapshots:
+            if path not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+        return removed
@@ -15,7 +15,7 @@ from pathlib import Path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from sync_client import SyncClient
-from sync_server import SyncServer
+from sync_daemon import send_command, start_daemon, stop_daemon
 from config import ConfigManager
 
 
@@ -97,7 +97,7 @@ class TermuxSyncManager:
 
     
     def start_sync_server(self, port=5000, host='0.0.0.0'):
-        """Start sync server on Termux"""
+        """Start sync server as a background daemon on Termux"""
         print("启动 Termux 数据同步服务...")
 
         if not os.path.exists(self.data_dir):
@@ -106,29 +106,31 @@ class TermuxSyncManager:
             return False
 
         try:
-            # Initialize sync server
-            sync_server = SyncServer(
-                data_path=self.data_dir,
-                port=port,
-                host=host
+            # Detached daemon, keeps running after this command exits
+            status = start_daemon(
+                self.data_dir, port, host,
+                engine=self.config_manager.get("sync.engine", "pooled"),
+                run_dir=os.getcwd()
             )
+            if status is None:
+                print("启动同步服务器失败")
+                return False
 
-            # Save configuration
+            # Save configuration only once the daemon checked the port is free
             self.config_manager.set("sync.enabled", True)
             self.config_manager.set("sync.port", port)
             self.config_manager.set("sync.host", host)
             self.config_manager.save_config()
 
-            # Start server
-            sync_server.start(block=False)
-
             # Get local IP
             local_ip = self._get_local_ip()
 
-            print(f"数据同步服务已启动!")
+            print(f"数据同步服务已启动! (PID {status['pid']})")
             print(f"服务器地址: http://{local_ip}:{port}")
             print(f"本地地址: http://localhost:{port}")
             print(f"数据路径: {self.data_dir}")
+            if status.get('indexing'):
+                print("正在建立文件索引，完成后开始提供服务")
 
             # Display commands for other devices
             print(f"\n其他设备可以使用以下命令同步:")
@@ -142,18 +144,21 @@ class TermuxSyncManager:
             return False
 
     def stop_sync_server(self):
-        """Stop sync server"""
+        """Stop the background sync daemon"""
         self.config_manager.set("sync.enabled", False)
         self.config_manager.save_config()
-        print("数据同步服务已停止 (需要重启启动器)")
+        if stop_daemon(os.getcwd()):
+            print("数据同步服务已停止")
+        else:
+            print("数据同步服务未运行")
 
-    def sync_from_custom_server(self, server_url, method='auto', backup=True):
+    def sync_from_custom_server(self, server_url, method='auto', backup=True, jobs=4):
         """Sync from custom server URL"""
         print(f"从自定义服务器同步: {server_url}")
 
         try:
-            client = SyncClient(server_url, self.data_dir)
-            success = client.sync(prefer_zip=(method == 'auto' or method == 'zip'), backup=backup)
+            client = SyncClient(server_url, self.data_dir, jobs=jobs)
+            success = client.sync(method=method, backup=backup)
             return success
         except Exception as e:
             print(f"同步失败: {e}")
@@ -167,7 +172,11 @@ class TermuxSyncManager:
         sync_port = self.config_manager.get("sync.port", 5000)
         sync_host = self.config_manager.get("sync.host", "0.0.0.0")
 
-        print(f"  同步服务状态: {'启用' if sync_enabled else '禁用'}")
+        daemon = send_command(os.getcwd(), 'status')
+        if daemon is not None:
+            print(f"  同步服务状态: 运行中 (PID {daemon['pid']}, 已运行 {daemon['uptime']} 秒)")
+        else:
+            print(f"  同步服务状态: 未运行 (配置: {'启用' if sync_enabled else '禁用'})")
         print(f"  监听主机: {sync_host}")
         print(f"  监听端口: {sync_port}")
         print(f"  数据目录: {self.data_dir}")
@@ -232,9 +241,10 @@ def main():
     # Sync from custom server
     sync_parser = subparsers.add_parser('sync', help='从指定服务器同步数据')
     sync_parser.add_argument('server_url', help='服务器地址 (例如: 192.168.1.100:5000)')
-    sync_parser.add_argument('--method', choices=['auto', 'zip', 'incremental'],
+    sync_parser.add_argument('--method', choices=['auto', 'zip', 'incremental', 'twoway'],
                            default='auto', help='同步方法')
     sync_parser.add_argument('--no-backup', action='store_true', help='同步时不备份现有数据')
+    sync_parser.add_argument('--jobs', type=int, default=4, help='增量同步并发下载数')
 
     # Status command
     subparsers.add_parser('status', help='显示同步状态')
@@ -264,7 +274,7 @@ def main():
                 ip, port = server_url.split(':', 1)
                 server_url = f"http://{ip}:{port}"
             success = manager.sync_from_custom_server(
-                server_url, args.method, not args.no_backup
+                server_url, args.method, not args.no_backup, args.jobs
             )
             return 0 if success else 1
 
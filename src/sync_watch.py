@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync Filesystem Watcher
+inotify-based change notifications for Linux/Android (Termux), used to keep
+the manifest index up to date without rescanning the data directory
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    def __init__(self, root, on_change):
+        """
+        Initialize inotify watcher
+
+        Args:
+            root (str): Directory tree to watch (hidden directories are skipped)
+            on_change (callable): Called with the relative path ('' for the
+                root) of a directory whose contents changed, or None when
+                events were lost and a full rescan is needed
+        """
+        self.root = os.path.abspath(root)
+        self.on_change = on_change
+        self.fd = None
+        self.libc = None
+        self.watches = {}
+        self.running = False
+        self.thread = None
+
+    @staticmethod
+    def is_supported():
+        """Check whether inotify can be used on this platform"""
+        return sys.platform.startswith('linux')
+
+    def start(self):
+        """
+        Start watching in a background thread
+
+        Returns:
+            bool: False if inotify is unavailable (callers fall back to polling)
+        """
+        if not self.is_supported():
+            return False
+
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+            fd = self.libc.inotify_init1(IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return False
+        if fd < 0:
+            return False
+
+        self.fd = fd
+        self._add_tree('')
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        """Stop watching and release the inotify descriptor"""
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=2)
+            self.thread = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.watches.clear()
+
+    def _add_watch(self, rel_dir):
+        """Watch a single directory"""
+        abs_dir = os.path.join(self.root, rel_dir)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(abs_dir), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                # fs.inotify.max_user_watches exhausted - rely on rescans
+                self.on_change(None)
+            return
+        self.watches[wd] = rel_dir
+
+    def _add_tree(self, rel_dir):
+        """Watch a directory and all non-hidden subdirectories"""
+        self._add_watch(rel_dir)
+        abs_dir = os.path.join(self.root, rel_dir)
+        for root, dirs, files in os.walk(abs_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for d in dirs:
+                rel = os.path.relpath(os.path.join(root, d), self.root).replace('\\', '/')
+                self._add_watch(rel)
+
+    def _run(self):
+        """Read and dispatch inotify events"""
+        while self.running:
+            try:
+                readable, _, _ = select.select([self.fd], [], [], 1.0)
+                if not readable:
+                    continue
+                data = os.read(self.fd, 64 * 1024)
+            except OSError:
+                break
+
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                self._handle_event(wd, mask, os.fsdecode(name))
+
+    def _handle_event(self, wd, mask, name):
+        """Translate one inotify event into directory change callbacks"""
+        if mask & IN_Q_OVERFLOW:
+            self.on_change(None)
+            return
+
+        rel_dir = self.watches.get(wd)
+        if rel_dir is None:
+            return
+
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        if name.startswith('.'):
+            return
+
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            new_dir = f"{rel_dir}/{name}" if rel_dir else name
+            self._add_tree(new_dir)
+            # Files may have landed before the watch existed
+            self.on_change(new_dir)
+
+        self.on_change(rel_dir)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Sync ZIP Cache
+Keeps built /zip archives on disk keyed by manifest fingerprint, shares one
+in-progress build between concurrent requests and evicts by size
+"""
+
+import os
+import shutil
+import threading
+
+
+class ZipBuild:
+    def __init__(self, cache, key, part_path, make_chunks):
+        """
+        One archive being written to the cache
+
+        Readers tail the partial file while the build thread appends to it,
+        so they all receive the bytes of a single build. If the cache can't
+        hold the archive after all (disk full, or larger than the size cap),
+        the build is abandoned and each reader continues with its own stream
+        from where the file ended.
+
+        Args:
+            cache (ZipCache): Owning cache
+            key (str): Archive fingerprint
+            part_path (str): Partial file being written
+            make_chunks (callable): start -> archive bytes from that offset
+        """
+        self.cache = cache
+        self.key = key
+        self.part_path = part_path
+        self.make_chunks = make_chunks
+        self.cond = threading.Condition()
+        self.written = 0
+        self.done = False
+        self.error = None
+        self.abandoned = False
+
+    def run(self, chunks):
+        """Write the archive (build thread), then hand it to the cache"""
+        try:
+            self._write(chunks)
+        except BaseException as e:
+            with self.cond:
+                self.error = e
+                self.done = True
+                self.cond.notify_all()
+            self.cache._finish(self, False)
+            return
+
+        if self.abandoned:
+            # Stop compressing, readers generate the rest themselves
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+        self.cache._finish(self, not self.abandoned)
+        with self.cond:
+            self.done = True
+            self.cond.notify_all()
+
+    def _write(self, chunks):
+        """Append chunks to the partial file until done or the cache can't take more"""
+        try:
+            f = open(self.part_path, 'wb')
+        except OSError:
+            self.abandoned = True
+            return
+        try:
+            for chunk in chunks:
+                if self.written + len(chunk) > self.cache.max_bytes:
+                    self.abandoned = True
+                    return
+                try:
+                    f.write(chunk)
+                    f.flush()
+                except OSError:
+                    # e.g. ENOSPC: losing the cached copy must not fail the download
+                    self.abandoned = True
+                    return
+                with self.cond:
+                    self.written += len(chunk)
+                    self.cond.notify_all()
+        finally:
+            try:
+                f.close()
+            except OSError:
+                self.abandoned = True
+
+    def iter_content(self, f, chunk_size=64 * 1024):
+        """
+        Yield the archive from the start, waiting for bytes not written yet
+
+        Args:
+            f: Reader opened on the partial file
+
+        Raises:
+            Exception: The build failed, so the archive is incomplete
+        """
+        with f:
+            position = 0
+            while True:
+                data = f.read(chunk_size)
+                if data:
+                    position += len(data)
+                    yield data
+                    continue
+                with self.cond:
+                    while not self.done and self.written <= position:
+                        self.cond.wait()
+                    if self.error is not None:
+                        raise self.error
+                    if not self.done or self.written > position:
+                        continue
+                    abandoned = self.abandoned
+                if abandoned:
+                    # Bytes of a write that failed halfway are still valid
+                    for data in iter(lambda: f.read(chunk_size), b''):
+                        position += len(data)
+                        yield data
+                    yield from self.make_chunks(position)
+                return
+
+
+class ZipCache:
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024, min_free_bytes=256 * 1024 * 1024):
+        """
+        Initialize ZIP cache
+
+        Args:
+            cache_dir (str): Directory for cached archives
+            max_bytes (int): Size cap; least recently used archives are
+                removed beyond it, larger archives are never cached
+            min_free_bytes (int): Disk space a new archive must leave free
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.lock = threading.Lock()
+        self.builds = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Builds interrupted by a restart can't be resumed
+        for name in os.listdir(cache_dir):
+            if name.endswith('.part'):
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError:
+                    pass
+
+    def _path(self, key):
+        """Archive path for a fingerprint"""
+        return os.path.join(self.cache_dir, f"{key}.zip")
+
+    def get(self, key):
+        """
+        Look up a complete archive
+
+        Args:
+            key (str): Archive fingerprint
+
+        Returns:
+            str: Archive path, or None if not cached
+        """
+        path = self._path(key)
+        try:
+            # mtime doubles as last-use time for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def stream(self, key, make_chunks, size_hint=None):
+        """
+        Stream an archive through the cache
+
+        If the archive is already being built, the request joins that build;
+        otherwise a build thread is started. The build runs to completion
+        even if every client disconnects, so a retry finds it cached.
+        Archives that wouldn't fit (see has_room) are streamed straight from
+        make_chunks without touching the disk.
+
+        Args:
+            key (str): Archive fingerprint
+            make_chunks (callable): start -> iterable of archive bytes from
+                that offset; the archive must be the same on every call
+            size_hint (int): Expected archive size, if known
+
+        Returns:
+            iterable: Archive bytes from the start
+        """
+        with self.lock:
+            build = self.builds.get(key)
+            if build is None:
+                if not self.has_room(size_hint):
+                    return make_chunks(0)
+                build = ZipBuild(self, key, self._path(key) + '.part', make_chunks)
+                # Create the file before any reader opens it
+                try:
+                    open(build.part_path, 'wb').close()
+                except OSError:
+                    return make_chunks(0)
+                self.builds[key] = build
+                threading.Thread(
+                    target=build.run, args=(make_chunks(0),), daemon=True
+                ).start()
+            # Opened under the lock, before the build can be renamed away
+            reader = open(build.part_path, 'rb')
+        return build.iter_content(reader)
+
+    def has_room(self, size):
+        """
+        Check whether an archive of about size bytes should be cached
+
+        Returns:
+            bool: False if it exceeds max_bytes or would leave less than
+                min_free_bytes free on the cache's filesystem
+        """
+        if size is None:
+            return True
+        if size > self.max_bytes:
+            return False
+        try:
+            free = shutil.disk_usage(self.cache_dir).free
+        except OSError:
+            return False
+        return free - size >= self.min_free_bytes
+
+    def _finish(self, build, success):
+        """Publish or discard a finished build and apply the size cap"""
+        with self.lock:
+            self.builds.pop(build.key, None)
+            if success:
+                os.replace(build.part_path, self._path(build.key))
+            else:
+                try:
+                    os.remove(build.part_path)
+                except OSError:
+                    pass
+        if success:
+            self.evict()
+
+    def retain(self, keep):
+        """
+        Remove cached archives whose fingerprint is no longer useful
+
+        Args:
+            keep (callable): key -> bool, False for archives to remove
+        """
+        for key, path, _, _ in self._entries():
+            if not keep(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """Remove least recently used archives until the cache fits max_bytes"""
+        entries = sorted(self._entries(), key=lambda entry: entry[3])
+        total = sum(entry[2] for entry in entries)
+        for _, path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            # Readers still streaming it keep their open file
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def _entries(self):
+        """Complete archives as (key, path, size, mtime)"""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith('.zip'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((name[:-4], path, st.st_size, st.st_mtime))
+        return entries
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Streaming ZIP Extractor
+Unpacks ZIP entries from their local file headers while the archive is still
+arriving, so no temporary archive is written
+"""
+
+import os
+import struct
+import zlib
+
+from sync_zipstream import (
+    CENTRAL_HEADER_SIG, DATA_DESCRIPTOR_SIG, END_OF_CENTRAL_DIR_SIG, FLAG_DATA_DESCRIPTOR,
+    FLAG_UTF8, LOCAL_HEADER_SIG, METHOD_DEFLATED, METHOD_STORED
+)
+
+
+LOCAL_HEADER = struct.Struct('<HHHHHIIIHH')
+
+
+class ZipStreamError(Exception):
+    """The stream is not a ZIP archive this extractor can unpack sequentially"""
+
+
+class _ChunkStream:
+    def __init__(self, chunks, offset=0):
+        """
+        Buffered reader over an iterator of byte chunks
+
+        Args:
+            chunks (iterable): Byte chunks, e.g. response.iter_content()
+            offset (int): Archive offset of the first chunk
+        """
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.offset = offset
+
+    def read_some(self, limit):
+        """Read between 1 and limit bytes, or b'' at the end of the stream"""
+        if not self.buffer:
+            for chunk in self.chunks:
+                if chunk:
+                    self.buffer = chunk
+                    break
+            else:
+                return b''
+        data, self.buffer = self.buffer[:limit], self.buffer[limit:]
+        self.offset += len(data)
+        return data
+
+    def read_exact(self, n):
+        """Read exactly n bytes"""
+        parts = []
+        while n:
+            data = self.read_some(n)
+            if not data:
+                raise ZipStreamError("unexpected end of archive")
+            parts.append(data)
+            n -= len(data)
+        return b''.join(parts)
+
+    def skip(self, n):
+        """Consume n bytes without keeping them"""
+        while n:
+            data = self.read_some(min(n, 64 * 1024))
+            if not data:
+                raise ZipStreamError("unexpected end of archive")
+            n -= len(data)
+
+    def unread(self, data):
+        """Push back bytes read past the end of an entry"""
+        if data:
+            self.buffer = data + self.buffer
+            self.offset -= len(data)
+
+
+class _EntrySink:
+    def __init__(self, temp_path, spool_limit):
+        """
+        Collect one entry's content, in memory until spool_limit is exceeded
+
+        Args:
+            temp_path (str): Temporary file used once the content spills to disk
+            spool_limit (int): Bytes kept in memory
+        """
+        self.temp_path = temp_path
+        self.spool_limit = spool_limit
+        self.parts = []
+        self.size = 0
+        self.file = None
+
+    def write(self, data):
+        """Add decompressed content"""
+        self.size += len(data)
+        if self.file is None and self.size > self.spool_limit:
+            self.file = open(self.temp_path, 'wb')
+            self.file.writelines(self.parts)
+            self.parts = []
+        if self.file is not None:
+            self.file.write(data)
+        else:
+            self.parts.append(data)
+
+    def link_from(self, source, target):
+        """Hardlink an identical existing file to target instead of writing"""
+        try:
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+            os.link(source, self.temp_path)
+            os.replace(self.temp_path, target)
+            return True
+        except OSError:
+            return False
+
+    def commit(self, target):
+        """Write out the content and move it into place"""
+        if self.file is None:
+            self.file = open(self.temp_path, 'wb')
+            self.file.writelines(self.parts)
+            self.parts = []
+        self.file.close()
+        os.replace(self.temp_path, target)
+
+    def discard(self):
+        """Release buffers and remove the temporary file if still present"""
+        self.parts = []
+        if self.file is not None:
+            self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+
+def _safe_target(dest, name):
+    """Resolve an entry name below dest, rejecting absolute or escaping paths"""
+    name = name.replace('\\', '/')
+    parts = [p for p in name.split('/') if p not in ('', '.')]
+    if not parts or name.startswith('/') or '..' in parts:
+        raise ZipStreamError(f"unsafe entry name: {name}")
+    return os.path.join(dest, *parts)
+
+
+def _zip64_sizes(extra, compress_size, file_size):
+    """Read sizes from a Zip64 extra field when the header holds 0xFFFFFFFF"""
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, length = struct.unpack_from('<HH', extra, pos)
+        if tag == 0x0001:
+            field = extra[pos + 4:pos + 4 + length]
+            values = [struct.unpack_from('<Q', field, i)[0] for i in range(0, len(field) - 7, 8)]
+            if file_size == 0xFFFFFFFF and values:
+                file_size = values.pop(0)
+            if compress_size == 0xFFFFFFFF and values:
+                compress_size = values.pop(0)
+            return True, compress_size, file_size
+        pos += 4 + length
+    return False, compress_size, file_size
+
+
+def extract_stream(chunks, dest, offset=0, on_entry=None, reuse=None,
+                   chunk_size=64 * 1024, spool_limit=16 * 1024 * 1024):
+    """
+    Extract a ZIP archive sequentially from a byte stream
+
+    Entries are written to a hidden temporary file next to their target and
+    renamed into place once the CRC matches. Entries using data descriptors
+    must be deflated (their end is found by the decompressor); stored entries
+    need sizes in the local header.
+
+    If reuse finds an identical local file, that file is hardlinked into
+    place instead. Entries with sizes and CRC in the local header are
+    checked before their content, which is then skipped unread. The CRC of a
+    data-descriptor entry is only known after its content, so entries up to
+    spool_limit are held in memory until then and nothing is written when a
+    local copy matches; larger ones are written to disk first and still
+    replaced by the link, so staging shares the data folder's copy.
+
+    Args:
+        chunks (iterable): Archive bytes, starting at offset
+        dest (str): Directory to extract into
+        offset (int): Archive offset of the first byte; must be the start of
+            a local file header
+        on_entry (callable): Called with (name, file_size, next_offset, reused)
+            after each entry is in place, next_offset being where the
+            following entry starts (a safe point to resume from)
+        reuse (callable): (name, file_size, crc) -> path of an identical
+            local file on the same filesystem, or None
+
+    Returns:
+        int: Number of files extracted
+    """
+    stream = _ChunkStream(chunks, offset)
+    count = 0
+
+    while True:
+        # Archives always end with a central directory; running out of data
+        # before it means the transfer was cut short
+        signature, = struct.unpack('<I', stream.read_exact(4))
+        if signature in (CENTRAL_HEADER_SIG, END_OF_CENTRAL_DIR_SIG):
+            break
+        if signature != LOCAL_HEADER_SIG:
+            raise ZipStreamError(f"unexpected record at offset {stream.offset - 4}")
+
+        (_, flags, method, _, _, crc, compress_size, file_size,
+         name_len, extra_len) = LOCAL_HEADER.unpack(stream.read_exact(LOCAL_HEADER.size))
+        raw_name = stream.read_exact(name_len)
+        extra = stream.read_exact(extra_len)
+        name = raw_name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437')
+        zip64, compress_size, file_size = _zip64_sizes(extra, compress_size, file_size)
+        has_descriptor = bool(flags & FLAG_DATA_DESCRIPTOR)
+
+        if method not in (METHOD_STORED, METHOD_DEFLATED):
+            raise ZipStreamError(f"unsupported compression method {method}: {name}")
+        if has_descriptor and method == METHOD_STORED:
+            raise ZipStreamError(f"stored entry without sizes: {name}")
+
+        target = _safe_target(dest, name)
+        if name.endswith('/'):
+            os.makedirs(target, exist_ok=True)
+            continue
+
+        directory, base = os.path.split(target)
+        os.makedirs(directory, exist_ok=True)
+        sink = _EntrySink(os.path.join(directory, f".{base}.extract"), spool_limit)
+        actual_crc = 0
+
+        if not has_descriptor and reuse is not None:
+            source = reuse(name, file_size, crc)
+            if source is not None and sink.link_from(source, target):
+                stream.skip(compress_size)
+                count += 1
+                if on_entry:
+                    on_entry(name, file_size, stream.offset, True)
+                continue
+
+        try:
+            if method == METHOD_DEFLATED:
+                decompressor = zlib.decompressobj(-15)
+                remaining = None if has_descriptor else compress_size
+                while not decompressor.eof:
+                    limit = chunk_size if remaining is None else min(chunk_size, remaining)
+                    data = stream.read_some(limit) if limit else b''
+                    if not data:
+                        raise ZipStreamError(f"truncated entry: {name}")
+                    if remaining is not None:
+                        remaining -= len(data)
+                    output = decompressor.decompress(data)
+                    stream.unread(decompressor.unused_data)
+                    actual_crc = zlib.crc32(output, actual_crc)
+                    sink.write(output)
+            else:
+                remaining = compress_size
+                while remaining:
+                    data = stream.read_some(min(chunk_size, remaining))
+                    if not data:
+                        raise ZipStreamError(f"truncated entry: {name}")
+                    remaining -= len(data)
+                    actual_crc = zlib.crc32(data, actual_crc)
+                    sink.write(data)
+
+            if has_descriptor:
+                first = stream.read_exact(4)
+                if struct.unpack('<I', first)[0] == DATA_DESCRIPTOR_SIG:
+                    first = stream.read_exact(4)
+                crc, = struct.unpack('<I', first)
+                size_format = '<QQ' if zip64 else '<II'
+                compress_size, file_size = struct.unpack(
+                    size_format, stream.read_exact(struct.calcsize(size_format))
+                )
+
+            if actual_crc != crc or sink.size != file_size:
+                raise ZipStreamError(f"CRC mismatch: {name}")
+
+            # An identical local file is linked instead of writing the content
+            source = None if reuse is None else reuse(name, file_size, crc)
+            reused = source is not None and sink.link_from(source, target)
+            if not reused:
+                sink.commit(target)
+        finally:
+            sink.discard()
+
+        count += 1
+        if on_entry:
+            on_entry(name, file_size, stream.offset, reused)
+
+    return count
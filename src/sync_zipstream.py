@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""
+SillyTavern Streaming ZIP Writer
+Builds ZIP archives entry by entry (data descriptors + Zip64) so they can be
+sent over HTTP without holding the whole archive in memory
+"""
+
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ZIP record signatures
+LOCAL_HEADER_SIG = 0x04034b50
+DATA_DESCRIPTOR_SIG = 0x08074b50
+CENTRAL_HEADER_SIG = 0x02014b50
+END_OF_CENTRAL_DIR_SIG = 0x06054b50
+ZIP64_END_OF_CENTRAL_DIR_SIG = 0x06064b50
+ZIP64_LOCATOR_SIG = 0x07064b50
+
+# Limits above which Zip64 records are required (same threshold as zipfile)
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+# Already-compressed formats gain almost nothing from deflate
+STORED_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.webp', '.gif', '.avif', '.heic',
+    '.mp3', '.ogg', '.opus', '.m4a', '.aac', '.flac',
+    '.mp4', '.webm', '.mkv', '.mov',
+    '.zip', '.gz', '.7z', '.rar', '.xz', '.bz2', '.zst', '.woff', '.woff2',
+}
+DEFLATED_EXTENSIONS = {
+    '.json', '.jsonl', '.txt', '.md', '.html', '.css', '.js', '.yaml', '.yml',
+    '.csv', '.svg', '.xml', '.log', '.ini', '.wav',
+}
+# Entries up to this size are compressed in worker threads (zlib releases
+# the GIL); larger ones are streamed from the calling thread
+PARALLEL_ENTRY_LIMIT = 8 * 1024 * 1024
+
+# Unknown types are sampled; store them when deflate saves less than this
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_MIN_SAVING = 0.1
+
+
+def choose_method(file_path, compress_level=6):
+    """
+    Decide whether an entry is deflated or stored
+
+    Known media and archive formats are stored, known text formats are
+    deflated, anything else is decided by deflating a sample of its start.
+
+    Args:
+        file_path (str): File to be added
+        compress_level (int): Requested level, 0 stores everything
+
+    Returns:
+        int: METHOD_STORED or METHOD_DEFLATED
+    """
+    if compress_level == 0:
+        return METHOD_STORED
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext in STORED_EXTENSIONS:
+        return METHOD_STORED
+    if ext in DEFLATED_EXTENSIONS:
+        return METHOD_DEFLATED
+
+    try:
+        with open(file_path, 'rb') as f:
+            sample = f.read(SAMPLE_SIZE)
+    except OSError:
+        return METHOD_DEFLATED
+    if len(sample) < 512:
+        return METHOD_DEFLATED
+    compressed = zlib.compress(sample, 1)
+    if len(compressed) > len(sample) * (1 - SAMPLE_MIN_SAVING):
+        return METHOD_STORED
+    return METHOD_DEFLATED
+
+
+class ZipLayoutChanged(Exception):
+    """A file no longer matches the layout the response was planned with"""
+
+
+class ZipStreamWriter:
+    def __init__(self, chunk_size=64 * 1024, compress_level=6):
+        """
+        Initialize streaming ZIP writer
+
+        Output is deterministic for the same files, so a partially received
+        archive can be resumed by generating it again from a byte offset.
+
+        Args:
+            chunk_size (int): Read size and minimum size of yielded chunks
+            compress_level (int): zlib compression level (0-9)
+        """
+        self.chunk_size = chunk_size
+        self.compress_level = compress_level
+        self.offset = 0
+        self.entries = []
+
+    def _emit(self, data):
+        """Account for bytes written to the output stream"""
+        self.offset += len(data)
+        return data
+
+    def _dos_datetime(self, mtime):
+        """Convert a timestamp to (dos_time, dos_date)"""
+        t = time.localtime(mtime)
+        year = max(1980, min(t.tm_year, 2107))
+        dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+        dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+        return dos_time, dos_date
+
+    def _local_header(self, name, file_size, dos_time, dos_date, method=METHOD_DEFLATED, crc=0):
+        """
+        Build the local file header for an entry
+
+        Deflated entries use a data descriptor. Stored entries carry CRC and
+        sizes in the header, so a sequential reader knows where they end.
+
+        Returns:
+            tuple: (header bytes, zip64 flag, flags)
+        """
+        if method == METHOD_STORED:
+            zip64 = file_size > ZIP64_LIMIT
+            flags = FLAG_UTF8
+            sizes = (file_size, file_size)
+        else:
+            # Like zipfile, reserve Zip64 sizes when the file may grow past the limit
+            zip64 = file_size * 1.05 > ZIP64_LIMIT
+            flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+            sizes = (0, 0)
+            crc = 0
+        version = 45 if zip64 else 20
+
+        if zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, *sizes)
+            sizes = (0xFFFFFFFF, 0xFFFFFFFF)
+        else:
+            extra = b''
+
+        header = struct.pack(
+            '<IHHHHHIIIHH',
+            LOCAL_HEADER_SIG, version, flags, method,
+            dos_time, dos_date, crc, sizes[0], sizes[1],
+            len(name), len(extra)
+        ) + name + extra
+        return header, zip64, flags
+
+    def _iter_stored(self, f, file_size, crc, arcname):
+        """Yield stored content, checking it still matches the header"""
+        actual_crc = 0
+        remaining = file_size
+        while remaining:
+            data = f.read(min(self.chunk_size, remaining))
+            if not data:
+                raise ZipLayoutChanged(arcname)
+            remaining -= len(data)
+            actual_crc = zlib.crc32(data, actual_crc)
+            yield self._emit(data)
+        if actual_crc != crc:
+            raise ZipLayoutChanged(arcname)
+
+    def iter_file(self, file_path, arcname, method=None, crc=None):
+        """
+        Yield the local header, data and data descriptor for one file
+
+        The file is opened before anything is emitted, so unreadable files
+        raise OSError without corrupting the archive.
+
+        Args:
+            file_path (str): Path of the file on disk
+            arcname (str): Name of the entry inside the archive
+            method (int): Compression method, chosen by choose_method if None
+            crc (int): Known CRC32 of a stored file (read first otherwise)
+
+        Yields:
+            bytes: Archive chunks
+        """
+        if method is None:
+            method = choose_method(file_path, self.compress_level)
+
+        with open(file_path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            dos_time, dos_date = self._dos_datetime(st.st_mtime)
+            name = arcname.replace(os.sep, '/').encode('utf-8')
+
+            if method == METHOD_STORED:
+                if crc is None:
+                    crc = 0
+                    while True:
+                        data = f.read(1024 * 1024)
+                        if not data:
+                            break
+                        crc = zlib.crc32(data, crc)
+                    f.seek(0)
+                header, zip64, flags = self._local_header(
+                    name, st.st_size, dos_time, dos_date, METHOD_STORED, crc
+                )
+                header_offset = self.offset
+                yield self._emit(header)
+                yield from self._iter_stored(f, st.st_size, crc, arcname)
+                file_size = compress_size = st.st_size
+            else:
+                header, zip64, flags = self._local_header(name, st.st_size, dos_time, dos_date)
+                header_offset = self.offset
+                yield self._emit(header)
+                crc, compress_size, file_size = yield from self._iter_deflated(f, zip64, file_path)
+
+        self.entries.append({
+            'name': name,
+            'flags': flags,
+            'method': method,
+            'dos_time': dos_time,
+            'dos_date': dos_date,
+            'crc': crc,
+            'compress_size': compress_size,
+            'file_size': file_size,
+            'header_offset': header_offset,
+            'external_attr': (st.st_mode & 0xFFFF) << 16,
+            'mode': st.st_mode,
+            'key': (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns),
+        })
+
+    def _iter_deflated(self, f, zip64, file_path):
+        """
+        Yield deflated content followed by the data descriptor
+
+        Returns:
+            tuple: (crc, compress_size, file_size) via StopIteration
+        """
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+        pending = []
+        pending_size = 0
+
+        while True:
+            data = f.read(self.chunk_size)
+            if not data:
+                break
+            file_size += len(data)
+            crc = zlib.crc32(data, crc)
+            out = compressor.compress(data)
+            if out:
+                pending.append(out)
+                pending_size += len(out)
+                if pending_size >= self.chunk_size:
+                    chunk = b''.join(pending)
+                    compress_size += len(chunk)
+                    pending = []
+                    pending_size = 0
+                    yield self._emit(chunk)
+
+        pending.append(compressor.flush())
+        chunk = b''.join(pending)
+        compress_size += len(chunk)
+
+        if zip64:
+            descriptor = struct.pack('<IIQQ', DATA_DESCRIPTOR_SIG, crc,
+                                     compress_size, file_size)
+        else:
+            if compress_size > 0xFFFFFFFF or file_size > 0xFFFFFFFF:
+                raise OSError(f"文件在打包过程中增长过大: {file_path}")
+            descriptor = struct.pack('<IIII', DATA_DESCRIPTOR_SIG, crc,
+                                     compress_size, file_size)
+        yield self._emit(chunk + descriptor)
+        return crc, compress_size, file_size
+
+    def iter_compressed(self, chunks, entry):
+        """
+        Yield an entry compressed by another writer (see compress_entry)
+
+        Local headers don't depend on the entry's position, so the bytes are
+        placed at the current offset unchanged.
+
+        Args:
+            chunks (list): Entry bytes
+            entry (dict): Its entry record
+        """
+        entry = dict(entry, header_offset=self.offset)
+        for chunk in chunks:
+            yield self._emit(chunk)
+        self.entries.append(entry)
+
+    def skip_file(self, arcname, layout):
+        """
+        Account for an entry without reading the file
+
+        Used when resuming: entries that lie completely before the requested
+        offset only need their central directory record.
+
+        Args:
+            arcname (str): Name of the entry inside the archive
+            layout (dict): Known 'method', 'crc', 'compress_size', 'file_size',
+                'mtime' and 'mode' of the entry
+        """
+        dos_time, dos_date = self._dos_datetime(layout['mtime'])
+        name = arcname.replace(os.sep, '/').encode('utf-8')
+        method = layout.get('method', METHOD_DEFLATED)
+        header, zip64, flags = self._local_header(
+            name, layout['file_size'], dos_time, dos_date, method, layout['crc']
+        )
+
+        self.entries.append({
+            'name': name,
+            'flags': flags,
+            'method': method,
+            'dos_time': dos_time,
+            'dos_date': dos_date,
+            'crc': layout['crc'],
+            'compress_size': layout['compress_size'],
+            'file_size': layout['file_size'],
+            'header_offset': self.offset,
+            'external_attr': (layout['mode'] & 0xFFFF) << 16,
+            'mode': layout['mode'],
+            'key': None,
+        })
+        descriptor_size = 0 if method == METHOD_STORED else (24 if zip64 else 16)
+        self.offset += len(header) + layout['compress_size'] + descriptor_size
+
+    def iter_close(self):
+        """
+        Yield the central directory and end records
+
+        Yields:
+            bytes: Archive chunks
+        """
+        central_dir_offset = self.offset
+        records = []
+
+        for entry in self.entries:
+            zip64_fields = []
+            file_size = entry['file_size']
+            compress_size = entry['compress_size']
+            header_offset = entry['header_offset']
+
+            if file_size > ZIP64_LIMIT:
+                zip64_fields.append(file_size)
+                file_size = 0xFFFFFFFF
+            if compress_size > ZIP64_LIMIT:
+                zip64_fields.append(compress_size)
+                compress_size = 0xFFFFFFFF
+            if header_offset > ZIP64_LIMIT:
+                zip64_fields.append(header_offset)
+                header_offset = 0xFFFFFFFF
+
+            if zip64_fields:
+                extra = struct.pack('<HH', 0x0001, 8 * len(zip64_fields))
+                extra += struct.pack(f'<{len(zip64_fields)}Q', *zip64_fields)
+                version = 45
+            else:
+                extra = b''
+                version = 20
+
+            records.append(struct.pack(
+                '<IHHHHHHIIIHHHHHII',
+                CENTRAL_HEADER_SIG, (3 << 8) | version, version,
+                entry['flags'], entry['method'],
+                entry['dos_time'], entry['dos_date'], entry['crc'],
+                compress_size, file_size,
+                len(entry['name']), len(extra), 0, 0, 0,
+                entry['external_attr'], header_offset
+            ) + entry['name'] + extra)
+
+            if len(records) >= 256:
+                yield self._emit(b''.join(records))
+                records = []
+
+        if records:
+            yield self._emit(b''.join(records))
+
+        central_dir_size = self.offset - central_dir_offset
+        count = len(self.entries)
+        tail = b''
+
+        if (count > ZIP_FILECOUNT_LIMIT or central_dir_offset > ZIP64_LIMIT
+                or central_dir_size > ZIP64_LIMIT):
+            zip64_end_offset = self.offset
+            tail += struct.pack(
+                '<IQHHIIQQQQ',
+                ZIP64_END_OF_CENTRAL_DIR_SIG, 44, 45, 45, 0, 0,
+                count, count, central_dir_size, central_dir_offset
+            )
+            tail += struct.pack('<IIQI', ZIP64_LOCATOR_SIG, 0, zip64_end_offset, 1)
+            count = min(count, 0xFFFF)
+            central_dir_size = min(central_dir_size, 0xFFFFFFFF)
+            central_dir_offset = min(central_dir_offset, 0xFFFFFFFF)
+
+        tail += struct.pack(
+            '<IHHHHIIH',
+            END_OF_CENTRAL_DIR_SIG, 0, 0, count, count,
+            central_dir_size, central_dir_offset, 0
+        )
+        yield self._emit(tail)
+
+
+def compress_entry(file_path, arcname, method=None, crc=None, chunk_size=64 * 1024,
+                   compress_level=6):
+    """
+    Compress one entry into memory
+
+    Returns:
+        tuple: (list of entry bytes, entry record) for ZipStreamWriter.iter_compressed
+    """
+    writer = ZipStreamWriter(chunk_size=chunk_size, compress_level=compress_level)
+    chunks = list(writer.iter_file(file_path, arcname, method, crc))
+    return chunks, writer.entries[0]
+
+
+def _replay_args(layout):
+    """Method and CRC that reproduce a known layout: (method, crc)"""
+    if layout is None:
+        return None, None
+    # Replay the known method so the bytes match the earlier layout
+    method = layout.get('method', METHOD_DEFLATED)
+    return method, layout['crc'] if method == METHOD_STORED else None
+
+
+def measure_file(file_path, arcname, compress_level=6):
+    """
+    Compress a file without sending it to learn its ZIP layout
+
+    Returns:
+        dict: The finished entry record (see ZipStreamWriter.iter_file)
+    """
+    writer = ZipStreamWriter(compress_level=compress_level)
+    for _ in writer.iter_file(file_path, arcname):
+        pass
+    return writer.entries[0]
+
+
+def archive_size(files, compress_level=6):
+    """
+    Compute the exact archive size from known layouts
+
+    Args:
+        files (iterable): (arcname, layout) pairs, layout as for skip_file
+
+    Returns:
+        int: Total archive length in bytes
+    """
+    writer = ZipStreamWriter(compress_level=compress_level)
+    for arcname, layout in files:
+        writer.skip_file(arcname, layout)
+    for _ in writer.iter_close():
+        pass
+    return writer.offset
+
+
+def iter_zip(files, chunk_size=64 * 1024, compress_level=6, start=0, stop=None,
+             on_entry=None, workers=1, window_bytes=64 * 1024 * 1024):
+    """
+    Stream a ZIP archive built from (file_path, arcname, layout) triples
+
+    Files that cannot be opened are skipped, mirroring ZipFile.write usage
+    in the sync server. With start/stop only that byte range is yielded;
+    entries that end before start are skipped using their known layout.
+
+    With several workers, entries up to PARALLEL_ENTRY_LIMIT are compressed
+    ahead in a thread pool and written out in order. Read-ahead stops once
+    window_bytes of file content is queued, which bounds memory use.
+
+    Args:
+        files (iterable): (file_path, arcname, layout) triples; layout is
+            None or the known entry layout (see ZipStreamWriter.skip_file)
+        chunk_size (int): Read size and minimum size of yielded chunks
+        compress_level (int): zlib compression level (0-9); 0 stores every
+            entry, otherwise choose_method decides per file
+        start (int): First byte to yield
+        stop (int): Byte offset to stop at (exclusive), None for the end
+        on_entry (callable): Called with each entry compressed from disk
+        workers (int): Compression threads (1 compresses inline)
+        window_bytes (int): Limit on file bytes compressed ahead of the output
+
+    Yields:
+        bytes: Archive chunks
+
+    Raises:
+        ZipLayoutChanged: A file no longer matches its known layout, so the
+            bytes already sent don't belong to one consistent archive
+    """
+    writer = ZipStreamWriter(chunk_size=chunk_size, compress_level=compress_level)
+    files = iter(files)
+
+    def window(chunk):
+        chunk_start = writer.offset - len(chunk)
+        lo = max(start - chunk_start, 0)
+        hi = len(chunk) if stop is None else min(stop - chunk_start, len(chunk))
+        return chunk[lo:hi] if lo < hi else b''
+
+    # Offsets only grow, so the entries the client already has form a prefix
+    queue = deque()
+    for file_path, arcname, layout in files:
+        if layout is not None and start > 0:
+            # Skip whole entries that the client already has
+            probe = ZipStreamWriter(compress_level=compress_level)
+            probe.offset = writer.offset
+            probe.skip_file(arcname, layout)
+            if probe.offset <= start:
+                writer.skip_file(arcname, layout)
+                continue
+        queue.append(((file_path, arcname, layout), None, 0))
+        break
+
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    queued_bytes = 0
+
+    def fill():
+        nonlocal queued_bytes
+        while len(queue) < workers * 4 and queued_bytes < window_bytes:
+            item = next(files, None)
+            if item is None:
+                return
+            file_path, arcname, layout = item
+            if layout is not None:
+                size = layout['file_size']
+            else:
+                try:
+                    size = os.path.getsize(file_path)
+                except OSError:
+                    # Left to the inline path, which reports it like any other
+                    size = None
+            if size is None or size > PARALLEL_ENTRY_LIMIT:
+                queue.append((item, None, 0))
+                continue
+            future = pool.submit(
+                compress_entry, file_path, arcname, *_replay_args(layout),
+                chunk_size=chunk_size, compress_level=compress_level
+            )
+            queue.append((item, future, size))
+            queued_bytes += size
+
+    try:
+        while True:
+            if stop is not None and writer.offset >= stop:
+                return
+            if pool is not None:
+                fill()
+            elif not queue:
+                item = next(files, None)
+                if item is not None:
+                    queue.append((item, None, 0))
+            if not queue:
+                break
+
+            (file_path, arcname, layout), future, size = queue.popleft()
+            queued_bytes -= size
+            entry_offset = writer.offset
+            try:
+                if future is not None:
+                    chunks = writer.iter_compressed(*future.result())
+                else:
+                    chunks = writer.iter_file(file_path, arcname, *_replay_args(layout))
+                for chunk in chunks:
+                    data = window(chunk)
+                    if data:
+                        yield data
+            except OSError:
+                # File vanished between walk and open, or is unreadable; workers
+                # fail before anything is written, the inline path may not
+                if writer.offset != entry_offset:
+                    raise
+                if layout is not None:
+                    raise ZipLayoutChanged(arcname)
+                continue
+
+            entry = writer.entries[-1]
+            if on_entry:
+                on_entry(entry)
+            if layout is not None and (entry['crc'], entry['compress_size'], entry['file_size']) != (
+                    layout['crc'], layout['compress_size'], layout['file_size']):
+                raise ZipLayoutChanged(arcname)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    for chunk in writer.iter_close():
+        data = window(chunk)
+        if data:
+            yield data
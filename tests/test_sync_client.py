@@ -0,0 +1,247 @@
+import os
+import socket
+
+import pytest
+import requests
+
+from sync_client import SyncClient
+from sync_hash import hash_file
+from sync_server import SyncServer
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def remote(tmp_path):
+    data = tmp_path / "remote"
+    data.mkdir()
+    server = SyncServer(data_path=str(data), port=free_port(), host='127.0.0.1',
+                        index_path=str(tmp_path / "index.db"))
+    assert server.start(block=False)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def local(tmp_path):
+    data = tmp_path / "local"
+    data.mkdir()
+    return data
+
+
+def make_client(remote, local, tmp_path):
+    return SyncClient(f"http://127.0.0.1:{remote.port}", str(local),
+                      state_path=str(tmp_path / "client.db"), max_retries=0)
+
+
+def entry_for(path, rel_path):
+    st = os.stat(path)
+    return {'path': rel_path, 'size': st.st_size, 'mtime': st.st_mtime, 'hash': hash_file(path)}
+
+
+def test_append_replaces_chat_without_touching_the_original(remote, local, tmp_path):
+    chat = "chats/a.jsonl"
+    (local / "chats").mkdir()
+    (local / chat).write_bytes(b'{"line": 1}\n')
+    (tmp_path / "remote" / "chats").mkdir()
+    (tmp_path / "remote" / chat).write_bytes(b'{"line": 1}\n{"line": 2}\n')
+    # A reader holding the old file must never see a partial append
+    os.link(local / chat, tmp_path / "reader.jsonl")
+
+    client = make_client(remote, local, tmp_path)
+    client.hash_cache.get(str(local / chat))
+    assert client._download_append(entry_for(str(tmp_path / "remote" / chat), chat))
+
+    assert (local / chat).read_bytes() == b'{"line": 1}\n{"line": 2}\n'
+    assert (tmp_path / "reader.jsonl").read_bytes() == b'{"line": 1}\n'
+    assert sorted(os.listdir(local / "chats")) == ["a.jsonl"]
+
+
+def test_append_with_wrong_hash_leaves_chat_unchanged(remote, local, tmp_path):
+    chat = "chats/a.jsonl"
+    (local / "chats").mkdir()
+    (local / chat).write_bytes(b'{"line": 1}\n')
+    (tmp_path / "remote" / "chats").mkdir()
+    (tmp_path / "remote" / chat).write_bytes(b'{"line": 1}\n{"line": 2}\n')
+
+    client = make_client(remote, local, tmp_path)
+    client.hash_cache.get(str(local / chat))
+    info = dict(entry_for(str(tmp_path / "remote" / chat), chat), hash="0" * 32)
+    assert not client._download_append(info)
+
+    assert (local / chat).read_bytes() == b'{"line": 1}\n'
+    assert sorted(os.listdir(local / "chats")) == ["a.jsonl"]
+
+
+def test_zip_sync_keeps_local_only_and_hidden_files(remote, local, tmp_path):
+    (tmp_path / "remote" / "chats").mkdir()
+    (tmp_path / "remote" / "chats" / "a.jsonl").write_bytes(b"remote")
+    (tmp_path / "remote" / "settings.json").write_bytes(b"{}")
+    (local / "chats").mkdir()
+    (local / "chats" / "a.jsonl").write_bytes(b"old")
+    (local / "chats" / "local-only.jsonl").write_bytes(b"mine")
+    (local / ".hidden").mkdir()
+    (local / ".hidden" / "state").write_bytes(b"keep")
+    (local / "empty").mkdir()
+    remote.index.refresh(full=True, force=True)
+
+    client = make_client(remote, local, tmp_path)
+    assert client.sync_full_zip(backup=False)
+
+    assert (local / "chats" / "a.jsonl").read_bytes() == b"remote"
+    assert (local / "settings.json").read_bytes() == b"{}"
+    assert (local / "chats" / "local-only.jsonl").read_bytes() == b"mine"
+    assert (local / ".hidden" / "state").read_bytes() == b"keep"
+    assert (local / "empty").is_dir()
+
+
+def test_incremental_sync_with_failed_downloads_reports_failure(remote, local, tmp_path):
+    (tmp_path / "remote" / "chats").mkdir()
+    (tmp_path / "remote" / "chats" / "a.jsonl").write_bytes(b"remote")
+    (tmp_path / "remote" / "settings.json").write_bytes(b"{}")
+    remote.index.refresh(full=True, force=True)
+
+    client = make_client(remote, local, tmp_path)
+    plan = client.plan_incremental()
+    # Changed after planning, so the download fails its hash check
+    (tmp_path / "remote" / "chats" / "a.jsonl").write_bytes(b"edited")
+    assert not client.sync_incremental(plan=plan)
+
+    assert (local / "settings.json").read_bytes() == b"{}"
+    assert not (local / "chats" / "a.jsonl").exists()
+    assert client._load_cursor() is None
+    # Only what was applied becomes the bidirectional base
+    assert client._load_base() == {'settings.json': hash_file(str(local / "settings.json"))}
+
+
+def pull(client, method):
+    requested = []
+    get = client.session.get
+    client.session.get = lambda url, **kwargs: requested.append((url, kwargs.get('params'))) or get(url, **kwargs)
+    if method == "zip":
+        assert client.sync_full_zip(backup=False)
+    else:
+        assert client.sync_incremental()
+    client.session.get = get
+    # A pull never fetches the hashed manifest just for the base
+    assert not [params for url, params in requested
+                if url.endswith('/manifest') and params and params.get('hash')]
+
+
+@pytest.fixture
+def pulled(remote, local, tmp_path, request):
+    (tmp_path / "remote" / "chats").mkdir()
+    (tmp_path / "remote" / "chats" / "a.jsonl").write_bytes(b"v1")
+    (tmp_path / "remote" / "settings.json").write_bytes(b"{}")
+    remote.index.refresh(full=True, force=True)
+    remote.allow_upload = True
+    client = make_client(remote, local, tmp_path)
+    pull(client, request.param)
+    return client
+
+
+@pytest.mark.parametrize("pulled", ["incremental", "zip"], indirect=True)
+def test_remote_edit_after_pull_is_downloaded(pulled, remote, local, tmp_path):
+    (tmp_path / "remote" / "chats" / "a.jsonl").write_bytes(b"edited on the server")
+    remote.index.refresh(full=True, force=True)
+
+    assert pulled.sync_bidirectional()
+
+    assert (local / "chats" / "a.jsonl").read_bytes() == b"edited on the server"
+    assert sorted(os.listdir(local / "chats")) == ["a.jsonl"]
+
+
+@pytest.mark.parametrize("pulled", ["incremental"], indirect=True)
+def test_local_edit_after_pull_is_uploaded(pulled, remote, local, tmp_path):
+    (local / "chats" / "a.jsonl").write_bytes(b"edited locally")
+
+    assert pulled.sync_bidirectional()
+
+    assert (tmp_path / "remote" / "chats" / "a.jsonl").read_bytes() == b"edited locally"
+    assert sorted(os.listdir(tmp_path / "remote" / "chats")) == ["a.jsonl"]
+
+
+@pytest.mark.parametrize("pulled", ["zip"], indirect=True)
+def test_local_edit_after_zip_pull_keeps_both_versions(pulled, remote, local, tmp_path):
+    # ZIP pulls carry no hashes, so an edited file has no known base
+    (local / "chats" / "a.jsonl").write_bytes(b"edited locally")
+
+    assert pulled.sync_bidirectional()
+
+    names = sorted(os.listdir(tmp_path / "remote" / "chats"))
+    assert len(names) == 2
+    contents = {(tmp_path / "remote" / "chats" / name).read_bytes() for name in names}
+    assert contents == {b"v1", b"edited locally"}
+
+
+def record_requests(client, cut_after=None):
+    """Record the headers of each download; drop the first connection after cut_after bytes"""
+    sent = []
+    real_get = client.session.get
+
+    def get(url, **kwargs):
+        sent.append(dict(kwargs.get('headers') or {}))
+        response = real_get(url, **kwargs)
+        if cut_after is not None and len(sent) == 1:
+            def iter_content(chunk_size=1):
+                yield response.raw.read(cut_after)
+                raise requests.exceptions.ChunkedEncodingError("connection cut")
+            response.iter_content = iter_content
+        return response
+
+    client.session.get = get
+    return sent
+
+
+@pytest.mark.parametrize("same_run", [True, False])
+def test_cut_download_resumes_from_part_file(remote, local, tmp_path, same_run):
+    data = os.urandom(5000)
+    (tmp_path / "remote" / "big.bin").write_bytes(data)
+    remote.index.refresh(full=True, force=True)
+    part_path = str(tmp_path / "big.bin.part")
+
+    client = make_client(remote, local, tmp_path)
+    client.retry_backoff = 0
+    if same_run:
+        client.max_retries = 1
+        sent = record_requests(client, cut_after=1000)
+        client._download_resumable('file', {'path': 'big.bin'}, part_path)
+    else:
+        record_requests(client, cut_after=1000)
+        with pytest.raises(Exception):
+            client._download_resumable('file', {'path': 'big.bin'}, part_path)
+        assert os.path.getsize(part_path) == 1000
+        # A later run picks up the partial file and its ETag from the state database
+        client = make_client(remote, local, tmp_path)
+        sent = record_requests(client)
+        client._download_resumable('file', {'path': 'big.bin'}, part_path)
+
+    resumed = sent[-1]
+    assert resumed['Range'] == 'bytes=1000-'
+    assert resumed['If-Range']
+    with open(part_path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_changed_file_restarts_the_download(remote, local, tmp_path):
+    (tmp_path / "remote" / "big.bin").write_bytes(os.urandom(5000))
+    remote.index.refresh(full=True, force=True)
+    part_path = str(tmp_path / "big.bin.part")
+    client = make_client(remote, local, tmp_path)
+    sent = record_requests(client, cut_after=1000)
+    with pytest.raises(Exception):
+        client._download_resumable('file', {'path': 'big.bin'}, part_path)
+
+    data = os.urandom(6000)
+    (tmp_path / "remote" / "big.bin").write_bytes(data)
+    remote.index.refresh(full=True, force=True)
+    client._download_resumable('file', {'path': 'big.bin'}, part_path)
+
+    # The stale ETag made the server send the whole new file
+    assert sent[1]['Range'] == 'bytes=1000-'
+    with open(part_path, 'rb') as f:
+        assert f.read() == data
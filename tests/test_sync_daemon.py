@@ -0,0 +1,137 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import sync_daemon
+import sync_server
+from sync_daemon import SyncDaemon, daemon_pid, send_command, start_daemon, stop_daemon
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = predicate()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise AssertionError("timed out")
+
+
+def status_of(run_dir):
+    return send_command(str(run_dir), 'status', timeout=2) or {}
+
+
+@pytest.fixture
+def slow_index(monkeypatch):
+    """Block the first index scan until the returned event is set"""
+    gate = threading.Event()
+    refresh = sync_server.ManifestIndex.refresh
+
+    def blocked_refresh(self, *args, **kwargs):
+        gate.wait()
+        return refresh(self, *args, **kwargs)
+
+    monkeypatch.setattr(sync_server.ManifestIndex, 'refresh', blocked_refresh)
+    yield gate
+    gate.set()
+
+
+@pytest.fixture
+def in_process_daemon(tmp_path, monkeypatch):
+    """SyncDaemon.run in a thread of the test process"""
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "settings.json").write_bytes(b'{}')
+    monkeypatch.chdir(tmp_path)
+    # Signal handlers can only be installed from the main thread
+    monkeypatch.setattr(sync_daemon.signal, 'signal', lambda signum, handler: None)
+    daemon = SyncDaemon(str(data), free_port(), host='127.0.0.1', run_dir=str(tmp_path))
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(code=daemon.run()), daemon=True)
+    thread.start()
+    yield daemon, thread, result
+    daemon.stopping.set()
+    thread.join(timeout=10)
+
+
+def test_status_answers_while_indexing(tmp_path, slow_index, in_process_daemon):
+    daemon, thread, result = in_process_daemon
+
+    status = wait_for(lambda: status_of(tmp_path))
+    assert status['success'] and status['indexing'] and not status['running']
+    assert status['port'] == daemon.port
+    assert not send_command(str(tmp_path), 'reload')['success']
+
+    slow_index.set()
+    wait_for(lambda: status_of(tmp_path).get('running'))
+    status = status_of(tmp_path)
+    assert not status['indexing']
+    assert status['file_count'] == 1
+
+
+def test_stop_while_indexing_exits_without_waiting_for_the_scan(tmp_path, slow_index,
+                                                                in_process_daemon):
+    daemon, thread, result = in_process_daemon
+    wait_for(lambda: status_of(tmp_path))
+
+    assert send_command(str(tmp_path), 'stop')['success']
+    thread.join(timeout=5)
+
+    assert result == {'code': 0}
+    assert not os.path.exists(tmp_path / sync_daemon.SOCKET_FILE)
+    assert not os.path.exists(tmp_path / sync_daemon.PID_FILE)
+
+
+def test_port_in_use_fails_before_indexing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with socket.socket() as busy:
+        busy.bind(('127.0.0.1', 0))
+        busy.listen()
+        daemon = SyncDaemon(str(tmp_path), busy.getsockname()[1], host='127.0.0.1',
+                            run_dir=str(tmp_path))
+        assert daemon.run() == 1
+    assert not os.path.exists(tmp_path / "sync_index.db")
+
+
+def test_start_reload_and_stop_detached_daemon(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "settings.json").write_bytes(b'{}')
+    port = free_port()
+
+    status = start_daemon(str(data), port, host='127.0.0.1', run_dir=str(tmp_path))
+    try:
+        assert status is not None
+        pid = status['pid']
+        assert daemon_pid(str(tmp_path)) == pid
+        wait_for(lambda: status_of(tmp_path).get('running'))
+        status = status_of(tmp_path)
+        assert status['file_count'] == 1 and not status['allow_upload']
+        assert requests.get(f"http://127.0.0.1:{port}/health", timeout=5).json()['status'] == 'healthy'
+        # A second start finds the running daemon instead of launching another
+        assert start_daemon(str(data), port, host='127.0.0.1', run_dir=str(tmp_path))['pid'] == pid
+
+        (tmp_path / "config.json").write_text(json.dumps({'sync': {'allow_upload': True}}))
+        (data / "new.json").write_bytes(b'{}')
+        status = send_command(str(tmp_path), 'reload')
+        assert status['allow_upload'] and status['file_count'] == 2
+    finally:
+        assert stop_daemon(str(tmp_path))
+
+    assert daemon_pid(str(tmp_path)) is None
+    assert send_command(str(tmp_path), 'status') is None
+    assert not os.path.exists(tmp_path / sync_daemon.PID_FILE)
+    with socket.socket() as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('127.0.0.1', port))
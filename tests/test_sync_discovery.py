@@ -0,0 +1,96 @@
+import json
+import socket
+import threading
+
+import pytest
+
+from sync_discovery import DISCOVERY_QUERY, SERVICE_NAME, DiscoveryResponder, query_broadcast
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def answer_with():
+    """UDP responder on loopback that sends the given raw replies to each query"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # Broadcasts only reach sockets bound to the wildcard address
+    sock.bind(('', 0))
+    sock.settimeout(0.2)
+    state = {'replies': [], 'running': True}
+
+    def run():
+        while state['running']:
+            try:
+                data, sender = sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            if data == DISCOVERY_QUERY:
+                for reply in state['replies']:
+                    sock.sendto(reply, sender)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    def set_replies(*replies):
+        state['replies'] = list(replies)
+        return sock.getsockname()[1]
+
+    yield set_replies
+    state['running'] = False
+    thread.join()
+    sock.close()
+
+
+def reply(**fields):
+    return json.dumps(dict({'service': SERVICE_NAME}, **fields)).encode('utf-8')
+
+
+def test_malformed_replies_are_skipped(answer_with):
+    port = answer_with(
+        b'not json',
+        b'[1, 2, 3]',
+        b'"text"',
+        reply(),
+        reply(port='abc'),
+        reply(port=None),
+        reply(port=0),
+        reply(port=70000),
+        json.dumps({'service': 'other', 'port': 8000}).encode('utf-8'),
+        reply(port=9999, name='phone'),
+        reply(port='8888', name=['bad']),
+    )
+
+    servers = query_broadcast(timeout=0.5, discovery_port=port, address='127.0.0.1')
+
+    # The broadcast may arrive on several interfaces, so ignore the host
+    assert {(url.rsplit(':', 1)[1], name) for url, name in servers.items()} == \
+        {('9999', 'phone'), ('8888', None)}
+
+
+def test_responder_answers_queries():
+    discovery_port = free_udp_port()
+    responder = DiscoveryResponder(12345, name='desk', discovery_port=discovery_port)
+    assert responder.start()
+    try:
+        servers = query_broadcast(timeout=0.5, discovery_port=discovery_port, address='127.0.0.1')
+    finally:
+        responder.stop()
+
+    assert ('12345', 'desk') in {(url.rsplit(':', 1)[1], name) for url, name in servers.items()}
+
+
+def test_responder_ignores_queries_from_other_networks():
+    discovery_port = free_udp_port()
+    responder = DiscoveryResponder(12345, name='desk', discovery_port=discovery_port,
+                                   host='198.51.100.10')
+    assert responder.start()
+    try:
+        servers = query_broadcast(timeout=0.5, discovery_port=discovery_port, address='127.0.0.1')
+    finally:
+        responder.stop()
+
+    assert servers == {}
@@ -0,0 +1,65 @@
+import http.client
+import socket
+import threading
+
+import pytest
+
+from sync_httpd import make_server
+
+
+def app(environ, start_response):
+    """Echo the client port, so tests can tell which connection served a request"""
+    body = f"{environ['REMOTE_PORT']} {environ['PATH_INFO']}".encode('utf-8')
+    if environ['PATH_INFO'] == '/stream':
+        # No Content-Length: sent chunked on HTTP/1.1
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return iter([body[:3], body[3:]])
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+@pytest.fixture
+def httpd():
+    server = make_server('127.0.0.1', 0, app, max_workers=2, keepalive_timeout=5)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.close(grace=1)
+    thread.join(timeout=5)
+
+
+def get(conn, path, method='GET', body=None):
+    conn.request(method, path, body=body)
+    response = conn.getresponse()
+    return response.read().decode('utf-8').split(' ')
+
+
+def test_requests_reuse_one_connection(httpd):
+    conn = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1], timeout=5)
+    try:
+        ports = set()
+        for method, path, body in [('GET', '/a', None), ('GET', '/stream', None),
+                                   ('POST', '/unread-body', b'x' * 10000), ('GET', '/b', None)]:
+            port, echoed = get(conn, path, method, body)
+            assert echoed == path
+            ports.add(port)
+    finally:
+        conn.close()
+
+    assert len(ports) == 1
+
+
+def test_close_drops_idle_connections_and_frees_the_port(httpd):
+    port = httpd.server_address[1]
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    get(conn, '/a')
+
+    httpd.close(grace=1)
+
+    # The idle keep-alive connection was shut down by the server
+    assert conn.sock.recv(1) == b''
+    conn.close()
+    with socket.socket() as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('127.0.0.1', port))
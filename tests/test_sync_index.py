@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from sync_index import ManifestIndex
+
+
+def write(path, data, age=60):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(data)
+    # Old enough for the hash cache to keep its hash
+    when = time.time() - age
+    os.utime(path, (when, when))
+
+
+@pytest.fixture
+def index(tmp_path):
+    data = tmp_path / "data"
+    write(str(data / "chats" / "a.jsonl"), "a")
+    index = ManifestIndex(str(data), str(tmp_path / "index.db"), min_interval=0)
+    index.refresh(force=True)
+    yield index
+    index.close()
+
+
+def test_changes_since_reports_add_modify_delete(index):
+    start = index.generation
+    write(os.path.join(index.data_path, "chats", "a.jsonl"), "aa")
+    write(os.path.join(index.data_path, "b.json"), "b")
+    index.refresh(full=True, force=True)
+
+    result = index.changes_since(start, index.epoch)
+    ops = {entry['path']: entry['op'] for entry in result['changes']}
+    assert not result['full_resync']
+    assert ops == {'chats/a.jsonl': 'modify', 'b.json': 'add'}
+
+    os.remove(os.path.join(index.data_path, "b.json"))
+    index.refresh(force=True)
+    result = index.changes_since(start, index.epoch)
+    # Clients delete it only if they picked it up in between
+    ops = {entry['path']: entry['op'] for entry in result['changes']}
+    assert ops == {'chats/a.jsonl': 'modify', 'b.json': 'delete'}
+
+
+def test_changes_since_after_epoch_reset(tmp_path, index):
+    old_epoch, generation = index.epoch, index.generation
+    index.close()
+
+    # Indexing another directory with the same database starts a new epoch
+    other = tmp_path / "other"
+    write(str(other / "c.txt"), "c")
+    index = ManifestIndex(str(other), str(tmp_path / "index.db"), min_interval=0)
+    try:
+        index.refresh(force=True)
+        assert index.epoch != old_epoch
+        assert index.changes_since(generation, old_epoch)['full_resync']
+        assert not index.changes_since(0, index.epoch)['full_resync']
+    finally:
+        index.close()
+
+
+def test_future_generation_needs_full_resync(index):
+    assert index.changes_since(index.generation + 5, index.epoch)['full_resync']
+
+
+def test_hashed_change_queries_do_not_lock_refresh(index):
+    for conn in (index.conn, index.hash_cache.conn):
+        # Fail fast instead of after sqlite's default 5 s busy wait
+        conn.execute("PRAGMA busy_timeout = 100")
+
+    for i in range(3):
+        start = index.generation
+        write(os.path.join(index.data_path, f"f{i}.txt"), str(i))
+        index.refresh(force=True)
+        result = index.changes_since(start, index.epoch, with_hash=True)
+        assert [entry['path'] for entry in result['changes']] == [f"f{i}.txt"]
+        assert result['changes'][0]['hash']
+
+    write(os.path.join(index.data_path, "late.txt"), "late")
+    try:
+        index.refresh(force=True)
+    except sqlite3.OperationalError as e:
+        pytest.fail(f"refresh blocked by the hash cache: {e}")
+    assert 'late.txt' in {entry['path'] for entry in index.manifest()}
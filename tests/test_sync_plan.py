@@ -0,0 +1,102 @@
+from datetime import datetime
+
+from sync_plan import conflict_path, diff_three_way
+
+
+def entry(path, digest, mtime=100.0, size=10):
+    return {'path': path, 'hash': digest, 'mtime': mtime, 'size': size}
+
+
+def plan_for(local, remote, base):
+    return diff_three_way(local, remote, base, lambda path, loser: f"{path}.{loser}")
+
+
+def test_one_sided_changes_are_copied_across():
+    base = {'up.json': 'a', 'down.json': 'b', 'gone.json': 'c', 'kept.json': 'd'}
+    local = [entry('up.json', 'a2'), entry('down.json', 'b'), entry('kept.json', 'd'),
+             entry('new.json', 'n')]
+    remote = [entry('up.json', 'a'), entry('down.json', 'b2'), entry('kept.json', 'd')]
+
+    plan = plan_for(local, remote, base)
+
+    assert [(e['path'], h) for e, h in plan.upload] == [('new.json', None), ('up.json', 'a')]
+    assert [e['path'] for e in plan.download] == ['down.json']
+    assert plan.delete_local == []
+    assert plan.delete_remote == []
+    # Deleted on both sides since the last sync
+    assert plan.in_sync == {'gone.json': None, 'kept.json': 'd'}
+    assert plan.conflicts == []
+
+
+def test_deletions_follow_the_other_side():
+    base = {'local-gone.json': 'a', 'remote-gone.json': 'b'}
+    local = [entry('remote-gone.json', 'b')]
+    remote = [entry('local-gone.json', 'a')]
+
+    plan = plan_for(local, remote, base)
+
+    assert plan.delete_remote == [('local-gone.json', 'a')]
+    assert plan.delete_local == [('remote-gone.json', 'b')]
+
+
+def test_delete_versus_modify_keeps_the_modification():
+    base = {'edited-remotely.json': 'a', 'edited-locally.json': 'b'}
+    local = [entry('edited-locally.json', 'b2')]
+    remote = [entry('edited-remotely.json', 'a2')]
+
+    plan = plan_for(local, remote, base)
+
+    assert [e['path'] for e in plan.download] == ['edited-remotely.json']
+    assert [(e['path'], h) for e, h in plan.upload] == [('edited-locally.json', None)]
+    assert plan.delete_local == []
+    assert plan.delete_remote == []
+
+
+def test_both_modified_newer_wins_with_conflict_copy():
+    base = {'chat.jsonl': 'a'}
+    local = [entry('chat.jsonl', 'local', mtime=200.0)]
+    remote = [entry('chat.jsonl', 'remote', mtime=100.0)]
+
+    plan = plan_for(local, remote, base)
+
+    assert len(plan.conflicts) == 1
+    path, winner, copy_path, local_entry, remote_entry = plan.conflicts[0]
+    assert (path, winner, copy_path) == ('chat.jsonl', 'local', 'chat.jsonl.remote')
+    assert local_entry['hash'] == 'local'
+    assert remote_entry['hash'] == 'remote'
+    assert plan.upload == [] and plan.download == []
+
+
+def test_empty_base_keeps_both_versions_of_diverged_files():
+    local = [entry('phone.jsonl', 'l1', mtime=200.0), entry('pc.jsonl', 'l2', mtime=100.0),
+             entry('same.json', 's'), entry('local-only.json', 'n')]
+    remote = [entry('phone.jsonl', 'r1', mtime=100.0), entry('pc.jsonl', 'r2', mtime=200.0),
+              entry('same.json', 's'), entry('remote-only.json', 'm')]
+
+    plan = plan_for(local, remote, {})
+
+    assert [(path, winner, copy_path) for path, winner, copy_path, _, _ in plan.conflicts] == [
+        ('pc.jsonl', 'remote', 'pc.jsonl.local'),
+        ('phone.jsonl', 'local', 'phone.jsonl.remote'),
+    ]
+    # Files on one side only are copied across, nothing is overwritten
+    assert [(e['path'], h) for e, h in plan.upload] == [('local-only.json', None)]
+    assert [e['path'] for e in plan.download] == ['remote-only.json']
+    assert plan.in_sync == {'same.json': 's'}
+
+
+def test_conflict_path_keeps_extension():
+    when = datetime(2024, 1, 2, 3, 4, 5)
+
+    assert conflict_path('chats/a.jsonl', 'phone', when) == \
+        'chats/a.sync-conflict-20240102-030405-phone.jsonl'
+    assert conflict_path('settings', 'pc', when) == 'settings.sync-conflict-20240102-030405-pc'
+    assert conflict_path('.hidden', 'pc', when) == '.hidden.sync-conflict-20240102-030405-pc'
+
+
+def test_conflict_path_sanitizes_device_name():
+    when = datetime(2024, 1, 2, 3, 4, 5)
+
+    assert conflict_path('a.json', 'my phone/1', when) == \
+        'a.sync-conflict-20240102-030405-my_phone_1.json'
+    assert conflict_path('a.json', '', when) == 'a.sync-conflict-20240102-030405-device.json'
@@ -0,0 +1,135 @@
+import io
+import socket
+import threading
+import time
+import zipfile
+
+import pytest
+
+from sync_server import SyncServer
+
+
+@pytest.fixture
+def server(tmp_path):
+    data = tmp_path / "data"
+    (data / "chats").mkdir(parents=True)
+    (data / "settings.json").write_bytes(b'{"theme": "dark"}')
+    (data / "chats" / "a.jsonl").write_bytes(b"0123456789" * 100)
+    (tmp_path / "secret.txt").write_bytes(b"outside")
+
+    server = SyncServer(data_path=str(data), index_path=str(tmp_path / "index.db"))
+    yield server
+    server.watcher.stop()
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.mark.parametrize("path", [
+    "../secret.txt",
+    "../../etc/passwd",
+    "/etc/passwd",
+    "chats/../../secret.txt",
+    "chats",
+    "missing.json",
+])
+def test_file_outside_data_path_is_not_found(client, path):
+    response = client.get("/file", query_string={"path": path})
+
+    assert response.status_code == 404
+
+
+def test_file_inside_data_path(client):
+    response = client.get("/file", query_string={"path": "/settings.json"})
+
+    assert response.status_code == 200
+    assert response.data == b'{"theme": "dark"}'
+
+
+def test_file_range_and_if_range(client):
+    full = client.get("/file", query_string={"path": "chats/a.jsonl"})
+    etag = full.headers["ETag"]
+
+    partial = client.get("/file", query_string={"path": "chats/a.jsonl"},
+                         headers={"Range": "bytes=995-", "If-Range": etag})
+    assert partial.status_code == 206
+    assert partial.headers["Content-Range"] == "bytes 995-999/1000"
+    assert partial.data == b"56789"
+
+    stale = client.get("/file", query_string={"path": "chats/a.jsonl"},
+                       headers={"Range": "bytes=995-", "If-Range": '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == full.data
+
+    beyond = client.get("/file", query_string={"path": "chats/a.jsonl"},
+                        headers={"Range": "bytes=5000-"})
+    assert beyond.status_code == 416
+
+
+@pytest.mark.parametrize("level", [0, 6])
+def test_zip_range_and_if_range(client, level):
+    full = client.get("/zip", query_string={"level": level})
+    assert full.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(full.data)) as archive:
+        assert sorted(archive.namelist()) == ["chats/a.jsonl", "settings.json"]
+        assert archive.read("chats/a.jsonl") == b"0123456789" * 100
+    etag = full.headers["ETag"]
+
+    partial = client.get("/zip", query_string={"level": level},
+                         headers={"Range": "bytes=100-", "If-Range": etag})
+    assert partial.status_code == 206
+    assert partial.headers["Content-Range"] == f"bytes 100-{len(full.data) - 1}/{len(full.data)}"
+    assert partial.data == full.data[100:]
+
+    stale = client.get("/zip", query_string={"level": level},
+                       headers={"Range": "bytes=100-", "If-Range": '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == full.data
+
+
+def test_zip_range_before_full_download(server, client):
+    # Without a cached archive the range is served from the computed layout
+    partial = client.get("/zip", headers={"Range": "bytes=0-21"})
+    assert partial.status_code == 206
+    assert partial.data[:4] == b"PK\x03\x04"
+    assert len(partial.data) == 22
+
+
+def test_events_times_out_without_changes(client):
+    generation = client.get("/events").get_json()['generation']
+
+    started = time.monotonic()
+    response = client.get("/events", query_string={"since": generation, "timeout": 0.5})
+
+    assert time.monotonic() - started >= 0.5
+    assert response.get_json()['changes'] == []
+    assert response.get_json()['generation'] == generation
+
+
+def test_events_wakes_up_on_a_change(tmp_path, client):
+    generation = client.get("/events").get_json()['generation']
+    writer = threading.Timer(0.3, (tmp_path / "data" / "chats" / "b.jsonl").write_bytes, [b"{}"])
+    writer.start()
+
+    started = time.monotonic()
+    response = client.get("/events", query_string={"since": generation, "timeout": 30})
+    writer.join()
+
+    # Well before the timeout: inotify and the no-watcher poll both react in seconds
+    assert time.monotonic() - started < 15
+    changes = response.get_json()['changes']
+    assert [(change['path'], change['op']) for change in changes] == [('chats/b.jsonl', 'add')]
+
+
+def test_loopback_server_does_not_answer_discovery(server):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        server.port = s.getsockname()[1]
+    server.host = '127.0.0.1'
+    assert server.start(block=False)
+    try:
+        assert server.responder is None
+    finally:
+        server.stop()
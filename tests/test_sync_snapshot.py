@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from sync_snapshot import SnapshotStore
+
+
+@pytest.fixture
+def data(tmp_path):
+    root = tmp_path / "data"
+    (root / "chats").mkdir(parents=True)
+    (root / "settings.json").write_bytes(b'{"theme": "dark"}')
+    (root / "chats" / "a.jsonl").write_bytes(b'{"mes": "hello"}\n')
+    (root / "chats" / "b.jsonl").write_bytes(b'{"mes": "bye"}\n')
+    return root
+
+
+def test_unchanged_files_are_linked_to_the_previous_snapshot(tmp_path, data):
+    store = SnapshotStore(str(tmp_path / "backups"))
+    first, stats = store.create(str(data))
+    assert stats['linked'] == 0 and stats['copied'] == 3
+
+    chat = data / "chats" / "a.jsonl"
+    with open(chat, 'ab') as f:
+        f.write(b'{"mes": "again"}\n')
+    second, stats = store.create(str(data))
+
+    assert (stats['linked'], stats['copied']) == (2, 1)
+    assert stats['copied_bytes'] == os.path.getsize(chat)
+    assert os.path.samefile(os.path.join(first, "settings.json"),
+                            os.path.join(second, "settings.json"))
+    assert not os.path.samefile(os.path.join(first, "chats", "a.jsonl"),
+                                os.path.join(second, "chats", "a.jsonl"))
+    assert store.list_snapshots() == [first, second]
+
+
+def test_appending_to_live_data_leaves_snapshots_alone(tmp_path, data):
+    store = SnapshotStore(str(tmp_path / "backups"))
+    snapshot, _ = store.create(str(data))
+    chat = data / "chats" / "a.jsonl"
+
+    with open(chat, 'ab') as f:
+        f.write(b'{"mes": "again"}\n')
+
+    with open(os.path.join(snapshot, "chats", "a.jsonl"), 'rb') as f:
+        assert f.read() == b'{"mes": "hello"}\n'
+
+
+def test_restore_copies_back_and_removes_new_files(tmp_path, data):
+    store = SnapshotStore(str(tmp_path / "backups"))
+    snapshot, _ = store.create(str(data))
+    (data / "settings.json").write_bytes(b'{"theme": "light"}')
+    (data / "chats" / "b.jsonl").unlink()
+    (data / "new").mkdir()
+    (data / "new" / "c.jsonl").write_bytes(b'{}')
+
+    copied, removed = store.restore(snapshot, str(data))
+
+    assert (copied, removed) == (2, 1)
+    assert (data / "settings.json").read_bytes() == b'{"theme": "dark"}'
+    assert (data / "chats" / "b.jsonl").read_bytes() == b'{"mes": "bye"}\n'
+    assert not (data / "new").exists()
+    # Restored files are copies, so editing them can't change the snapshot
+    assert not os.path.samefile(data / "settings.json", os.path.join(snapshot, "settings.json"))
+
+
+def test_prune_keeps_newest_and_one_per_day(tmp_path):
+    backups = tmp_path / "backups"
+    stamps = ["20240101_080000", "20240101_200000", "20240102_090000", "20240103_090000",
+              "20240104_070000", "20240104_120000", "20240104_180000"]
+    for stamp in stamps:
+        (backups / f"default-user.backup.{stamp}").mkdir(parents=True)
+    store = SnapshotStore(str(backups), keep_last=2, keep_daily=3)
+
+    removed = store.prune()
+
+    kept = [os.path.basename(path)[len(store.prefix):] for path in store.list_snapshots()]
+    # The two newest, plus the newest of each of the last three days
+    assert kept == ["20240102_090000", "20240103_090000", "20240104_120000", "20240104_180000"]
+    assert len(removed) == 3
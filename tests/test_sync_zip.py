@@ -0,0 +1,135 @@
+import io
+import os
+import zipfile
+import zlib
+
+import pytest
+
+import sync_zipstream
+from sync_zipextract import ZipStreamError, extract_stream
+from sync_zipstream import iter_zip
+
+
+FILES = {
+    'settings.json': b'{"theme": "dark"}',
+    'chats/a.jsonl': b'{"mes": "hello"}\n' * 400,
+    'images/avatar.png': os.urandom(3000),
+    'empty.txt': b'',
+}
+
+
+def write_tree(root, files):
+    for name, data in files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def build_archive(root, level):
+    entries = [(str(root / name), name, None) for name in sorted(FILES)]
+    return list(iter_zip(entries, compress_level=level, chunk_size=1024))
+
+
+def read_tree(root):
+    return {name: (root / name).read_bytes() for name in FILES}
+
+
+@pytest.fixture
+def source(tmp_path):
+    root = tmp_path / "source"
+    write_tree(root, FILES)
+    return root
+
+
+@pytest.mark.parametrize("level", [0, 6])
+@pytest.mark.parametrize("zip64", [False, True])
+def test_round_trip(tmp_path, source, monkeypatch, level, zip64):
+    if zip64:
+        # Zip64 records for everything over 1000 bytes, without gigabytes of test data
+        monkeypatch.setattr(sync_zipstream, 'ZIP64_LIMIT', 1000)
+    chunks = build_archive(source, level)
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert (archive.getinfo('chats/a.jsonl').extra[:2] == b'\x01\x00') == zip64
+
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    seen = []
+    count = extract_stream(chunks, str(dest),
+                           on_entry=lambda name, size, offset, reused: seen.append(name))
+
+    assert count == len(FILES)
+    assert sorted(seen) == sorted(FILES)
+    assert read_tree(dest) == FILES
+    assert not [name for name in os.listdir(dest / "chats") if name.startswith('.')]
+
+
+@pytest.mark.parametrize("level", [0, 6])
+@pytest.mark.parametrize("spool_limit", [16 * 1024 * 1024, 100])
+def test_identical_local_files_are_linked(tmp_path, source, level, spool_limit):
+    local = tmp_path / "local"
+    write_tree(local, dict(FILES, **{'settings.json': b'{"theme": "light"}'}))
+    chunks = build_archive(source, level)
+
+    def reuse(name, file_size, crc):
+        path = local / name
+        data = path.read_bytes()
+        if len(data) == file_size and zlib.crc32(data) == crc:
+            return str(path)
+        return None
+
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    reused = {}
+    extract_stream(chunks, str(dest), reuse=reuse, spool_limit=spool_limit,
+                   on_entry=lambda name, size, offset, was_reused: reused.update({name: was_reused}))
+
+    assert read_tree(dest) == FILES
+    assert reused == {name: name != 'settings.json' for name in FILES}
+    for name in FILES:
+        assert os.path.samefile(dest / name, local / name) == reused[name]
+
+
+def test_stored_entry_is_not_read_when_reused(tmp_path, source):
+    local = tmp_path / "local"
+    write_tree(local, FILES)
+    chunks = build_archive(source, 0)
+    archive = b''.join(chunks)
+    # Corrupt the stored PNG body: a reused entry must not even be checked
+    start = archive.index(FILES['images/avatar.png'])
+    archive = archive[:start] + b'\0' * 3000 + archive[start + 3000:]
+
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    extract_stream([archive], str(dest),
+                   reuse=lambda name, size, crc: str(local / name))
+
+    assert os.path.samefile(dest / 'images/avatar.png', local / 'images/avatar.png')
+
+
+def test_truncated_archive_is_rejected(tmp_path, source):
+    archive = b''.join(build_archive(source, 6))
+    dest = tmp_path / "dest"
+    dest.mkdir()
+
+    with pytest.raises(ZipStreamError):
+        extract_stream([archive[:len(archive) // 2]], str(dest))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+@pytest.mark.parametrize("level", [0, 6])
+def test_unreadable_files_are_skipped(tmp_path, source, workers, level):
+    (source / "now-a-folder.json").mkdir()
+    os.symlink("loop", source / "loop")
+    entries = [(str(source / name), name, None) for name in sorted(FILES)]
+    entries[1:1] = [
+        (str(source / "missing.json"), "missing.json", None),
+        (str(source / "now-a-folder.json"), "now-a-folder.json", None),
+        (str(source / "loop"), "loop", None),
+    ]
+
+    archive = b''.join(iter_zip(entries, compress_level=level, workers=workers))
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == sorted(FILES)
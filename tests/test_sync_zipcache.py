@@ -0,0 +1,149 @@
+import builtins
+import errno
+import os
+import threading
+from collections import namedtuple
+
+import sync_zipcache
+from sync_zipcache import ZipCache
+
+
+ARCHIVE = bytes(range(256)) * 40
+
+
+def chunked(start=0, size=1000):
+    data = ARCHIVE[start:]
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def leftovers(cache_dir):
+    return sorted(os.listdir(cache_dir))
+
+
+def test_concurrent_requests_share_one_build(tmp_path):
+    cache = ZipCache(str(tmp_path))
+    gate = threading.Event()
+    starts = []
+
+    def make_chunks(start):
+        starts.append(start)
+        gate.wait()
+        yield from chunked(start)
+
+    streams = [cache.stream('k', make_chunks) for _ in range(3)]
+    results = [None] * len(streams)
+
+    def read(i):
+        results[i] = b''.join(streams[i])
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(len(streams))]
+    for thread in threads:
+        thread.start()
+    gate.set()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    assert results == [ARCHIVE] * len(streams)
+    assert starts == [0]
+    with open(cache.get('k'), 'rb') as f:
+        assert f.read() == ARCHIVE
+    assert leftovers(tmp_path) == ['k.zip']
+
+
+def build(cache, key):
+    assert b''.join(cache.stream(key, chunked)) == ARCHIVE
+    # Readers finish only after the archive was published
+    return cache.get(key)
+
+
+def test_least_recently_used_archive_is_evicted(tmp_path):
+    cache = ZipCache(str(tmp_path), max_bytes=len(ARCHIVE) * 5 // 2)
+    os.utime(build(cache, 'a'), (1000, 1000))
+    os.utime(build(cache, 'b'), (2000, 2000))
+    # Serving 'a' again makes 'b' the least recently used
+    cache.get('a')
+
+    build(cache, 'c')
+
+    assert leftovers(tmp_path) == ['a.zip', 'c.zip']
+    assert cache.get('b') is None
+
+
+def test_retain_removes_stale_fingerprints(tmp_path):
+    cache = ZipCache(str(tmp_path))
+    build(cache, 'old')
+    build(cache, 'new')
+
+    cache.retain(lambda key: key == 'new')
+
+    assert leftovers(tmp_path) == ['new.zip']
+
+
+def test_over_cap_archive_is_streamed_without_caching(tmp_path):
+    cache = ZipCache(str(tmp_path), max_bytes=1000)
+    starts = []
+
+    def make_chunks(start):
+        starts.append(start)
+        return chunked(start)
+
+    assert b''.join(cache.stream('k', make_chunks, size_hint=len(ARCHIVE))) == ARCHIVE
+    assert starts == [0]
+    assert leftovers(tmp_path) == []
+
+
+def test_archive_outgrowing_the_cap_is_abandoned_but_completed(tmp_path):
+    # No size hint: the cap is only noticed while writing
+    cache = ZipCache(str(tmp_path), max_bytes=2500)
+
+    assert b''.join(cache.stream('k', chunked)) == ARCHIVE
+    assert cache.get('k') is None
+    assert leftovers(tmp_path) == []
+
+
+def test_low_disk_space_skips_the_cache(tmp_path, monkeypatch):
+    usage = namedtuple('usage', 'total used free')
+    monkeypatch.setattr(sync_zipcache.shutil, 'disk_usage',
+                        lambda path: usage(10 ** 9, 10 ** 9 - 5000, 5000))
+    cache = ZipCache(str(tmp_path), min_free_bytes=1000)
+
+    assert b''.join(cache.stream('k', chunked, size_hint=len(ARCHIVE))) == ARCHIVE
+    assert leftovers(tmp_path) == []
+
+
+def test_disk_full_while_writing_keeps_streaming(tmp_path, monkeypatch):
+    real_open = builtins.open
+
+    class FullDisk:
+        def __init__(self, f):
+            self.f = f
+
+        def write(self, data):
+            # Half of the third chunk fits, then the disk is full
+            if self.f.tell() + len(data) > 2500:
+                self.f.write(data[:2500 - self.f.tell()])
+                self.f.flush()
+                raise OSError(errno.ENOSPC, "No space left on device")
+            return self.f.write(data)
+
+        def __getattr__(self, name):
+            return getattr(self.f, name)
+
+    def fake_open(path, mode='r', *args, **kwargs):
+        f = real_open(path, mode, *args, **kwargs)
+        return FullDisk(f) if 'w' in mode else f
+
+    monkeypatch.setattr(sync_zipcache, 'open', fake_open, raising=False)
+    cache = ZipCache(str(tmp_path))
+    starts = []
+
+    def make_chunks(start):
+        starts.append(start)
+        return chunked(start)
+
+    assert b''.join(cache.stream('k', make_chunks)) == ARCHIVE
+    # The reader picked up exactly where the partial file ended
+    assert starts == [0, 2500]
+    assert cache.get('k') is None
+    assert leftovers(tmp_path) == []